@@ -1,8 +1,70 @@
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+import asyncio
+import ssl
+from typing import Optional
+
+import certifi
+from aiogram import Bot, __version__
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiohttp import ClientSession, FormData, TCPConnector
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
 from config import BOT_TOKEN
+from keyboards.factory import detach_keyboard
+
+# Пул соединений с Bot API. Все запросы идут на один хост, поэтому
+# соединения держатся открытыми между всплесками отправок, а адрес
+# api.telegram.org кэшируется, чтобы не ходить в DNS на каждое соединение
+POOL_LIMIT = 64
+KEEPALIVE_TIMEOUT = 75
+DNS_CACHE_TTL = 600
+
+
+class BotSession(AiohttpSession):
+    """Сессия Bot API с настроенным пулом соединений и готовыми клавиатурами.
+
+    Сессию aiohttp создает и закрывает сам класс, поэтому параметры
+    TCPConnector задаются явно, без внутренних полей AiohttpSession.
+    Прокси не поддерживается.
+    """
+
+    def __init__(self, limit: int = POOL_LIMIT, **kwargs):
+        super().__init__(**kwargs)
+        self.limit = limit
+        self._client: Optional[ClientSession] = None
+
+    async def create_session(self) -> ClientSession:
+        """Общая сессия aiohttp; создается при первом запросе"""
+        if self._client is None or self._client.closed:
+            self._client = ClientSession(
+                connector=TCPConnector(
+                    ssl=ssl.create_default_context(cafile=certifi.where()),
+                    limit=self.limit,
+                    limit_per_host=self.limit,
+                    keepalive_timeout=KEEPALIVE_TIMEOUT,
+                    use_dns_cache=True,
+                    ttl_dns_cache=DNS_CACHE_TTL,
+                ),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{__version__}"},
+            )
+        return self._client
+
+    async def close(self):
+        """Закрытие сессии aiohttp"""
+        if self._client is not None and not self._client.closed:
+            await self._client.close()
+            # Как в AiohttpSession: SSL-соединениям нужно время на закрытие
+            await asyncio.sleep(0.25)
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod) -> FormData:
+        # Клавиатуры из keyboards.factory уже сериализованы
+        method, keyboard = detach_keyboard(method)
+        form = super().build_form_data(bot, method)
+        if keyboard is not None:
+            form.add_field("reply_markup", keyboard)
+        return form
+
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+def create_bot(token: str = BOT_TOKEN) -> Bot:
+    """Единственный бот процесса; обработчики получают его через DI aiogram"""
+    return Bot(token=token, session=BotSession())
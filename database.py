@@ -1,293 +1,197 @@
-import aiosqlite
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Iterable, Optional, Sequence, Tuple
+from utils.batch_writer import BatchWriter, utc_timestamp
+from utils.catalog_import import ImportResult, normalize_product
+from utils.catalog_index import CatalogIndex
+from utils.chat_sessions import OPEN_STATUSES, ChatSessions
+from utils.contacts_directory import ContactsDirectory
+from utils.db_pool import ConnectionPool, SQLiteWriter
 from utils.logger import logger
-import os
+from utils.migrations import check_schema, migrate
+from utils.records import (
+    Chat, FSMState, LogEntry, Product, ServicePoint, User,
+    columns, fetch_all, fetch_one
+)
+from utils.ttl_cache import TTLCache
+
+
+# Прагмы режима WAL: читатели не блокируются фиксацией транзакций писателя
+WAL_WRITER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+)
+WAL_READER_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+)
+DEFAULT_PRAGMAS = ("PRAGMA foreign_keys = ON",)
+
+# Явные списки колонок в порядке полей записей из utils.records
+USER_COLUMNS = columns(User)
+SERVICE_POINT_COLUMNS = columns(ServicePoint)
+CHAT_COLUMNS = (
+    "c.id, c.user_id, c.manager_id, c.status, c.created_at, c.closed_at"
+)
+CHAT_WITH_USER_COLUMNS = (
+    f"{CHAT_COLUMNS}, u.first_name, u.last_name, u.username"
+)
+CHAT_BY_ID_SQL = f"""
+    SELECT {CHAT_WITH_USER_COLUMNS}
+    FROM chats c
+    LEFT JOIN users u ON c.user_id = u.user_id
+    WHERE c.id = ?
+"""
+
+# Вставка товара с обновлением ссылки по уникальному ключу idx_products_key
+PRODUCT_UPSERT_SQL = """
+    INSERT INTO products (category, vehicle_type, subtype, size, link)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (category, vehicle_type, IFNULL(subtype, ''), size)
+    DO UPDATE SET link = excluded.link
+"""
 
 
 class Database:
-    def __init__(self, db_path: str = "service_points.db"):
+    def __init__(
+        self,
+        db_path: str = "service_points.db",
+        pool_size: int = 4,
+        wal: bool = False,
+        message_flush_interval: float = 0.05,
+        user_cache_size: int = 10000,
+        user_cache_ttl: float = 300.0
+    ):
         self.db_path = db_path
+        self.wal = wal
+        # Чтение идет через пул соединений, запись - через одного писателя
+        self.writer = SQLiteWriter(
+            db_path, pragmas=WAL_WRITER_PRAGMAS if wal else DEFAULT_PRAGMAS
+        )
+        self.pool = ConnectionPool(
+            db_path,
+            size=pool_size,
+            pragmas=WAL_READER_PRAGMAS if wal else DEFAULT_PRAGMAS,
+            read_only=wal
+        )
+        self.user_logs = BatchWriter(
+            self.writer,
+            """
+            INSERT INTO user_logs (user_id, action, details, created_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            name="user_logs"
+        )
+        # Групповая фиксация сообщений: не позже message_flush_interval
+        # секунд после поступления
+        self.messages = BatchWriter(
+            self.writer,
+            """
+            INSERT INTO messages (chat_id, sender_id, message_text, created_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            batch_size=500,
+            flush_interval=message_flush_interval,
+            name="messages"
+        )
+        self.catalog = CatalogIndex()
+        self.contacts = ContactsDirectory()
+        # Профили пользователей: чтение через кэш, запись сквозь него
+        self.users: TTLCache[User] = TTLCache(user_cache_size, user_cache_ttl)
+        # Незакрытые чаты: по ним пересылаются сообщения без запросов к базе
+        self.sessions = ChatSessions()
 
     async def connect(self):
-        """Установка соединения с базой данных"""
+        """Открытие писателя и пула читателей"""
         try:
-            self.connection = await aiosqlite.connect(self.db_path)
-            await self.connection.execute("PRAGMA foreign_keys = ON")
-            await self.connection.commit()
+            # Писатель открывается первым: он создает файл и включает WAL
+            await self.writer.open()
+            await self.pool.open()
+            await self.user_logs.start()
+            await self.messages.start()
             logger.info("Успешное подключение к базе данных")
         except Exception as e:
             logger.error(f"Ошибка подключения к базе данных: {e}")
             raise
 
     async def disconnect(self):
-        """Закрытие соединения с базой данных"""
-        if hasattr(self, 'connection'):
-            await self.connection.close()
-            logger.info("Соединение с базой данных закрыто")
-
-    async def init_db(self):
-        """Инициализация базы данных"""
+        """Запись буферов, закрытие пула читателей и писателя"""
+        await self.messages.close()
+        await self.user_logs.close()
+        await self.pool.close()
+        await self.writer.close()
+        logger.info(f"Кэш пользователей: {self.users.stats()}")
+        logger.info("Соединение с базой данных закрыто")
+
+    async def set_trace_callback(self, callback: Optional[Callable]):
+        """Трассировка всех SQL-запросов (используется проверкой планов)"""
+        await self.writer.set_trace_callback(callback)
+        await self.pool.set_trace_callback(callback)
+
+    async def init_db(self, apply_migrations: bool = True):
+        """Инициализация базы данных: применение недостающих миграций.
+
+        С apply_migrations=False схема только проверяется: так запускаются
+        процессы-обработчики, базу которых заранее мигрировал супервизор.
+        """
         try:
-            await self.connect()
-            
-            # Проверяем существование старой таблицы
-            cursor = await self.connection.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND "
-                "name='service_points'"
-            )
-            table_exists = await cursor.fetchone()
-            await cursor.close()
-            
-            if table_exists:
-                # Создаем временную таблицу с новой структурой
-                await self.connection.execute("""
-                    CREATE TABLE IF NOT EXISTS service_points_new (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        city TEXT NOT NULL,
-                        address TEXT NOT NULL,
-                        phone_store TEXT,
-                        phone_service TEXT,
-                        work_schedule_weekdays TEXT,
-                        work_schedule_weekend TEXT,
-                        service_schedule_weekdays TEXT,
-                        service_schedule_weekend TEXT,
-                        service_manager_name TEXT,
-                        maps_2gis_link TEXT,
-                        google_maps_link TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        UNIQUE(city, address)
-                    )
-                """)
-                
-                # Переносим данные из старой таблицы в новую
-                await self.connection.execute("""
-                    INSERT INTO service_points_new (
-                        id, city, address, phone_store, phone_service,
-                        work_schedule_weekdays, work_schedule_weekend,
-                        service_schedule_weekdays, service_schedule_weekend,
-                        service_manager_name, maps_2gis_link, google_maps_link,
-                        created_at, updated_at
-                    )
-                    SELECT 
-                        id, city, address, phone_store, phone_service,
-                        work_schedule_weekdays, work_schedule_weekend,
-                        service_schedule_weekdays, service_schedule_weekend,
-                        service_manager_name, maps_2gis_link, google_maps_link,
-                        created_at, updated_at
-                    FROM service_points
-                """)
-
-                # Удаляем старую таблицу
-                await self.connection.execute("DROP TABLE service_points")
-
-                # Переименовываем новую таблицу
-                await self.connection.execute(
-                    "ALTER TABLE service_points_new RENAME TO service_points"
-                )
+            if apply_migrations:
+                version = await self.migrate()
             else:
-                # Создаем новую таблицу, если старая не существует
-                await self.connection.execute("""
-                    CREATE TABLE IF NOT EXISTS service_points (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        city TEXT NOT NULL,
-                        address TEXT NOT NULL,
-                        phone_store TEXT,
-                        phone_service TEXT,
-                        work_schedule_weekdays TEXT,
-                        work_schedule_weekend TEXT,
-                        service_schedule_weekdays TEXT,
-                        service_schedule_weekend TEXT,
-                        service_manager_name TEXT,
-                        maps_2gis_link TEXT,
-                        google_maps_link TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        UNIQUE(city, address)
-                    )
-                """)
-            
-            # Создаем таблицу для продуктов
-            await self.connection.execute("""
-                CREATE TABLE IF NOT EXISTS products (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    category TEXT NOT NULL,
-                    vehicle_type TEXT NOT NULL,
-                    subtype TEXT,
-                    size TEXT NOT NULL,
-                    link TEXT NOT NULL
-                )
-            """)
-            
-            # Создаем таблицу пользователей
-            await self.connection.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    first_name TEXT,
-                    last_name TEXT,
-                    username TEXT,
-                    phone_number TEXT,
-                    birth_date TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Создаем таблицу запросов на связь
-            await self.connection.execute("""
-                CREATE TABLE IF NOT EXISTS contact_requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    request_type TEXT NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            # Создаем таблицу чатов
-            await self.connection.execute("""
-                CREATE TABLE IF NOT EXISTS chats (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    manager_id INTEGER,
-                    status TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    closed_at TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            # Создаем таблицу оценок чатов
-            await self.connection.execute("""
-                CREATE TABLE IF NOT EXISTS chat_ratings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER,
-                    rating INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (chat_id) REFERENCES chats(id)
-                )
-            """)
-            
-            # Создаем таблицу сообщений
-            await self.connection.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER,
-                    sender_id INTEGER,
-                    message_text TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Создаем таблицу логов
-            await self.connection.execute("""
-                CREATE TABLE IF NOT EXISTS user_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    action TEXT,
-                    details TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            """)
-            
-            await self.connection.commit()
-            logger.info("База данных успешно инициализирована")
+                version = await self.writer.run(check_schema)
+            await self.reload()
+            logger.info(
+                f"База данных успешно инициализирована (схема v{version})"
+            )
         except Exception as e:
             logger.error(f"Ошибка при инициализации базы данных: {e}")
             raise
-        finally:
-            await self.disconnect()
 
-    async def get_all_cities(self) -> List[str]:
-        """Получение списка всех городов"""
-        try:
-            await self.connect()
-            cursor = await self.connection.execute(
-                "SELECT DISTINCT city FROM service_points"
+    async def migrate(self) -> int:
+        """Применение недостающих миграций, возвращает версию схемы"""
+        return await self.writer.run(migrate)
+
+    async def reload(self):
+        """Загрузка данных в память: каталог, контакты, открытые чаты"""
+        await self._load_catalog()
+        await self._load_contacts()
+        await self._load_sessions()
+
+    # Методы для работы с контактами: чтение идет из справочника в памяти
+    async def _load_contacts(self):
+        """Загрузка торговых точек в справочник в памяти"""
+        async with self.pool.acquire() as connection:
+            points = await fetch_all(
+                connection, ServicePoint,
+                f"SELECT {SERVICE_POINT_COLUMNS} FROM service_points"
             )
-            cities = [row[0] for row in await cursor.fetchall()]
-            await cursor.close()
-            return cities
-        except Exception as e:
-            logger.error(f"Ошибка при получении списка городов: {e}")
-            return []
-        finally:
-            await self.disconnect()
+        self.contacts.load(points)
+        logger.info(f"Справочник контактов загружен: {len(points)} точек")
+
+    async def get_all_cities(self) -> Sequence[str]:
+        """Получение списка всех городов"""
+        return self.contacts.cities()
 
     async def get_locations_by_city(
         self, city: str, contact_type: str
-    ) -> List[str]:
+    ) -> Sequence[str]:
         """Получение списка адресов в городе с учетом типа контакта"""
-        try:
-            await self.connect()
-            
-            if contact_type == "Магазин":
-                query = """
-                    SELECT DISTINCT address FROM service_points 
-                    WHERE city = ? AND phone_store IS NOT NULL 
-                    AND phone_store != ''
-                """
-            else:  # Сервис
-                query = """
-                    SELECT DISTINCT address FROM service_points 
-                    WHERE city = ? 
-                    AND (
-                        (phone_service IS NOT NULL AND phone_service != '') OR
-                        (service_schedule_weekdays IS NOT NULL AND service_schedule_weekdays != '') OR
-                        (service_schedule_weekend IS NOT NULL AND service_schedule_weekend != '') OR
-                        (service_manager_name IS NOT NULL AND service_manager_name != '')
-                    )
-                """
-            
-            cursor = await self.connection.execute(query, (city,))
-            locations = [row[0] for row in await cursor.fetchall()]
-            await cursor.close()
-            return locations
-        except Exception as e:
-            logger.error(
-                f"Ошибка при получении списка адресов в городе {city}: {e}"
-            )
-            return []
-        finally:
-            await self.disconnect()
+        return self.contacts.locations(city, contact_type)
 
     async def get_location_info(
         self, city: str, address: str
-    ) -> Optional[Dict]:
+    ) -> Optional[ServicePoint]:
         """Получение информации о торговой точке"""
-        try:
-            await self.connect()
-            cursor = await self.connection.execute(
-                """
-                SELECT * FROM service_points 
-                WHERE city = ? AND address = ?
-                """,
-                (city, address)
-            )
-            row = await cursor.fetchone()
-            await cursor.close()
-            
-            if row:
-                columns = [
-                    description[0] for description in cursor.description
-                ]
-                return dict(zip(columns, row))
-            return None
-        except Exception as e:
-            logger.error(
-                f"Ошибка при получении информации об адресе {address}: {e}"
-            )
-            return None
-        finally:
-            await self.disconnect()
+        return self.contacts.info(city, address)
 
     async def add_service_point(self, data: Dict) -> bool:
         """Добавление новой торговой точки"""
         try:
-            await self.connect()
-            await self.connection.execute(
+            await self.writer.execute(
                 """
                 INSERT OR REPLACE INTO service_points (
                     city, address, phone_store, phone_service,
@@ -308,173 +212,192 @@ class Database:
                     data.get('google_maps_link')
                 )
             )
-            await self.connection.commit()
+            # INSERT OR REPLACE меняет id и даты, поэтому точка перечитывается
+            async with self.pool.acquire() as connection:
+                point = await fetch_one(
+                    connection, ServicePoint,
+                    f"""
+                    SELECT {SERVICE_POINT_COLUMNS} FROM service_points
+                    WHERE city = ? AND address = ?
+                    """,
+                    (data['city'], data['address'])
+                )
+            self.contacts.upsert(point)
             return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении торговой точки: {e}")
             return False
-        finally:
-            await self.disconnect()
 
-    # Методы для работы с каталогом
-    async def get_vehicle_types(self, category: str) -> List[str]:
-        """Получение списка типов ТС для категории"""
-        try:
-            await self.connect()
-            cursor = await self.connection.execute(
-                """
-                SELECT DISTINCT vehicle_type FROM products 
-                WHERE category = ?
-                """,
-                (category,)
+    # Методы для работы с каталогом: чтение идет из индекса в памяти
+    async def reload_catalog(self):
+        """Перечитывание каталога из базы после импорта другим процессом"""
+        await self._load_catalog()
+
+    async def _load_catalog(self):
+        """Загрузка каталога в индекс в памяти"""
+        async with self.pool.acquire() as connection:
+            products = await fetch_all(
+                connection, Product,
+                f"SELECT {columns(Product)} FROM products ORDER BY id"
             )
-            types = [row[0] for row in await cursor.fetchall()]
-            await cursor.close()
-            return types
-        except Exception as e:
-            logger.error(f"Ошибка при получении типов ТС: {e}")
-            return []
-        finally:
-            await self.disconnect()
+        self.catalog.load(products)
+        logger.info(f"Каталог загружен в память: {len(products)} товаров")
 
-    async def get_subtypes(self, category: str, vehicle_type: str) -> List[str]:
+    async def get_vehicle_types(self, category: str) -> Sequence[str]:
+        """Получение списка типов ТС для категории"""
+        return self.catalog.vehicle_types(category)
+
+    async def get_subtypes(
+        self, category: str, vehicle_type: str
+    ) -> Sequence[str]:
         """Получение списка подтипов для категории и типа ТС"""
-        try:
-            await self.connect()
-            cursor = await self.connection.execute(
-                """
-                SELECT DISTINCT subtype FROM products 
-                WHERE category = ? AND vehicle_type = ? AND subtype IS NOT NULL
-                """,
-                (category, vehicle_type)
-            )
-            subtypes = [row[0] for row in await cursor.fetchall()]
-            await cursor.close()
-            return subtypes
-        except Exception as e:
-            logger.error(f"Ошибка при получении подтипов: {e}")
-            return []
-        finally:
-            await self.disconnect()
+        return self.catalog.subtypes(category, vehicle_type)
+
+    async def get_vehicle_type_options(
+        self, category: str, vehicle_type: str
+    ) -> Tuple[Sequence[str], Sequence[str]]:
+        """Получение подтипов и всех размеров типа ТС одним запросом"""
+        return self.catalog.branch(category, vehicle_type)
 
     async def get_sizes(
         self, category: str, vehicle_type: str, subtype: Optional[str] = None
-    ) -> List[str]:
+    ) -> Sequence[str]:
         """Получение списка размеров"""
-        try:
-            await self.connect()
-            if subtype:
-                cursor = await self.connection.execute(
-                    """
-                    SELECT DISTINCT size FROM products 
-                    WHERE category = ? AND vehicle_type = ? AND subtype = ?
-                    """,
-                    (category, vehicle_type, subtype)
-                )
-            else:
-                cursor = await self.connection.execute(
-                    """
-                    SELECT DISTINCT size FROM products 
-                    WHERE category = ? AND vehicle_type = ?
-                    """,
-                    (category, vehicle_type)
-                )
-            sizes = [row[0] for row in await cursor.fetchall()]
-            await cursor.close()
-            return sizes
-        except Exception as e:
-            logger.error(f"Ошибка при получении размеров: {e}")
-            return []
-        finally:
-            await self.disconnect()
+        return self.catalog.sizes(category, vehicle_type, subtype)
 
     async def get_product_link(
         self, category: str, vehicle_type: str, subtype: Optional[str],
         size: str
     ) -> Optional[str]:
         """Получение ссылки на товар"""
-        try:
-            await self.connect()
-            if subtype:
-                cursor = await self.connection.execute(
-                    """
-                    SELECT link FROM products 
-                    WHERE category = ? AND vehicle_type = ? 
-                    AND subtype = ? AND size = ?
-                    """,
-                    (category, vehicle_type, subtype, size)
-                )
-            else:
-                cursor = await self.connection.execute(
-                    """
-                    SELECT link FROM products 
-                    WHERE category = ? AND vehicle_type = ? AND size = ?
-                    """,
-                    (category, vehicle_type, size)
-                )
-            row = await cursor.fetchone()
-            await cursor.close()
-            return row[0] if row else None
-        except Exception as e:
-            logger.error(f"Ошибка при получении ссылки на товар: {e}")
-            return None
-        finally:
-            await self.disconnect()
+        return self.catalog.link(category, vehicle_type, subtype, size)
+
+    async def get_product_choice(
+        self, category: str, vehicle_type: str, subtype: Optional[str],
+        size: str
+    ) -> Tuple[Optional[str], Sequence[str]]:
+        """Получение ссылки на товар и списка размеров одним запросом"""
+        return self.catalog.choice(category, vehicle_type, subtype, size)
 
     async def add_product(self, data: Dict) -> bool:
-        """Добавление нового товара"""
+        """Добавление или обновление товара"""
         try:
-            await self.connect()
-            await self.connection.execute(
-                """
-                INSERT INTO products (
-                    category, vehicle_type, subtype, size, link
-                ) VALUES (?, ?, ?, ?, ?)
-                """,
+            await self.writer.execute(
+                PRODUCT_UPSERT_SQL,
                 (
                     data['category'], data['vehicle_type'],
-                    data.get('subtype'), data['size'], data['link']
+                    data.get('subtype') or None, data['size'], data['link']
                 )
             )
-            await self.connection.commit()
+            # Индекс обновляется только после успешной записи
+            self.catalog.add(
+                data['category'], data['vehicle_type'],
+                data.get('subtype'), data['size'], data['link']
+            )
             return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении товара: {e}")
             return False
-        finally:
-            await self.disconnect()
 
-    async def get_user(self, user_id: int) -> Optional[Dict]:
+    async def import_products(self, rows: Iterable[Dict]) -> ImportResult:
+        """Импорт прайс-листа одной транзакцией с обновлением по ключу товара.
+
+        Ключ товара - (category, vehicle_type, subtype, size). При повторе
+        ключа в файле побеждает последняя строка. Строки без обязательных
+        полей пропускаются.
+        """
+        try:
+            products: Dict[Tuple, Product] = {}
+            skipped = 0
+            for data in rows:
+                product = normalize_product(data)
+                if product is None:
+                    skipped += 1
+                    continue
+                products[product[:4]] = product
+
+            # Текущее состояние каталога уже есть в памяти
+            changed: List[Product] = []
+            inserted = updated = unchanged = 0
+            for key, product in products.items():
+                current = self.catalog.exact_link(*key)
+                if current is None:
+                    inserted += 1
+                elif current == product.link:
+                    unchanged += 1
+                    continue
+                else:
+                    updated += 1
+                changed.append(product)
+
+            async def operation(connection):
+                await connection.executemany(PRODUCT_UPSERT_SQL, changed)
+
+            if changed:
+                await self.writer.run(operation)
+                self.catalog.add_many(changed)
+            result = ImportResult(inserted, updated, unchanged, skipped)
+            logger.info(f"Импорт каталога завершен: {result}")
+            return result
+        except Exception as e:
+            logger.error(f"Ошибка при импорте каталога: {e}")
+            raise
+
+    async def get_user(self, user_id: int) -> Optional[User]:
         """Получение информации о пользователе"""
+        user = self.users.get(user_id)
+        if user is not None:
+            return user
         try:
-            await self.connect()
-            cursor = await self.connection.execute(
-                "SELECT * FROM users WHERE user_id = ?",
-                (user_id,)
-            )
-            row = await cursor.fetchone()
-            await cursor.close()
-            
-            if row:
-                columns = [description[0] for description in cursor.description]
-                return dict(zip(columns, row))
-            return None
+            token = self.users.token()
+            async with self.pool.acquire() as connection:
+                user = await fetch_one(
+                    connection, User,
+                    f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?",
+                    (user_id,)
+                )
+            if user is not None:
+                self.users.fill(user_id, user, token)
+            return user
         except Exception as e:
             logger.error(f"Ошибка при получении пользователя: {e}")
             return None
-        finally:
-            await self.disconnect()
+
+    async def _write_user(
+        self, user_id: int, sql: str, parameters: Sequence
+    ) -> Optional[User]:
+        """Изменение пользователя с возвратом новой строки в кэш"""
+        sequences = []
+
+        async def operation(connection):
+            sequences.append(self.users.begin_write(user_id))
+            return await fetch_one(connection, User, sql, parameters)
+
+        try:
+            user = await self.writer.run(operation)
+        except Exception:
+            # Транзакция откатена: запись завершена без изменений. При
+            # отмене исход неизвестен, и чтения ключа в кэш не попадают
+            for sequence in sequences:
+                self.users.end_write(sequence)
+            raise
+        sequence = sequences[0]
+        self.users.end_write(sequence)
+        if user is not None:
+            self.users.store(user_id, user, sequence)
+        return user
 
     async def save_user(self, user_data: Dict) -> bool:
         """Сохранение информации о пользователе"""
         try:
-            await self.connect()
-            await self.connection.execute(
-                """
+            await self._write_user(
+                user_data['user_id'],
+                f"""
                 INSERT OR REPLACE INTO users (
                     user_id, first_name, last_name, username,
                     phone_number, birth_date, created_at, updated_at
                 ) VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                RETURNING {USER_COLUMNS}
                 """,
                 (
                     user_data['user_id'],
@@ -485,363 +408,447 @@ class Database:
                     user_data.get('birth_date')
                 )
             )
-            await self.connection.commit()
             return True
         except Exception as e:
             logger.error(f"Ошибка при сохранении пользователя: {e}")
             return False
-        finally:
-            await self.disconnect()
 
     async def create_contact_request(self, user_id: int, request_type: str) -> bool:
         """Создание запроса на связь с менеджером"""
         try:
-            await self.connect()
-            await self.connection.execute(
+            await self.writer.execute(
                 """
                 INSERT INTO contact_requests (user_id, request_type)
                 VALUES (?, ?)
                 """,
                 (user_id, request_type)
             )
-            await self.connection.commit()
             return True
         except Exception as e:
             logger.error(f"Ошибка при создании запроса: {e}")
             return False
-        finally:
-            await self.disconnect()
 
     async def update_user(self, user_id: int, data: dict) -> bool:
         """Обновление данных пользователя"""
         try:
-            await self.connect()
             # Формируем SQL запрос на основе переданных данных
             set_clause = ", ".join([f"{k} = ?" for k in data.keys()])
             query = f"""
                 UPDATE users 
                 SET {set_clause}, updated_at = CURRENT_TIMESTAMP
                 WHERE user_id = ?
+                RETURNING {USER_COLUMNS}
             """
             values = list(data.values()) + [user_id]
-            
-            await self.connection.execute(query, values)
-            await self.connection.commit()
+
+            await self._write_user(user_id, query, values)
             return True
         except Exception as e:
             logger.error(f"Ошибка при обновлении пользователя: {e}")
             return False
-        finally:
-            await self.disconnect()
 
-    async def create_chat(self, user_id: int, manager_id: int) -> int:
-        """Создание чата между пользователем и менеджером"""
+    # Методы для работы с чатами: открытые чаты читаются из реестра
+    async def _load_sessions(self):
+        """Загрузка открытых чатов в реестр сессий"""
+        placeholders = ", ".join("?" * len(OPEN_STATUSES))
+        async with self.pool.acquire() as connection:
+            # IN по статусам идет по индексу idx_chats_status
+            chats = await fetch_all(
+                connection, Chat,
+                f"""
+                SELECT {CHAT_WITH_USER_COLUMNS}
+                FROM chats c
+                LEFT JOIN users u ON c.user_id = u.user_id
+                WHERE c.status IN ({placeholders})
+                """,
+                OPEN_STATUSES
+            )
+        self.sessions.load(chats)
+        logger.info(f"Реестр чатов загружен: {len(chats)} открытых чатов")
+
+    async def get_open_chat_users(self) -> List[int]:
+        """Пользователи с открытыми чатами по данным базы, а не реестра"""
+        placeholders = ", ".join("?" * len(OPEN_STATUSES))
+        try:
+            async with self.pool.acquire() as connection:
+                cursor = await connection.execute(
+                    f"""
+                    SELECT DISTINCT user_id FROM chats
+                    WHERE status IN ({placeholders})
+                    """,
+                    OPEN_STATUSES
+                )
+                return [row[0] for row in await cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Ошибка при получении пользователей с чатами: {e}")
+            return []
+
+    async def _write_chat(
+        self, sql: str, parameters: Sequence, chat_id: Optional[int] = None
+    ) -> Optional[Chat]:
+        """Изменение чата с обновлением реестра в той же операции писателя.
+
+        Без chat_id запрос считается вставкой нового чата.
+        """
+        async def operation(connection) -> Optional[Chat]:
+            cursor = await connection.execute(sql, parameters)
+            await cursor.close()
+            chat = await fetch_one(
+                connection, Chat, CHAT_BY_ID_SQL,
+                (chat_id or cursor.lastrowid,)
+            )
+            # Операции писателя выполняются по очереди, поэтому реестр
+            # меняется в порядке записи
+            if chat is not None:
+                self.sessions.upsert(chat)
+            return chat
+
         try:
-            await self.connect()
-            cursor = await self.connection.execute(
+            return await self.writer.run(operation)
+        except Exception:
+            # Реестр мог уйти вперед неудачной фиксации
+            if chat_id is not None:
+                await self._reload_chat(chat_id)
+            raise
+
+    async def _reload_chat(self, chat_id: int):
+        """Перечитывание чата из базы в реестр"""
+        try:
+            async with self.pool.acquire() as connection:
+                chat = await fetch_one(
+                    connection, Chat, CHAT_BY_ID_SQL, (chat_id,)
+                )
+            if chat is None:
+                self.sessions.discard(chat_id)
+            else:
+                self.sessions.upsert(chat)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении реестра чатов: {e}")
+
+    async def create_chat(
+        self, user_id: int, manager_id: Optional[int] = None
+    ) -> int:
+        """Создание чата; менеджер может быть назначен позже"""
+        try:
+            chat = await self._write_chat(
                 """
                 INSERT INTO chats (user_id, manager_id, status)
                 VALUES (?, ?, 'pending')
                 """,
                 (user_id, manager_id)
             )
-            chat_id = cursor.lastrowid
-            await self.connection.commit()
-            return chat_id
+            return chat.id
         except Exception as e:
             logger.error(f"Ошибка при создании чата: {e}")
             return 0
-        finally:
-            await self.disconnect()
 
-    async def get_chat(self, user_id: int) -> Optional[Dict]:
-        """Получение информации о чате по ID пользователя"""
+    async def assign_chat(self, chat_id: int, manager_id: int) -> bool:
+        """Назначение ожидающего чата менеджеру"""
         try:
-            await self.connect()
-            cursor = await self.connection.execute(
+            chat = await self._write_chat(
                 """
-                SELECT * FROM chats 
-                WHERE user_id = ? AND status != 'closed'
-                ORDER BY created_at DESC
-                LIMIT 1
+                UPDATE chats
+                SET manager_id = ?
+                WHERE id = ? AND status = 'pending'
                 """,
-                (user_id,)
+                (manager_id, chat_id),
+                chat_id
             )
-            row = await cursor.fetchone()
-            await cursor.close()
-            
-            if row:
-                columns = [description[0] for description in cursor.description]
-                return dict(zip(columns, row))
-            return None
+            return chat is not None and chat.manager_id == manager_id
         except Exception as e:
-            logger.error(f"Ошибка при получении чата: {e}")
-            return None
-        finally:
-            await self.disconnect()
+            logger.error(f"Ошибка при назначении чата менеджеру: {e}")
+            return False
+
+    async def get_chat(self, user_id: int) -> Optional[Chat]:
+        """Получение последнего открытого чата пользователя"""
+        return self.sessions.user_chat(user_id)
 
     async def update_chat_status(self, chat_id: int, status: str) -> bool:
         """Обновление статуса чата"""
         try:
-            await self.connect()
-            await self.connection.execute(
+            await self._write_chat(
                 """
                 UPDATE chats 
                 SET status = ?
                 WHERE id = ?
                 """,
-                (status, chat_id)
+                (status, chat_id),
+                chat_id
             )
-            await self.connection.commit()
             return True
         except Exception as e:
             logger.error(f"Ошибка при обновлении статуса чата: {e}")
             return False
-        finally:
-            await self.disconnect()
 
     async def accept_chat(self, chat_id: int) -> bool:
         """Принятие чата менеджером"""
         try:
-            await self.connect()
-            await self.connection.execute(
+            await self._write_chat(
                 """
                 UPDATE chats 
                 SET status = 'active', accepted_at = CURRENT_TIMESTAMP
                 WHERE id = ?
                 """,
-                (chat_id,)
+                (chat_id,),
+                chat_id
             )
-            await self.connection.commit()
             return True
         except Exception as e:
             logger.error(f"Ошибка при принятии чата: {e}")
             return False
-        finally:
-            await self.disconnect()
 
-    async def get_pending_chats(self) -> List[Dict]:
-        """Получение списка ожидающих чатов"""
-        try:
-            await self.connect()
-            cursor = await self.connection.execute(
-                """
-                SELECT c.*, u.first_name, u.last_name, u.username
-                FROM chats c
-                JOIN users u ON c.user_id = u.user_id
-                WHERE c.status = 'pending'
-                """
-            )
-            rows = await cursor.fetchall()
-            await cursor.close()
-            
-            if rows:
-                columns = [description[0] for description in cursor.description]
-                return [dict(zip(columns, row)) for row in rows]
-            return []
-        except Exception as e:
-            logger.error(f"Ошибка при получении ожидающих чатов: {e}")
-            return []
-        finally:
-            await self.disconnect()
-
-    async def get_active_chat(self, user_id: int) -> Optional[Dict]:
-        """Получение активного чата пользователя"""
-        try:
-            await self.connect()
-            cursor = await self.connection.execute(
-                """
-                SELECT * FROM chats 
-                WHERE user_id = ? AND status = 'active'
+    async def claim_pending_chat(
+        self, manager_id: int, chat_id: Optional[int] = None
+    ) -> Optional[Chat]:
+        """Атомарное принятие ожидающего чата менеджером.
+
+        Берется указанный чат или самый ранний ожидающий чат, свободный
+        или назначенный этому менеджеру. Условие status = 'pending'
+        проверяет сам UPDATE, поэтому один чат не достанется двоим.
+        """
+        if chat_id is None:
+            target_sql = """
+                SELECT id FROM chats
+                WHERE status = 'pending'
+                  AND (manager_id IS NULL OR manager_id = ?)
+                ORDER BY created_at, id
+                LIMIT 1
+            """
+            target_parameters = (manager_id,)
+        else:
+            target_sql = """
+                SELECT id FROM chats
+                WHERE id = ? AND status = 'pending'
+                  AND (manager_id IS NULL OR manager_id = ?)
+            """
+            target_parameters = (chat_id, manager_id)
+
+        async def operation(connection) -> Optional[Chat]:
+            cursor = await connection.execute(
+                f"""
+                UPDATE chats
+                SET status = 'active', manager_id = ?,
+                    accepted_at = CURRENT_TIMESTAMP
+                WHERE id = ({target_sql}) AND status = 'pending'
+                RETURNING id
                 """,
-                (user_id,)
+                (manager_id, *target_parameters)
             )
             row = await cursor.fetchone()
             await cursor.close()
-            
-            if row:
-                columns = [description[0] for description in cursor.description]
-                return dict(zip(columns, row))
-            return None
+            if row is None:
+                return None
+            chat = await fetch_one(connection, Chat, CHAT_BY_ID_SQL, (row[0],))
+            self.sessions.upsert(chat)
+            return chat
+
+        try:
+            return await self.writer.run(operation)
         except Exception as e:
-            logger.error(f"Ошибка при получении чата: {e}")
+            logger.error(f"Ошибка при принятии ожидающего чата: {e}")
+            if chat_id is not None:
+                await self._reload_chat(chat_id)
             return None
-        finally:
-            await self.disconnect()
 
-    async def save_message(self, chat_id: int, sender_id: int, message_text: str) -> bool:
-        """Сохранение сообщения в чате"""
+    async def get_pending_chats(self) -> List[Chat]:
+        """Получение списка ожидающих чатов"""
+        return self.sessions.pending()
+
+    async def get_active_chat(self, user_id: int) -> Optional[Chat]:
+        """Получение активного чата пользователя"""
+        return self.sessions.active_user_chat(user_id)
+
+    async def save_message(
+        self, chat_id: int, sender_id: int, message_text: str,
+        durable: bool = False
+    ) -> bool:
+        """Сохранение сообщения в чате.
+
+        Сообщения всех чатов фиксируются общими пачками в порядке поступления,
+        поэтому порядок внутри чата сохраняется. С durable=True вызов ждет
+        фиксации пачки - не дольше message_flush_interval.
+        """
         try:
-            await self.connect()
-            await self.connection.execute(
-                """
-                INSERT INTO messages (chat_id, sender_id, message_text)
-                VALUES (?, ?, ?)
-                """,
-                (chat_id, sender_id, message_text)
+            await self.messages.put(
+                (chat_id, sender_id, message_text, utc_timestamp()),
+                wait=durable
             )
-            await self.connection.commit()
             return True
         except Exception as e:
             logger.error(f"Ошибка при сохранении сообщения: {e}")
             return False
-        finally:
-            await self.disconnect()
 
     async def close_chat(self, chat_id: int) -> bool:
         """Закрытие чата"""
         try:
-            await self.connect()
-            await self.connection.execute(
+            await self._write_chat(
                 """
                 UPDATE chats 
                 SET status = 'closed', closed_at = CURRENT_TIMESTAMP
                 WHERE id = ?
                 """,
-                (chat_id,)
+                (chat_id,),
+                chat_id
             )
-            await self.connection.commit()
             return True
         except Exception as e:
             logger.error(f"Ошибка при закрытии чата: {e}")
             return False
-        finally:
-            await self.disconnect()
 
-    async def get_chat_by_id(self, chat_id: int) -> dict:
+    async def get_chat_by_id(self, chat_id: int) -> Optional[Chat]:
         """Получение информации о чате по ID чата"""
+        chat = self.sessions.chat(chat_id)
+        if chat is not None:
+            return chat
+        # Закрытых и отклоненных чатов в реестре нет
         try:
-            await self.connect()
-            query = """
-                SELECT c.*, u.first_name, u.last_name, u.username
-                FROM chats c
-                LEFT JOIN users u ON c.user_id = u.user_id
-                WHERE c.id = ?
-            """
-            cursor = await self.connection.execute(query, (chat_id,))
-            row = await cursor.fetchone()
-            await cursor.close()
-            
-            if row:
-                columns = [description[0] for description in cursor.description]
-                return dict(zip(columns, row))
-            return None
+            async with self.pool.acquire() as connection:
+                return await fetch_one(
+                    connection, Chat, CHAT_BY_ID_SQL, (chat_id,)
+                )
         except Exception as e:
             logger.error(f"Ошибка при получении чата по ID: {e}")
             return None
-        finally:
-            await self.disconnect()
 
-    async def get_active_chat_by_manager(self, manager_id: int) -> Optional[Dict]:
-        """Получение активного чата по ID менеджера"""
-        try:
-            await self.connect()
-            cursor = await self.connection.execute(
-                """
-                SELECT c.*, u.first_name, u.last_name, u.username
-                FROM chats c
-                LEFT JOIN users u ON c.user_id = u.user_id
-                WHERE c.manager_id = ? AND c.status = 'active'
-                ORDER BY c.created_at DESC
-                LIMIT 1
-                """,
-                (manager_id,)
-            )
-            row = await cursor.fetchone()
-            await cursor.close()
-            
-            if row:
-                columns = [description[0] for description in cursor.description]
-                return dict(zip(columns, row))
-            return None
-        except Exception as e:
-            logger.error(f"Ошибка при получении активного чата менеджера: {e}")
-            return None
-        finally:
-            await self.disconnect()
+    async def get_active_chat_by_manager(
+        self, manager_id: int
+    ) -> Optional[Chat]:
+        """Получение последнего активного чата менеджера"""
+        return self.sessions.manager_chat(manager_id)
 
     async def save_user_log(self, user_id: int, action: str, details: str = None) -> bool:
         """Сохранение лога действия пользователя"""
         try:
-            await self.connect()
-            await self.connection.execute(
-                '''
-                INSERT INTO user_logs (user_id, action, details)
-                VALUES (?, ?, ?)
-                ''',
-                (user_id, action, details)
+            # Запись уходит в буфер и фиксируется пачкой в фоне;
+            # время берется сейчас, чтобы порядок логов не зависел от пачки
+            await self.user_logs.put(
+                (user_id, action, details, utc_timestamp())
             )
-            await self.connection.commit()
             return True
         except Exception as e:
             logger.error(f"Ошибка при сохранении лога: {e}")
             return False
-        finally:
-            await self.disconnect()
 
-    async def get_user_logs(self, user_id: int, limit: int = 100) -> list:
+    async def get_user_logs(
+        self, user_id: int, limit: int = 100
+    ) -> List[LogEntry]:
         """Получение логов пользователя"""
         try:
-            await self.connect()
-            cursor = await self.connection.execute(
-                '''
-                SELECT action, details, created_at
-                FROM user_logs
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT ?
-                ''',
-                user_id, limit
-            )
-            rows = await cursor.fetchall()
-            await cursor.close()
-            return [dict(row) for row in rows]
+            async with self.pool.acquire() as connection:
+                return await fetch_all(
+                    connection, LogEntry,
+                    f"""
+                    SELECT {columns(LogEntry)}
+                    FROM user_logs
+                    WHERE user_id = ?
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                    """,
+                    (user_id, limit)
+                )
         except Exception as e:
             logger.error(f"Ошибка при получении логов: {e}")
             return []
-        finally:
-            await self.disconnect()
 
     async def save_chat_rating(self, chat_id: int, rating: int) -> bool:
         """Сохранение оценки чата"""
         try:
-            await self.connect()
-            await self.connection.execute(
+            await self.writer.execute(
                 """
                 INSERT INTO chat_ratings (chat_id, rating)
                 VALUES (?, ?)
                 """,
                 (chat_id, rating)
             )
-            await self.connection.commit()
             return True
         except Exception as e:
             logger.error(f"Ошибка при сохранении оценки чата: {e}")
             return False
-        finally:
-            await self.disconnect()
 
     async def get_manager_rating(self, manager_id: int) -> float:
         """Получение среднего рейтинга менеджера"""
         try:
-            await self.connect()
-            cursor = await self.connection.execute(
-                """
-                SELECT AVG(r.rating) as avg_rating
-                FROM chat_ratings r
-                JOIN chats c ON r.chat_id = c.id
-                WHERE c.manager_id = ?
-                """,
-                (manager_id,)
+            async with self.pool.acquire() as connection:
+                cursor = await connection.execute(
+                    """
+                    SELECT AVG(r.rating) as avg_rating
+                    FROM chat_ratings r
+                    JOIN chats c ON r.chat_id = c.id
+                    WHERE c.manager_id = ?
+                    """,
+                    (manager_id,)
+                )
+                row = await cursor.fetchone()
+                await cursor.close()
+
+                if row and row[0] is not None:
+                    return round(float(row[0]), 2)
+                return 0.0
+        except Exception as e:
+            logger.error(f"Ошибка при получении рейтинга менеджера: {e}")
+            return 0.0 
+
+    async def get_fsm_state(self, key: str) -> Optional[FSMState]:
+        """Сохраненное состояние FSM по ключу"""
+        try:
+            async with self.pool.acquire() as connection:
+                return await fetch_one(
+                    connection, FSMState,
+                    f"SELECT {columns(FSMState)} FROM fsm_states WHERE key = ?",
+                    (key,)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка при получении состояния FSM: {e}")
+            return None
+
+    async def save_fsm_states(self, states: Sequence[FSMState]) -> bool:
+        """Запись пачки состояний FSM одной транзакцией; пустые удаляются"""
+        saved = [
+            state for state in states
+            if state.state is not None or state.data != "{}"
+        ]
+        deleted = [
+            (state.key,) for state in states
+            if state.state is None and state.data == "{}"
+        ]
+
+        async def operation(connection):
+            if saved:
+                await connection.executemany(
+                    """
+                    INSERT INTO fsm_states (key, state, data, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        state = excluded.state,
+                        data = excluded.data,
+                        updated_at = excluded.updated_at
+                    """,
+                    saved
+                )
+            if deleted:
+                await connection.executemany(
+                    "DELETE FROM fsm_states WHERE key = ?", deleted
+                )
+
+        try:
+            await self.writer.run(operation)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении состояний FSM: {e}")
+            return False
+
+    async def delete_expired_fsm_states(self, updated_before: str) -> int:
+        """Удаление состояний FSM, не менявшихся с момента updated_before"""
+        async def operation(connection) -> int:
+            cursor = await connection.execute(
+                "DELETE FROM fsm_states WHERE updated_at < ?",
+                (updated_before,)
             )
-            row = await cursor.fetchone()
             await cursor.close()
-            
-            if row and row[0] is not None:
-                return round(float(row[0]), 2)
-            return 0.0
+            return cursor.rowcount
+
+        try:
+            return await self.writer.run(operation)
         except Exception as e:
-            logger.error(f"Ошибка при получении рейтинга менеджера: {e}")
-            return 0.0
-        finally:
-            await self.disconnect() 
\ No newline at end of file
+            logger.error(f"Ошибка при удалении устаревших состояний FSM: {e}")
+            return 0
@@ -23,7 +23,6 @@ class CatalogStates(StatesGroup):
 
 
 router = Router()
-db = Database()
 
 
 @router.message(Command("start"))
@@ -47,7 +46,7 @@ async def catalog_start(message: Message, state: FSMContext):
 
 
 @router.message(CatalogStates.category)
-async def process_category(message: Message, state: FSMContext):
+async def process_category(message: Message, state: FSMContext, db: Database):
     """Обработчик выбора категории"""
     if message.text == "Назад":
         await state.clear()
@@ -80,7 +79,7 @@ async def process_category(message: Message, state: FSMContext):
 
 
 @router.message(CatalogStates.vehicle_type)
-async def process_vehicle_type(message: Message, state: FSMContext):
+async def process_vehicle_type(message: Message, state: FSMContext, db: Database):
     """Обработчик выбора типа ТС"""
     if message.text == "Назад":
         await state.set_state(CatalogStates.category)
@@ -92,40 +91,8 @@ async def process_vehicle_type(message: Message, state: FSMContext):
 
     data = await state.get_data()
     vehicle_type = message.text
-    
-    # Для шин всегда показываем размеры сразу
-    if data["category"] == "Шины":
-        await state.update_data(vehicle_type=vehicle_type)
-        sizes = await db.get_sizes(
-            data["category"],
-            vehicle_type,
-            None
-        )
-        
-        if not sizes:
-            await message.answer(
-                "Для данного типа ТС пока нет товаров",
-                reply_markup=get_vehicle_types_keyboard(
-                    await db.get_vehicle_types(data["category"])
-                )
-            )
-            return
-
-        await state.set_state(CatalogStates.size)
-        await message.answer(
-            "Выберите размер:",
-            reply_markup=get_sizes_keyboard(sizes)
-        )
-        return
-
-    # Для других категорий (например, Диски) проверяем подтипы
-    subtypes = await db.get_subtypes(data["category"], vehicle_type)
-    
-    await state.update_data(vehicle_type=vehicle_type)
-    sizes = await db.get_sizes(
-        data["category"],
-        vehicle_type,
-        None
+    subtypes, sizes = await db.get_vehicle_type_options(
+        data["category"], vehicle_type
     )
     
     if not sizes:
@@ -137,15 +104,18 @@ async def process_vehicle_type(message: Message, state: FSMContext):
         )
         return
 
-    if subtypes:
-        # Если есть подтипы, показываем их
+    # Подтип прошлого выбора не должен попасть в поиск товара и в «Назад»
+    await state.update_data(vehicle_type=vehicle_type, subtype=None)
+
+    # Для шин всегда показываем размеры сразу, для других категорий
+    # (например, Диски) - подтипы, если они есть
+    if subtypes and data["category"] != "Шины":
         await state.set_state(CatalogStates.subtype)
         await message.answer(
             "Выберите подтип:",
             reply_markup=get_subtypes_keyboard(subtypes)
         )
     else:
-        # Если подтипов нет, сразу показываем размеры
         await state.set_state(CatalogStates.size)
         await message.answer(
             "Выберите размер:",
@@ -154,7 +124,7 @@ async def process_vehicle_type(message: Message, state: FSMContext):
 
 
 @router.message(CatalogStates.subtype)
-async def process_subtype(message: Message, state: FSMContext):
+async def process_subtype(message: Message, state: FSMContext, db: Database):
     """Обработчик выбора подтипа"""
     if message.text == "Назад":
         data = await state.get_data()
@@ -193,7 +163,7 @@ async def process_subtype(message: Message, state: FSMContext):
 
 
 @router.message(CatalogStates.size)
-async def process_size(message: Message, state: FSMContext):
+async def process_size(message: Message, state: FSMContext, db: Database):
     """Обработчик выбора размера"""
     if message.text == "Назад":
         data = await state.get_data()
@@ -217,7 +187,7 @@ async def process_size(message: Message, state: FSMContext):
 
     data = await state.get_data()
     size = message.text
-    product_link = await db.get_product_link(
+    product_link, available_sizes = await db.get_product_choice(
         data["category"],
         data["vehicle_type"],
         data.get("subtype"),
@@ -225,12 +195,6 @@ async def process_size(message: Message, state: FSMContext):
     )
     
     if not product_link:
-        available_sizes = await db.get_sizes(
-            data["category"],
-            data["vehicle_type"],
-            data.get("subtype")
-        )
-        
         if not available_sizes:
             await message.answer(
                 "Извините, в данной категории пока нет товаров.\n"
@@ -250,11 +214,5 @@ async def process_size(message: Message, state: FSMContext):
     await message.answer(
         f"Ссылка на товар: {product_link}\n\n"
         "Для выбора другого товара нажмите 'Назад'.",
-        reply_markup=get_sizes_keyboard(
-            await db.get_sizes(
-                data["category"],
-                data["vehicle_type"],
-                data.get("subtype")
-            )
-        )
-    ) 
\ No newline at end of file
+        reply_markup=get_sizes_keyboard(available_sizes)
+    )
\ No newline at end of file
@@ -1,5 +1,7 @@
+from typing import Dict, NamedTuple, Optional, Tuple
+
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.types import Message, ReplyKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
@@ -11,6 +13,8 @@ from keyboards.contacts_kb import (
 )
 from keyboards.main_kb import get_main_keyboard
 from database import Database
+from utils.contacts_directory import SERVICE, STORE, ContactsDirectory
+from utils.records import ServicePoint
 
 
 class ContactsStates(StatesGroup):
@@ -21,7 +25,86 @@ class ContactsStates(StatesGroup):
 
 
 router = Router()
-db = Database()
+
+
+def render_card(point: ServicePoint, contact_type: str) -> str:
+    """Текст карточки точки для выбранного типа контакта"""
+    response = f"📍 {point.address}\n\n"
+
+    if contact_type == STORE:
+        if point.phone_store:
+            response += f"📞 Телефон: {point.phone_store}\n"
+        if point.work_schedule_weekdays:
+            response += f"🕒 График работы (будни): {point.work_schedule_weekdays}\n"
+        if point.work_schedule_weekend:
+            response += f"🕒 График работы (выходные): {point.work_schedule_weekend}\n"
+    else:  # Сервис
+        if point.phone_service:
+            response += f"📞 Телефон: {point.phone_service}\n"
+        if point.service_schedule_weekdays:
+            response += f"🕒 График работы сервиса (будни): {point.service_schedule_weekdays}\n"
+        if point.service_schedule_weekend:
+            response += f"🕒 График работы сервиса (выходные): {point.service_schedule_weekend}\n"
+        if point.service_manager_name:
+            response += f"👨‍💼 Менеджер сервиса: {point.service_manager_name}\n"
+
+    if point.maps_2gis_link:
+        response += f"\n🗺 2ГИС: {point.maps_2gis_link}\n"
+    if point.google_maps_link:
+        response += f"🗺 Google Maps: {point.google_maps_link}\n"
+    return response
+
+
+class ContactCard(NamedTuple):
+    """Готовый ответ о торговой точке"""
+    text: str
+    keyboard: ReplyKeyboardMarkup
+
+
+class ContactCards:
+    """Готовые карточки точек: (город, адрес, тип контакта) → карточка.
+
+    Карточки строятся для обоих типов контакта, когда справочник
+    загружает или меняет город, так что ответ на выбор адреса - один
+    поиск в словаре. Клавиатура карточки - список адресов города, поэтому
+    изменение одной точки пересобирает карточки всего города. Карточка
+    есть и для точки без выбранного типа: адрес можно ввести вручную.
+    """
+
+    def __init__(self, directory: ContactsDirectory):
+        self._directory = directory
+        self._cards: Dict[Tuple[str, str, str], ContactCard] = {}
+        # Адреса города, для которых построены карточки
+        self._addresses: Dict[str, Tuple[str, ...]] = {}
+
+    def refresh(self, city: str, points: Dict[str, ServicePoint]):
+        """Пересборка карточек города"""
+        for address in self._addresses.pop(city, ()):
+            for contact_type in (STORE, SERVICE):
+                self._cards.pop((city, address, contact_type), None)
+        for contact_type in (STORE, SERVICE):
+            keyboard = get_locations_keyboard(
+                self._directory.locations(city, contact_type)
+            )
+            for address, point in points.items():
+                self._cards[(city, address, contact_type)] = ContactCard(
+                    render_card(point, contact_type), keyboard
+                )
+        if points:
+            self._addresses[city] = tuple(points)
+
+    def get(
+        self, city: str, address: str, contact_type: str
+    ) -> Optional[ContactCard]:
+        """Готовая карточка точки"""
+        return self._cards.get((city, address, contact_type))
+
+
+def create_contact_cards(db: Database) -> ContactCards:
+    """Карточки точек, которые пересобираются вместе со справочником"""
+    cards = ContactCards(db.contacts)
+    db.contacts.subscribe(cards.refresh)
+    return cards
 
 
 @router.message(Command("start"))
@@ -45,7 +128,7 @@ async def contacts_start(message: Message, state: FSMContext):
 
 
 @router.message(ContactsStates.contact_type)
-async def process_contact_type(message: Message, state: FSMContext):
+async def process_contact_type(message: Message, state: FSMContext, db: Database):
     """Обработчик выбора типа контакта"""
     if message.text == "Назад":
         await state.clear()
@@ -80,7 +163,7 @@ async def process_contact_type(message: Message, state: FSMContext):
 
 
 @router.message(ContactsStates.city)
-async def process_city(message: Message, state: FSMContext):
+async def process_city(message: Message, state: FSMContext, db: Database):
     """Обработчик выбора города"""
     if message.text == "Назад":
         await state.set_state(ContactsStates.contact_type)
@@ -110,7 +193,9 @@ async def process_city(message: Message, state: FSMContext):
 
 
 @router.message(ContactsStates.location)
-async def process_location(message: Message, state: FSMContext):
+async def process_location(
+    message: Message, state: FSMContext, db: Database, cards: ContactCards
+):
     """Обработчик выбора адреса"""
     if message.text == "Назад":
         data = await state.get_data()
@@ -122,10 +207,9 @@ async def process_location(message: Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    location = message.text
-    location_info = await db.get_location_info(data["city"], location)
-    
-    if not location_info:
+    card = cards.get(data["city"], message.text, data["contact_type"])
+
+    if not card:
         await message.answer(
             "Информация о торговой точке не найдена",
             reply_markup=get_locations_keyboard(
@@ -134,33 +218,4 @@ async def process_location(message: Message, state: FSMContext):
         )
         return
 
-    response = f"📍 {location_info['address']}\n\n"
-    
-    if data["contact_type"] == "Магазин":
-        if location_info.get("phone_store"):
-            response += f"📞 Телефон: {location_info['phone_store']}\n"
-        if location_info.get("work_schedule_weekdays"):
-            response += f"🕒 График работы (будни): {location_info['work_schedule_weekdays']}\n"
-        if location_info.get("work_schedule_weekend"):
-            response += f"🕒 График работы (выходные): {location_info['work_schedule_weekend']}\n"
-    else:  # Сервис
-        if location_info.get("phone_service"):
-            response += f"📞 Телефон: {location_info['phone_service']}\n"
-        if location_info.get("service_schedule_weekdays"):
-            response += f"🕒 График работы сервиса (будни): {location_info['service_schedule_weekdays']}\n"
-        if location_info.get("service_schedule_weekend"):
-            response += f"🕒 График работы сервиса (выходные): {location_info['service_schedule_weekend']}\n"
-        if location_info.get("service_manager_name"):
-            response += f"👨‍💼 Менеджер сервиса: {location_info['service_manager_name']}\n"
-
-    if location_info.get("maps_2gis_link"):
-        response += f"\n🗺 2ГИС: {location_info['maps_2gis_link']}\n"
-    if location_info.get("google_maps_link"):
-        response += f"🗺 Google Maps: {location_info['google_maps_link']}\n"
-
-    await message.answer(
-        response,
-        reply_markup=get_locations_keyboard(
-            await db.get_locations_by_city(data["city"], data["contact_type"])
-        )
-    ) 
\ No newline at end of file
+    await message.answer(card.text, reply_markup=card.keyboard)
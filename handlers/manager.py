@@ -1,15 +1,27 @@
+import re
+from typing import Iterable, Optional
+
 from aiogram import Router, F, Bot
-from aiogram.types import Message, ReplyKeyboardRemove, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import Message, ReplyKeyboardRemove, ReplyKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from keyboards.main_kb import get_main_keyboard, get_manager_contact_keyboard
+from keyboards.factory import build_keyboard, grid_keyboard, rows_keyboard
+from keyboards.main_kb import (
+    get_client_chat_keyboard, get_main_keyboard, get_manager_contact_keyboard
+)
 from database import Database
-from config import MANAGER_ID, BOT_TOKEN
+import config
 from utils.logger import logger
+from utils.routing import PRIORITY_RETRY, ManagerRouting
+from utils.send_scheduler import PRIORITY_RELAY, send_priority
+from utils.tasks import TaskSupervisor
+
+# Пул менеджеров и число чатов, которые каждый ведет одновременно;
+# без MANAGER_IDS в config пул состоит из одного MANAGER_ID
+MANAGER_IDS = tuple(getattr(config, "MANAGER_IDS", (config.MANAGER_ID,)))
+MANAGER_CAPACITY = getattr(config, "MANAGER_CAPACITY", 3)
 
 router = Router()
-db = Database()
-bot = Bot(token=BOT_TOKEN)
 
 class ManagerStates(StatesGroup):
     """Состояния для общения с менеджером"""
@@ -17,25 +29,119 @@ class ManagerStates(StatesGroup):
     chat_message = State()
     rating_chat = State()  # Новое состояние для оценки
 
+# Кнопки, с которых пользователь начинает разговор с менеджером: при
+# нескольких процессах такие апдейты обрабатывает процесс поддержки
+SUPPORT_TEXTS = ("Связаться с менеджером", "Завершить чат")
+
+def in_support(db: Database, user_id: int, state: Optional[str]) -> bool:
+    """Пользователь ведет диалог с менеджером или ждет его"""
+    return (
+        user_id in MANAGER_IDS
+        or state in ManagerStates.__all_states_names__
+        or db.sessions.user_chat(user_id) is not None
+    )
+
 def get_manager_keyboard(chat_id: int) -> ReplyKeyboardMarkup:
     """Создание клавиатуры для менеджера"""
-    keyboard = [
-        [KeyboardButton(text=f"Принять чат {chat_id}")],
-        [KeyboardButton(text="Отклонить")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return rows_keyboard(
+        ((f"Принять чат {chat_id}",), (f"Отклонить чат {chat_id}",))
+    )
+
+def get_manager_chats_keyboard(chat_ids: Iterable[int]) -> ReplyKeyboardMarkup:
+    """Клавиатура выбора активного чата менеджера"""
+    return grid_keyboard(
+        tuple(f"Чат №{chat_id}" for chat_id in chat_ids), 1, ("Завершить чат",)
+    )
+
+def get_manager_reply_keyboard(
+    routing: ManagerRouting, manager_id: int
+) -> ReplyKeyboardMarkup:
+    """Клавиатура менеджера: его активные чаты или главное меню"""
+    chat_ids = routing.active_chats(manager_id)
+    if chat_ids:
+        return get_manager_chats_keyboard(chat_ids)
+    return get_main_keyboard()
+
+def parse_chat_id(text: str) -> Optional[int]:
+    """Номер чата из текста кнопки, если он есть"""
+    match = re.search(r"(?:чат |№)(\d+)$", text or "")
+    return int(match.group(1)) if match else None
+
+def create_routing(db: Database) -> ManagerRouting:
+    """Распределение чатов по пулу менеджеров с учетом незакрытых чатов"""
+    routing = ManagerRouting(MANAGER_IDS, MANAGER_CAPACITY)
+    routing.load(db.sessions.chats())
+    return routing
+
+async def offer_pending_chats(bot: Bot, db: Database, routing: ManagerRouting):
+    """Раздача ожидающих чатов свободным менеджерам с уведомлением"""
+    for chat_id, manager_id in routing.dispatch():
+        try:
+            if not await db.assign_chat(chat_id, manager_id):
+                raise RuntimeError("чат не назначен в базе")
+            await notify_manager(bot, db, chat_id, manager_id)
+        except Exception as e:
+            logger.error(
+                f"Ошибка при предложении чата {chat_id} менеджеру {manager_id}: {e}"
+            )
+            # Чат возвращается в начало очереди до следующей раздачи
+            routing.release(chat_id)
+            routing.enqueue(chat_id, PRIORITY_RETRY)
+
+async def notify_manager(bot: Bot, db: Database, chat_id: int, manager_id: int):
+    """Уведомление менеджера о предложенном ему чате"""
+    chat = await db.get_chat_by_id(chat_id)
+    user = await db.get_user(chat.user_id)
+    if user:
+        manager_message = (
+            f"Новый запрос на чат!\n\n"
+            f"Пользователь: {user.first_name} {user.last_name}\n"
+            f"Username: @{user.username}\n"
+            f"ID: {user.user_id}\n"
+            f"Телефон: {user.phone_number or 'не указан'}\n"
+            f"Дата рождения: {user.birth_date or 'не указана'}\n\n"
+            f"ID чата: {chat_id}"
+        )
+    else:
+        # Без профиля чат все равно предлагается: иначе он занимал бы
+        # место менеджера без уведомления
+        logger.error(f"Пользователь {chat.user_id} не найден")
+        manager_message = (
+            f"Новый запрос на чат!\n\n"
+            f"ID: {chat.user_id}\n\n"
+            f"ID чата: {chat_id}"
+        )
+    await bot.send_message(
+        manager_id,
+        manager_message,
+        reply_markup=get_manager_keyboard(chat_id)
+    )
+
+def queue_status(routing: ManagerRouting, chat_id: int) -> str:
+    """Текст для клиента о его месте в очереди к менеджерам"""
+    position = routing.queue_position(chat_id)
+    if position is None:
+        return "Ваш запрос на чат отправлен менеджеру. Ожидайте подтверждения."
+    return (
+        "Все менеджеры сейчас заняты. "
+        f"Ваш запрос в очереди, позиция: {position}."
+    )
+
+RATING_KEYBOARD = build_keyboard([
+    ["⭐️", "⭐️⭐️"],
+    ["⭐️⭐️⭐️", "⭐️⭐️⭐️⭐️"],
+    ["⭐️⭐️⭐️⭐️⭐️"]
+])
 
 def get_rating_keyboard() -> ReplyKeyboardMarkup:
     """Создание клавиатуры для оценки"""
-    keyboard = [
-        [KeyboardButton(text="⭐️"), KeyboardButton(text="⭐️⭐️")],
-        [KeyboardButton(text="⭐️⭐️⭐️"), KeyboardButton(text="⭐️⭐️⭐️⭐️")],
-        [KeyboardButton(text="⭐️⭐️⭐️⭐️⭐️")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return RATING_KEYBOARD
 
 @router.message(F.text == "Связаться с менеджером")
-async def start_manager_contact(message: Message, state: FSMContext):
+async def start_manager_contact(
+    message: Message, state: FSMContext, db: Database, bot: Bot,
+    routing: ManagerRouting
+):
     """Начало процесса связи с менеджером"""
     try:
         # Проверяем существование пользователя
@@ -63,18 +169,12 @@ async def start_manager_contact(message: Message, state: FSMContext):
         # Проверяем наличие активного чата
         active_chat = await db.get_chat(message.from_user.id)
         if active_chat:
-            if active_chat['status'] == 'active':
+            if active_chat.status == 'active':
                 # Если есть активный чат, продолжаем общение
                 await state.set_state(ManagerStates.chat_message)
                 await message.answer(
                     "У вас уже есть активный чат с менеджером. Продолжайте общение.",
-                    reply_markup=ReplyKeyboardMarkup(
-                        keyboard=[
-                            [KeyboardButton(text="Завершить чат")],
-                            [KeyboardButton(text="Назад")]
-                        ],
-                        resize_keyboard=True
-                    )
+                    reply_markup=get_client_chat_keyboard()
                 )
                 # Логируем действие
                 await db.save_user_log(
@@ -83,9 +183,13 @@ async def start_manager_contact(message: Message, state: FSMContext):
                     "Продолжение активного чата с менеджером"
                 )
                 return
-            elif active_chat['status'] == 'pending':
-                # Если есть ожидающий чат, отправляем новый запрос
-                await start_chat(message, state)
+            elif active_chat.status == 'pending':
+                # Запрос уже в очереди: новый чат не создается
+                await state.set_state(ManagerStates.chat_message)
+                await message.answer(
+                    queue_status(routing, active_chat.id),
+                    reply_markup=ReplyKeyboardRemove()
+                )
                 return
 
         await state.set_state(ManagerStates.waiting_for_manager)
@@ -107,11 +211,14 @@ async def start_manager_contact(message: Message, state: FSMContext):
         )
 
 @router.message(ManagerStates.waiting_for_manager, F.text == "Чат с менеджером")
-async def start_chat(message: Message, state: FSMContext):
+async def start_chat(
+    message: Message, state: FSMContext, db: Database, bot: Bot,
+    routing: ManagerRouting
+):
     """Начало чата с менеджером"""
     try:
-        # Создаем новый чат
-        chat_id = await db.create_chat(message.from_user.id, MANAGER_ID)
+        # Создаем новый чат: менеджер назначается при раздаче очереди
+        chat_id = await db.create_chat(message.from_user.id)
         if not chat_id:
             logger.error(
                 f"Не удалось создать чат для пользователя {message.from_user.id}"
@@ -122,52 +229,12 @@ async def start_chat(message: Message, state: FSMContext):
             )
             return
 
-        # Получаем информацию о пользователе
-        user = await db.get_user(message.from_user.id)
-        if not user:
-            logger.error(f"Пользователь {message.from_user.id} не найден")
-            await message.answer(
-                "Произошла ошибка. Попробуйте позже.",
-                reply_markup=get_manager_contact_keyboard()
-            )
-            return
-
-        # Формируем текст кнопки для менеджера
-        user_info = []
-        if user['first_name']:
-            user_info.append(user['first_name'])
-        if user['last_name']:
-            user_info.append(user['last_name'])
-        if user['phone_number']:
-            user_info.append(user['phone_number'])
-        if not user_info:  # Если нет никакой информации
-            user_info.append(f"ID: {user['user_id']}")
-
-        button_text = f"Принять чат с {' '.join(user_info)}"
-
-        # Отправляем уведомление менеджеру
-        manager_message = (
-            f"Новый запрос на чат!\n\n"
-            f"Пользователь: {user['first_name']} {user['last_name']}\n"
-            f"Username: @{user['username']}\n"
-            f"ID: {user['user_id']}\n"
-            f"Телефон: {user['phone_number'] or 'не указан'}\n"
-            f"Дата рождения: {user['birth_date'] or 'не указана'}\n\n"
-            f"ID чата: {chat_id}"
-        )
-        await bot.send_message(
-            MANAGER_ID,
-            manager_message,
-            reply_markup=ReplyKeyboardMarkup(
-                keyboard=[[KeyboardButton(text=button_text)]],
-                resize_keyboard=True
-            )
-        )
+        routing.enqueue(chat_id)
+        await offer_pending_chats(bot, db, routing)
 
         await state.set_state(ManagerStates.chat_message)
         await message.answer(
-            "Ваш запрос на чат отправлен менеджеру. Ожидайте подтверждения.",
-            reply_markup=ReplyKeyboardRemove()
+            queue_status(routing, chat_id), reply_markup=ReplyKeyboardRemove()
         )
         # Логируем действие
         await db.save_user_log(
@@ -182,64 +249,82 @@ async def start_chat(message: Message, state: FSMContext):
             reply_markup=get_manager_contact_keyboard()
         )
 
-@router.message(F.text.startswith("Принять чат с "))
-async def accept_chat(message: Message, state: FSMContext):
+@router.message(F.text.startswith("Принять чат"))
+async def accept_chat(
+    message: Message, state: FSMContext, db: Database, bot: Bot,
+    routing: ManagerRouting
+):
     """Обработка принятия чата менеджером"""
-    if message.from_user.id != MANAGER_ID:
+    manager_id = message.from_user.id
+    if not routing.is_manager(manager_id):
         return
 
     try:
-        # Получаем последний ожидающий чат
-        pending_chats = await db.get_pending_chats()
-        if not pending_chats:
+        # Чат из кнопки или самый ранний из предложенных менеджеру
+        chat_id = routing.offered(manager_id, parse_chat_id(message.text))
+        if chat_id is None:
             await message.answer("Нет ожидающих чатов")
             return
 
-        chat = pending_chats[0]  # Берем первый ожидающий чат
-        chat_id = chat['id']
-
-        # Обновляем статус чата
-        if not await db.update_chat_status(chat_id, "active"):
-            await message.answer("Ошибка при обновлении статуса чата")
+        # Место за менеджером закрепляется до записи в базу
+        routing.accept(manager_id, chat_id)
+        chat = await db.claim_pending_chat(manager_id, chat_id)
+        if chat is None:
+            # Чат уже принят или закрыт; ожидающий чат возвращается в очередь
+            routing.release(chat_id)
+            current = await db.get_chat_by_id(chat_id)
+            if current is not None and current.status == "pending":
+                routing.enqueue(chat_id, PRIORITY_RETRY)
+            await offer_pending_chats(bot, db, routing)
+            await message.answer("Чат уже недоступен")
             return
 
-        # Создаем клавиатуру для клиента
-        client_keyboard = ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="Завершить чат")],
-                [KeyboardButton(text="Назад")]
-            ],
-            resize_keyboard=True
-        )
-
         # Уведомление пользователю
         await bot.send_message(
-            chat['user_id'],
+            chat.user_id,
             "Менеджер принял ваш запрос на чат. Теперь вы можете общаться.",
-            reply_markup=client_keyboard
-        )
-
-        # Создаем клавиатуру для менеджера
-        manager_keyboard = ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="Завершить чат")]],
-            resize_keyboard=True
+            reply_markup=get_client_chat_keyboard()
         )
 
         await message.answer(
-            f"Чат с пользователем {chat['user_id']} начат.",
-            reply_markup=manager_keyboard
+            f"Чат с пользователем {chat.user_id} начат.",
+            reply_markup=get_manager_chats_keyboard(
+                routing.active_chats(manager_id)
+            )
         )
     except Exception as e:
         logger.error(f"Ошибка при принятии чата: {e}")
         await message.answer("Ошибка при обработке запроса")
 
+@router.message(F.text.startswith("Чат №"))
+async def select_chat(message: Message, db: Database, routing: ManagerRouting):
+    """Выбор менеджером чата, в который пойдут его сообщения"""
+    manager_id = message.from_user.id
+    if not routing.is_manager(manager_id):
+        return
+
+    chat_id = parse_chat_id(message.text)
+    if chat_id is None or not routing.select(manager_id, chat_id):
+        await message.answer("Чат не найден среди ваших активных чатов")
+        return
+
+    chat = await db.get_chat_by_id(chat_id)
+    await message.answer(
+        f"Сообщения пойдут в чат с {chat.first_name or chat.user_id}."
+    )
+
 @router.message(F.text == "Завершить чат")
-async def end_chat(message: Message, state: FSMContext):
+async def end_chat(
+    message: Message, state: FSMContext, db: Database, bot: Bot,
+    routing: ManagerRouting
+):
     """Завершение чата"""
     try:
-        # Получаем активный чат
-        if message.from_user.id == MANAGER_ID:
-            chat = await db.get_active_chat_by_manager(MANAGER_ID)
+        # Менеджер завершает выбранный чат, пользователь - свой
+        is_manager = routing.is_manager(message.from_user.id)
+        if is_manager:
+            chat_id = routing.selected(message.from_user.id)
+            chat = await db.get_chat_by_id(chat_id) if chat_id else None
         else:
             chat = await db.get_chat(message.from_user.id)
             
@@ -248,38 +333,44 @@ async def end_chat(message: Message, state: FSMContext):
             return
 
         # Обновляем статус чата
-        if not await db.update_chat_status(chat['id'], "closed"):
+        if not await db.update_chat_status(chat.id, "closed"):
             await message.answer("Ошибка при завершении чата")
             return
+        routing.release(chat.id)
 
         # Уведомление другому участнику чата
-        if message.from_user.id == MANAGER_ID:
+        if is_manager:
             await bot.send_message(
-                chat['user_id'],
+                chat.user_id,
                 "Чат завершен менеджером.",
                 reply_markup=get_main_keyboard()
             )
             await message.answer(
                 "Чат завершен",
-                reply_markup=get_main_keyboard()
+                reply_markup=get_manager_reply_keyboard(
+                    routing, message.from_user.id
+                )
             )
             # Логируем действие менеджера
             await db.save_user_log(
-                MANAGER_ID,
+                message.from_user.id,
                 "end_chat_manager",
-                f"Завершен чат с пользователем {chat['user_id']}"
+                f"Завершен чат с пользователем {chat.user_id}"
             )
         else:
-            # Уведомляем менеджера
-            await bot.send_message(
-                MANAGER_ID,
-                "Пользователь завершил чат.",
-                reply_markup=get_main_keyboard()
-            )
+            # Уведомляем менеджера, если чат уже был ему назначен
+            if routing.is_manager(chat.manager_id):
+                await bot.send_message(
+                    chat.manager_id,
+                    f"Пользователь завершил чат {chat.id}.",
+                    reply_markup=get_manager_reply_keyboard(
+                        routing, chat.manager_id
+                    )
+                )
             
             # Сохраняем ID чата в состоянии для оценки
             await state.set_state(ManagerStates.rating_chat)
-            await state.update_data(chat_id=chat['id'])
+            await state.update_data(chat_id=chat.id)
             
             # Запрашиваем оценку у пользователя
             await message.answer(
@@ -292,12 +383,15 @@ async def end_chat(message: Message, state: FSMContext):
                 "end_chat_user",
                 "Завершен чат с менеджером"
             )
+
+        # Освободившееся место получает следующий чат из очереди
+        await offer_pending_chats(bot, db, routing)
     except Exception as e:
         logger.error(f"Ошибка при завершении чата: {e}")
         await message.answer("Ошибка при обработке запроса")
 
 @router.message(ManagerStates.rating_chat)
-async def handle_rating(message: Message, state: FSMContext):
+async def handle_rating(message: Message, state: FSMContext, db: Database):
     """Обработка оценки чата"""
     try:
         # Получаем количество звезд из сообщения
@@ -343,27 +437,30 @@ async def handle_rating(message: Message, state: FSMContext):
         )
         await state.clear()
 
-@router.message(F.text == "Отклонить")
-async def reject_chat(message: Message, state: FSMContext):
+@router.message(F.text.startswith("Отклонить"))
+async def reject_chat(
+    message: Message, state: FSMContext, db: Database, bot: Bot,
+    routing: ManagerRouting
+):
     """Обработка отклонения чата менеджером"""
-    if message.from_user.id != MANAGER_ID:
+    manager_id = message.from_user.id
+    if not routing.is_manager(manager_id):
         return
 
     try:
-        # Получаем последний ожидающий чат
-        pending_chats = await db.get_pending_chats()
-        if not pending_chats:
+        # Чат из кнопки или самый ранний из предложенных менеджеру
+        chat_id = routing.offered(manager_id, parse_chat_id(message.text))
+        if chat_id is None:
             await message.answer("Нет ожидающих чатов")
             return
-
-        chat = pending_chats[0]  # Берем первый ожидающий чат
-        chat_id = chat['id']
-        user_id = chat['user_id']
+        chat = await db.get_chat_by_id(chat_id)
+        user_id = chat.user_id
 
         # Обновляем статус чата
         if not await db.update_chat_status(chat_id, "rejected"):
             await message.answer("Ошибка при обновлении статуса чата")
             return
+        routing.release(chat_id)
 
         # Уведомление пользователю
         await bot.send_message(
@@ -374,14 +471,18 @@ async def reject_chat(message: Message, state: FSMContext):
 
         await message.answer(
             "Чат отклонен",
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=get_manager_reply_keyboard(routing, manager_id)
         )
+        await offer_pending_chats(bot, db, routing)
     except Exception as e:
         logger.error(f"Ошибка при отклонении чата: {e}")
         await message.answer("Ошибка при обработке запроса")
 
 @router.message(ManagerStates.chat_message)
-async def handle_chat_message(message: Message, state: FSMContext):
+async def handle_chat_message(
+    message: Message, state: FSMContext, db: Database, bot: Bot,
+    tasks: TaskSupervisor
+):
     """Обработка сообщений в чате с менеджером"""
     try:
         # Получаем информацию о чате
@@ -395,34 +496,31 @@ async def handle_chat_message(message: Message, state: FSMContext):
             return
 
         # Если чат не активен
-        if chat['status'] != 'active':
+        if chat.status != 'active':
             await message.answer(
                 "Чат не активен. Пожалуйста, дождитесь ответа менеджера.",
                 reply_markup=get_manager_contact_keyboard()
             )
             return
 
-        # Создаем клавиатуру для клиента
-        client_keyboard = ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="Завершить чат")],
-                [KeyboardButton(text="Назад")]
-            ],
-            resize_keyboard=True
-        )
-
-        # Отправляем сообщение менеджеру
-        manager_id = chat['manager_id']
-        await bot.send_message(manager_id, message.text)
+        # Отправляем сообщение менеджеру раньше уведомлений
+        manager_id = chat.manager_id
+        with send_priority(PRIORITY_RELAY):
+            await bot.send_message(manager_id, message.text)
         
-        # Сохраняем сообщение в истории
-        await db.save_message(chat['id'], message.from_user.id, message.text)
-        
-        # Логируем действие
-        await db.save_user_log(
-            message.from_user.id,
-            "send_message",
-            f"Отправлено сообщение в чат {chat['id']}: {message.text[:50]}..."
+        # Сохраняем сообщение в истории и логируем действие в фоне,
+        # по порядку внутри чата; при остановке бота - сразу
+        await tasks.submit_or_run(
+            db.save_message(chat.id, message.from_user.id, message.text),
+            key=chat.id
+        )
+        await tasks.submit_or_run(
+            db.save_user_log(
+                message.from_user.id,
+                "send_message",
+                f"Отправлено сообщение в чат {chat.id}: {message.text[:50]}..."
+            ),
+            key=chat.id
         )
         
     except Exception as e:
@@ -433,34 +531,33 @@ async def handle_chat_message(message: Message, state: FSMContext):
         )
         await state.clear()
 
-@router.message(F.from_user.id == MANAGER_ID)
-async def handle_manager_message(message: Message):
+@router.message(F.from_user.id.in_(MANAGER_IDS))
+async def handle_manager_message(
+    message: Message, db: Database, bot: Bot, tasks: TaskSupervisor,
+    routing: ManagerRouting
+):
     """Обработка сообщений от менеджера"""
     try:
-        # Получаем активный чат для менеджера
-        chat = await db.get_active_chat_by_manager(MANAGER_ID)
+        # Сообщение уходит в выбранный менеджером чат
+        chat_id = routing.selected(message.from_user.id)
+        chat = await db.get_chat_by_id(chat_id) if chat_id else None
         if not chat:
             await message.answer("У вас нет активных чатов")
             return
 
-        # Создаем клавиатуру для клиента
-        client_keyboard = ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="Завершить чат")],
-                [KeyboardButton(text="Назад")]
-            ],
-            resize_keyboard=True
-        )
-
-        # Отправляем сообщение пользователю
-        await bot.send_message(
-            chat['user_id'],
-            message.text,
-            reply_markup=client_keyboard
-        )
+        # Отправляем сообщение пользователю раньше уведомлений
+        with send_priority(PRIORITY_RELAY):
+            await bot.send_message(
+                chat.user_id,
+                message.text,
+                reply_markup=get_client_chat_keyboard()
+            )
         
-        # Сохраняем сообщение в истории
-        await db.save_message(chat['id'], message.from_user.id, message.text)
+        # Сохраняем сообщение в истории в фоне; при остановке бота - сразу
+        await tasks.submit_or_run(
+            db.save_message(chat.id, message.from_user.id, message.text),
+            key=chat.id
+        )
         
     except Exception as e:
         logger.error(f"Ошибка при обработке сообщения менеджера: {e}")
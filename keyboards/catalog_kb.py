@@ -1,49 +1,27 @@
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from typing import Sequence
+
+from aiogram.types import ReplyKeyboardMarkup
+
+from keyboards.factory import BACK, build_keyboard, grid_keyboard
+
+CATEGORIES_KEYBOARD = build_keyboard([["Шины", "Диски"], [BACK]])
 
 
 def get_categories_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура выбора категории"""
-    keyboard = [
-        [KeyboardButton(text="Шины"), KeyboardButton(text="Диски")],
-        [KeyboardButton(text="Назад")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return CATEGORIES_KEYBOARD
 
 
-def get_vehicle_types_keyboard(types: list[str]) -> ReplyKeyboardMarkup:
+def get_vehicle_types_keyboard(types: Sequence[str]) -> ReplyKeyboardMarkup:
     """Клавиатура выбора типа ТС"""
-    keyboard = []
-    row = []
-    for i, vehicle_type in enumerate(types):
-        row.append(KeyboardButton(text=vehicle_type))
-        if len(row) == 2 or i == len(types) - 1:
-            keyboard.append(row)
-            row = []
-    keyboard.append([KeyboardButton(text="Назад")])
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
-
-
-def get_subtypes_keyboard(subtypes: list[str]) -> ReplyKeyboardMarkup:
+    return grid_keyboard(tuple(types), 2)
+
+
+def get_subtypes_keyboard(subtypes: Sequence[str]) -> ReplyKeyboardMarkup:
     """Клавиатура выбора подтипа"""
-    keyboard = []
-    row = []
-    for i, subtype in enumerate(subtypes):
-        row.append(KeyboardButton(text=subtype))
-        if len(row) == 2 or i == len(subtypes) - 1:
-            keyboard.append(row)
-            row = []
-    keyboard.append([KeyboardButton(text="Назад")])
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
-
-
-def get_sizes_keyboard(sizes: list[str]) -> ReplyKeyboardMarkup:
+    return grid_keyboard(tuple(subtypes), 2)
+
+
+def get_sizes_keyboard(sizes: Sequence[str]) -> ReplyKeyboardMarkup:
     """Клавиатура выбора размера"""
-    keyboard = []
-    row = []
-    for i, size in enumerate(sizes):
-        row.append(KeyboardButton(text=size))
-        if len(row) == 3 or i == len(sizes) - 1:
-            keyboard.append(row)
-            row = []
-    keyboard.append([KeyboardButton(text="Назад")])
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True) 
\ No newline at end of file
+    return grid_keyboard(tuple(sizes), 3)
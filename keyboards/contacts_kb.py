@@ -1,38 +1,27 @@
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from typing import Sequence
+
+from aiogram.types import ReplyKeyboardMarkup
+
+from keyboards.factory import BACK, build_keyboard, grid_keyboard
+
+MAIN_MENU = build_keyboard([["Каталог"], ["Контакты"]])
+CONTACT_TYPES_KEYBOARD = build_keyboard([["Магазин", "Сервис"], [BACK]])
 
 # Главное меню
 def get_main_menu() -> ReplyKeyboardMarkup:
     """Создает главное меню бота"""
-    keyboard = [
-        [KeyboardButton(text="Каталог")],
-        [KeyboardButton(text="Контакты")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return MAIN_MENU
 
 # Клавиатура с городами
-def get_cities_keyboard(cities: list[str]) -> ReplyKeyboardMarkup:
+def get_cities_keyboard(cities: Sequence[str]) -> ReplyKeyboardMarkup:
     """Создает клавиатуру выбора города"""
-    keyboard = []
-    row = []
-    for i, city in enumerate(cities):
-        row.append(KeyboardButton(text=city))
-        if len(row) == 2 or i == len(cities) - 1:
-            keyboard.append(row)
-            row = []
-    keyboard.append([KeyboardButton(text="Назад")])
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return grid_keyboard(tuple(cities), 2)
 
 # Клавиатура с торговыми точками
-def get_locations_keyboard(locations: list[str]) -> ReplyKeyboardMarkup:
+def get_locations_keyboard(locations: Sequence[str]) -> ReplyKeyboardMarkup:
     """Создает клавиатуру выбора адреса"""
-    keyboard = [[KeyboardButton(text=location)] for location in locations]
-    keyboard.append([KeyboardButton(text="Назад")])
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return grid_keyboard(tuple(locations), 1)
 
 def get_contact_types_keyboard() -> ReplyKeyboardMarkup:
     """Создает клавиатуру выбора типа контакта"""
-    keyboard = [
-        [KeyboardButton(text="Магазин"), KeyboardButton(text="Сервис")],
-        [KeyboardButton(text="Назад")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True) 
\ No newline at end of file
+    return CONTACT_TYPES_KEYBOARD
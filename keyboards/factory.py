@@ -0,0 +1,77 @@
+import json
+from functools import lru_cache
+from typing import Optional, Sequence, Tuple, Union
+
+from aiogram.methods import TelegramMethod
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+from pydantic import ConfigDict, PrivateAttr
+
+BACK = "Назад"
+
+# Число разных динамических клавиатур в кэше: списки размеров, городов,
+# адресов и т.п. повторяются, пока не изменится каталог или справочник
+KEYBOARD_CACHE_SIZE = 1024
+
+Button = Union[str, KeyboardButton]
+
+
+class CachedKeyboard(ReplyKeyboardMarkup):
+    """Клавиатура, которая создается один раз и отправляется готовым JSON.
+
+    Одна клавиатура отдается во все ответы, поэтому ее поля заморожены.
+    JSON считается при создании; BotSession подставляет его в запрос
+    вместо сериализации клавиатуры.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    _json: str = PrivateAttr(default="")
+
+    @property
+    def serialized(self) -> str:
+        """JSON клавиатуры для поля reply_markup"""
+        return self._json
+
+
+def build_keyboard(rows: Sequence[Sequence[Button]]) -> CachedKeyboard:
+    """Клавиатура из рядов кнопок; строка - кнопка с этим текстом"""
+    markup = CachedKeyboard(
+        keyboard=[
+            [
+                KeyboardButton(text=button) if isinstance(button, str) else button
+                for button in row
+            ]
+            for row in rows
+        ],
+        resize_keyboard=True,
+    )
+    # Так же, как сессия aiogram сериализует reply_markup
+    markup._json = json.dumps(markup.model_dump(exclude_none=True))
+    return markup
+
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def rows_keyboard(rows: Tuple[Tuple[str, ...], ...]) -> CachedKeyboard:
+    """Клавиатура по кортежу рядов надписей"""
+    return build_keyboard(rows)
+
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def grid_keyboard(
+    labels: Tuple[str, ...], width: int, footer: Tuple[str, ...] = (BACK,)
+) -> CachedKeyboard:
+    """Надписи по width в ряд и последний ряд footer"""
+    rows = [labels[i:i + width] for i in range(0, len(labels), width)]
+    if footer:
+        rows.append(footer)
+    return build_keyboard(rows)
+
+
+def detach_keyboard(
+    method: TelegramMethod
+) -> Tuple[TelegramMethod, Optional[str]]:
+    """Метод без готовой клавиатуры и ее JSON; без нее - метод как есть"""
+    markup = getattr(method, "reply_markup", None)
+    if not isinstance(markup, CachedKeyboard):
+        return method, None
+    return method.model_copy(update={"reply_markup": None}), markup.serialized
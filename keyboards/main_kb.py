@@ -1,34 +1,43 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
+from keyboards.factory import BACK, build_keyboard
+
+MAIN_KEYBOARD = build_keyboard([
+    ["Каталог", "Контакты"],
+    ["Связаться с менеджером"]
+])
+# Без номера телефона первой идет кнопка отправки профиля
+MANAGER_CONTACT_KEYBOARDS = {
+    has_phone: build_keyboard(
+        ([] if has_phone else [
+            [KeyboardButton(text="Поделиться профилем", request_contact=True)]
+        ]) + [
+            ["Хочу, чтобы мне перезвонили"],
+            ["Чат с менеджером"],
+            [BACK]
+        ]
+    )
+    for has_phone in (False, True)
+}
+CHAT_KEYBOARD = build_keyboard([["Завершить чат"]])
+CLIENT_CHAT_KEYBOARD = build_keyboard([["Завершить чат"], [BACK]])
+
 
 def get_main_keyboard() -> ReplyKeyboardMarkup:
     """Создает основную клавиатуру"""
-    keyboard = [
-        [KeyboardButton(text="Каталог"), KeyboardButton(text="Контакты")],
-        [KeyboardButton(text="Связаться с менеджером")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return MAIN_KEYBOARD
 
 
 def get_manager_contact_keyboard(has_phone: bool = False) -> ReplyKeyboardMarkup:
     """Создает клавиатуру для связи с менеджером"""
-    keyboard = []
-    
-    if not has_phone:
-        keyboard.append([KeyboardButton(text="Поделиться профилем", request_contact=True)])
-    
-    keyboard.extend([
-        [KeyboardButton(text="Хочу, чтобы мне перезвонили")],
-        [KeyboardButton(text="Чат с менеджером")],
-        [KeyboardButton(text="Назад")]
-    ])
-    
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return MANAGER_CONTACT_KEYBOARDS[bool(has_phone)]
 
 
 def get_chat_keyboard() -> ReplyKeyboardMarkup:
     """Создает клавиатуру для чата с менеджером"""
-    keyboard = [
-        [KeyboardButton(text="Завершить чат")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True) 
\ No newline at end of file
+    return CHAT_KEYBOARD
+
+
+def get_client_chat_keyboard() -> ReplyKeyboardMarkup:
+    """Клавиатура пользователя в активном чате с менеджером"""
+    return CLIENT_CHAT_KEYBOARD
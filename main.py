@@ -1,23 +1,63 @@
+import argparse
 import asyncio
 import logging
+import os
+import secrets
+import signal
+import sys
+from functools import partial
+from typing import Callable, Dict, Optional
 from aiogram import Bot, Dispatcher
 from aiogram.filters import Command
+from aiogram.fsm.storage.base import StorageKey
 from aiogram.types import Message
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
-from handlers.manager import router as manager_router
-from handlers.contacts import router as contacts_router
+import config
+from handlers.manager import (
+    router as manager_router, MANAGER_IDS, SUPPORT_TEXTS,
+    create_routing, in_support, offer_pending_chats
+)
+from handlers.contacts import create_contact_cards, router as contacts_router
 from handlers.catalog import router as catalog_router
 from keyboards.main_kb import get_main_keyboard
+from bot import create_bot
 from database import Database
+from utils.fsm_storage import SQLiteStorage
 from utils.logger import logger, setup_logger
+from utils.send_scheduler import GLOBAL_RATE, SendScheduler
+from utils.tasks import TaskSupervisor
+from utils.webhook import run_webhook
+from utils.workers import (
+    SUPPORT_WORKER, ShardingDispatcher, WorkerPool, serve_worker
+)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+# Режим webhook: публичный адрес, по которому Telegram шлет апдейты, и
+# секретный токен из заголовка X-Telegram-Bot-Api-Secret-Token. Без
+# WEBHOOK_SECRET токен генерируется при запуске и регистрируется вместе
+# с адресом
+WEBHOOK_URL = getattr(config, "WEBHOOK_URL", None)
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", None)
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = getattr(config, "WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8080)
+WEBHOOK_WORKERS = getattr(config, "WEBHOOK_WORKERS", 100)
+
+# Сигнал, по которому процесс перечитывает каталог из базы: его шлет
+# tools.import_catalog --reload-pid; супервизор передает его обработчикам
+CATALOG_RELOAD_SIGNAL = signal.SIGUSR1
+
+# Число процессов-обработчиков. Больше одного - процесс запуска становится
+# супервизором: принимает апдейты и раздает их обработчикам по ID
+# пользователя, SIGHUP поочередно перезапускает обработчики. Прирост
+# возможен только при свободных ядрах: на одном ядре супервизор и
+# обработчики делят его, и пропускная способность падает (tools.replay)
+WORKER_PROCESSES = getattr(config, "WORKER_PROCESSES", 1)
+
+# Инициализация диспетчера; бот создается в main(). Состояния FSM
+# хранятся в базе и переживают перезапуск, база подключается в main()
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
 
 # Подключение роутеров
@@ -48,34 +88,212 @@ async def cmd_help(message: Message):
         reply_markup=get_main_keyboard()
     )
 
-async def shutdown(bot: Bot):
+async def shutdown(
+    bot: Bot, db: Database, tasks: TaskSupervisor, scheduler: SendScheduler
+):
     """Корректное завершение работы бота"""
     logger.info("Shutting down...")
+    # Фоновые записи и состояния FSM дописываются до закрытия базы
+    await tasks.close()
+    await storage.close()
+    logger.info(f"Очередь отправки: {scheduler.stats()}")
     await bot.session.close()
     logger.info("Bot session closed")
+    await db.disconnect()
+
+def request_catalog_reload(db: Database, tasks: TaskSupervisor):
+    """Перечитывание каталога в фоне по CATALOG_RELOAD_SIGNAL"""
+    logger.info("Перечитывание каталога по сигналу")
+    try:
+        tasks.submit(db.reload_catalog(), key="catalog")
+    except RuntimeError:
+        # Процесс останавливается
+        pass
+
+def private_key(bot: Bot, user_id: int) -> StorageKey:
+    """Ключ FSM пользователя в личном чате с ботом"""
+    return StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
 
-async def main():
+async def activate_worker(bot: Bot, index: int):
+    """Перечитывание общего состояния перед приемом апдейтов обработчиком"""
+    db = dp["db"]
+    await db.reload()
+    routing = create_routing(db)
+    dp["routing"] = routing
+    if index == SUPPORT_WORKER:
+        await offer_pending_chats(bot, db, routing)
+
+async def is_support_user(bot: Bot, user_id: int) -> bool:
+    """Апдейты пользователя должен обрабатывать процесс поддержки"""
+    state = await storage.get_state(private_key(bot, user_id))
+    return in_support(dp["db"], user_id, state)
+
+async def release_user(bot: Bot, user_id: int) -> bool:
+    """Передача пользователя другому обработчику: запись и очистка кэшей"""
+    dp["db"].users.discard(user_id)
+    return await storage.release(private_key(bot, user_id))
+
+async def run_worker(
+    bot: Bot, index: int, socket_path: str,
+    stats: Optional[Callable[[], Dict]] = None
+):
+    """Обработчик: апдейты приходят от супервизора через unix-сокет"""
+    await serve_worker(
+        dp, bot, socket_path,
+        index=index,
+        activate=partial(activate_worker, bot, index),
+        is_support=partial(is_support_user, bot),
+        release=partial(release_user, bot),
+        stats=stats,
+    )
+
+async def run_supervisor(args: argparse.Namespace):
+    """Супервизор: прием апдейтов и раздача их процессам-обработчикам"""
+    bot = create_bot()
+    # База супервизора: миграции и пользователи с открытыми чатами
+    db = Database(wal=True)
+    pool = WorkerPool(
+        [sys.executable, os.path.abspath(__file__),
+         "--processes", str(args.processes)],
+        args.processes,
+        support_users=MANAGER_IDS,
+        support_texts=SUPPORT_TEXTS,
+        support_loader=db.get_open_chat_users,
+    )
+    # Обработчики в супервизоре не вызываются: типы апдейтов берутся
+    # из диспетчера обработчиков
+    supervisor = ShardingDispatcher(pool, dp.resolve_used_update_types())
+    # Сигналы ставятся до запуска: иначе SIGUSR1 завершил бы процесс
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGHUP, pool.request_restart)
+    loop.add_signal_handler(
+        CATALOG_RELOAD_SIGNAL,
+        partial(pool.signal_workers, CATALOG_RELOAD_SIGNAL)
+    )
+    try:
+        # Миграции применяются один раз до запуска обработчиков: те только
+        # проверяют версию схемы
+        await db.connect()
+        await db.migrate()
+        await pool.start()
+        logger.info(f"Бот запущен: обработчиков {args.processes}")
+        if args.webhook:
+            await run_webhook(
+                supervisor, bot,
+                host=WEBHOOK_HOST,
+                port=args.port,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or secrets.token_urlsafe(32),
+                url=WEBHOOK_URL,
+                limit=args.workers,
+            )
+        else:
+            await bot.delete_webhook()
+            await supervisor.start_polling(bot)
+    except Exception as e:
+        logger.error(f"Error in main loop: {e}")
+    finally:
+        await pool.close()
+        await bot.session.close()
+        logger.info("Bot session closed")
+        await db.disconnect()
+
+def parse_args() -> argparse.Namespace:
+    """Аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="Бот поддержки клиентов")
+    parser.add_argument("--webhook", action="store_true",
+                        help="принимать апдейты через webhook вместо long polling")
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT,
+                        help="порт сервера webhook")
+    parser.add_argument("--workers", type=int, default=WEBHOOK_WORKERS,
+                        help="число апдейтов, обрабатываемых одновременно")
+    parser.add_argument("--processes", type=int, default=WORKER_PROCESSES,
+                        help="число процессов-обработчиков")
+    # Номер обработчика и его сокет передает супервизор
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--socket", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.processes < 1:
+        parser.error("--processes должно быть не меньше 1")
+    if args.webhook and not (WEBHOOK_URL or WEBHOOK_SECRET):
+        parser.error("для режима webhook нужен WEBHOOK_URL или WEBHOOK_SECRET в config.py")
+    return args
+
+async def main(args: argparse.Namespace):
     """Основная функция запуска бота"""
-    # Настройка логирования
-    setup_logger()
+    # Настройка логирования: файл лога ротирует только запускающий
+    # процесс, обработчики супервизора лишь дописывают в него
+    setup_logger(rotate=args.worker is None)
     logger.info("Запуск бота...")
+    if args.worker is None and args.processes > 1:
+        await run_supervisor(args)
+        return
+
+    # Один бот и один пул соединений на процесс: обработчики получают
+    # его через DI aiogram. Все исходящие сообщения идут через очередь
+    # с лимитами Telegram; лимит на бота процессы делят поровну
+    bot = create_bot()
+    scheduler = SendScheduler(global_rate=GLOBAL_RATE / args.processes)
+    bot.session.middleware(scheduler)
     
-    # Инициализация базы данных
-    db = Database()
-    await db.init_db()
+    # Инициализация базы данных: пул соединений общий для всех роутеров
+    db = Database(wal=True)
+    await db.connect()
+    # Фоновые задачи: запись истории и логов не задерживает пересылку
+    tasks = TaskSupervisor(name="persistence")
+    dp["tasks"] = tasks
+    
+    # Каталог, импортированный tools.import_catalog, виден без перезапуска;
+    # сигнал ставится до запуска, иначе SIGUSR1 завершил бы процесс
+    asyncio.get_running_loop().add_signal_handler(
+        CATALOG_RELOAD_SIGNAL, partial(request_catalog_reload, db, tasks)
+    )
     
     try:
+        # Обработчикам базу мигрирует супервизор
+        await db.init_db(apply_migrations=args.worker is None)
+        dp["db"] = db
+        # Карточки точек пересобираются вместе со справочником контактов
+        dp["cards"] = create_contact_cards(db)
+        await storage.start(db)
+        # Распределение чатов между менеджерами; чаты, ждавшие в очереди
+        # до перезапуска, сразу предлагаются свободным менеджерам
+        routing = create_routing(db)
+        dp["routing"] = routing
+
+        if args.worker is not None:
+            # Ожидающие чаты раздает процесс поддержки при активации
+            await run_worker(
+                bot, args.worker, args.socket,
+                stats=lambda: {"fsm": storage.stats(), "send": scheduler.stats()}
+            )
+            return
+        await offer_pending_chats(bot, db, routing)
         # Запуск бота
         logger.info("Бот запущен и готов к работе")
-        await dp.start_polling(bot)
+        if args.webhook:
+            await run_webhook(
+                dp, bot,
+                host=WEBHOOK_HOST,
+                port=args.port,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or secrets.token_urlsafe(32),
+                url=WEBHOOK_URL,
+                limit=args.workers,
+            )
+        else:
+            # getUpdates не работает, пока у бота зарегистрирован webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Error in main loop: {e}")
     finally:
-        await shutdown(bot)
+        await shutdown(bot, db, tasks, scheduler)
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        asyncio.run(main())
+        asyncio.run(main(args))
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped!")
     except Exception as e:
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from utils.batch_writer import BatchWriter
+from utils.db_pool import SQLiteWriter
+
+
+async def open_writer(path: str) -> SQLiteWriter:
+    writer = SQLiteWriter(path)
+    await writer.open()
+    await writer.execute("CREATE TABLE items (value INTEGER NOT NULL)")
+    return writer
+
+
+async def stored_values(writer: SQLiteWriter):
+    async def operation(connection):
+        cursor = await connection.execute(
+            "SELECT value FROM items ORDER BY rowid"
+        )
+        rows = await cursor.fetchall()
+        await cursor.close()
+        return [row[0] for row in rows]
+
+    return await writer.run(operation)
+
+
+def test_failed_rows_are_reported_to_waiters(tmp_path):
+    """Ожидающий put получает ошибку только для своей незаписанной строки"""
+    async def scenario():
+        writer = await open_writer(str(tmp_path / "items.db"))
+        batch = BatchWriter(
+            writer, "INSERT INTO items (value) VALUES (?)",
+            batch_size=10, flush_interval=0.01, name="items"
+        )
+        await batch.start()
+        try:
+            results = await asyncio.gather(
+                *(batch.put((value,), wait=True) for value in (1, 2, None, 4)),
+                return_exceptions=True
+            )
+            assert results[:2] == [None, None] and results[3] is None
+            assert isinstance(results[2], RuntimeError)
+            # Строка без ожидающего тоже не считается записанной
+            await batch.put((None,))
+            await batch.put((5,), wait=True)
+            await batch.flush()
+            assert await stored_values(writer) == [1, 2, 4, 5]
+            assert batch._written == 4
+            assert not batch._failed and not batch._waiting
+        finally:
+            await batch.close()
+            await writer.close()
+
+    asyncio.run(scenario())
+
+
+def test_put_after_close_fails(tmp_path):
+    """После close строки не принимаются"""
+    async def scenario():
+        writer = await open_writer(str(tmp_path / "items.db"))
+        batch = BatchWriter(writer, "INSERT INTO items (value) VALUES (?)")
+        await batch.start()
+        await batch.close()
+        try:
+            with pytest.raises(RuntimeError):
+                await batch.put((1,))
+        finally:
+            await writer.close()
+
+    asyncio.run(scenario())
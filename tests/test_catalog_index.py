@@ -0,0 +1,126 @@
+import asyncio
+
+from tests.test_database import open_database
+
+CATEGORY = "Шины"
+PRODUCTS = [
+    ("Легковые", "Летние", "R15", "https://shop/1"),
+    ("Легковые", "Зимние", "R16", "https://shop/2"),
+    ("Легковые", "Летние", "R16", "https://shop/3"),
+    ("Легковые", None, "R17", "https://shop/4"),
+    ("Грузовые", None, "R22", "https://shop/5"),
+]
+
+
+def product(vehicle_type, subtype, size, link):
+    return {
+        "category": CATEGORY, "vehicle_type": vehicle_type,
+        "subtype": subtype, "size": size, "link": link,
+    }
+
+
+async def sql_values(db, sql, parameters):
+    async with db.pool.acquire() as connection:
+        cursor = await connection.execute(sql, parameters)
+        return [row[0] for row in await cursor.fetchall()]
+
+
+async def assert_matches_sql(db):
+    """Ответы индекса совпадают с запросами к таблице products"""
+    vehicle_types = await db.get_vehicle_types(CATEGORY)
+    assert list(vehicle_types) == sorted(await sql_values(
+        db, "SELECT DISTINCT vehicle_type FROM products WHERE category = ?",
+        (CATEGORY,)
+    ))
+    for vehicle_type in vehicle_types:
+        subtypes, sizes = await db.get_vehicle_type_options(CATEGORY, vehicle_type)
+        assert list(subtypes) == sorted(await sql_values(
+            db,
+            "SELECT DISTINCT subtype FROM products WHERE category = ?"
+            " AND vehicle_type = ? AND subtype IS NOT NULL",
+            (CATEGORY, vehicle_type)
+        ))
+        assert list(sizes) == sorted(await sql_values(
+            db,
+            "SELECT DISTINCT size FROM products WHERE category = ?"
+            " AND vehicle_type = ?",
+            (CATEGORY, vehicle_type)
+        ))
+        for size in sizes:
+            # Без подтипа подходит товар любого подтипа этого размера
+            link, choices = await db.get_product_choice(
+                CATEGORY, vehicle_type, None, size
+            )
+            assert choices == sizes
+            assert link in await sql_values(
+                db,
+                "SELECT link FROM products WHERE category = ?"
+                " AND vehicle_type = ? AND size = ?",
+                (CATEGORY, vehicle_type, size)
+            )
+        for subtype in subtypes:
+            link_sizes = await db.get_sizes(CATEGORY, vehicle_type, subtype)
+            for size in link_sizes:
+                link, choices = await db.get_product_choice(
+                    CATEGORY, vehicle_type, subtype, size
+                )
+                assert choices == link_sizes
+                assert [link] == await sql_values(
+                    db,
+                    "SELECT link FROM products WHERE category = ?"
+                    " AND vehicle_type = ? AND subtype = ? AND size = ?",
+                    (CATEGORY, vehicle_type, subtype, size)
+                )
+
+
+def test_index_matches_sql_after_upsert(tmp_path):
+    """Индекс после добавления, обновления и импорта совпадает с базой"""
+    async def scenario():
+        db = await open_database(str(tmp_path / "catalog.db"))
+        try:
+            for row in PRODUCTS:
+                assert await db.add_product(product(*row))
+            await assert_matches_sql(db)
+
+            # Обновление ссылки по ключу товара и новый подтип
+            assert await db.add_product(
+                product("Легковые", "Летние", "R16", "https://shop/3-new")
+            )
+            assert await db.add_product(
+                product("Легковые", "Всесезонные", "R15", "https://shop/6")
+            )
+            result = await db.import_products([
+                product("Легковые", None, "R17", "https://shop/4-new"),
+                product("Грузовые", "Ведущие", "R22.5", "https://shop/7"),
+                product("Грузовые", None, "R22", "https://shop/5"),
+            ])
+            assert (result.inserted, result.updated, result.unchanged) == (1, 1, 1)
+            await assert_matches_sql(db)
+            assert await db.get_product_link(
+                CATEGORY, "Легковые", "Летние", "R16"
+            ) == "https://shop/3-new"
+
+            # Инкрементальные обновления дают то же, что полная загрузка
+            before = {
+                vehicle_type: (
+                    await db.get_vehicle_type_options(CATEGORY, vehicle_type),
+                    [
+                        await db.get_product_link(CATEGORY, vehicle_type, None, size)
+                        for size in await db.get_sizes(CATEGORY, vehicle_type)
+                    ],
+                )
+                for vehicle_type in await db.get_vehicle_types(CATEGORY)
+            }
+            await db.reload_catalog()
+            for vehicle_type, (options, links) in before.items():
+                assert await db.get_vehicle_type_options(
+                    CATEGORY, vehicle_type
+                ) == options
+                assert [
+                    await db.get_product_link(CATEGORY, vehicle_type, None, size)
+                    for size in await db.get_sizes(CATEGORY, vehicle_type)
+                ] == links
+        finally:
+            await db.disconnect()
+
+    asyncio.run(scenario())
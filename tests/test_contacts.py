@@ -0,0 +1,47 @@
+from handlers.contacts import ContactCards, render_card
+from keyboards.contacts_kb import get_locations_keyboard
+from utils.contacts_directory import SERVICE, STORE, ContactsDirectory
+from utils.records import ServicePoint
+
+
+def point(point_id: int, city: str, address: str, **fields) -> ServicePoint:
+    values = dict.fromkeys(ServicePoint._fields)
+    values.update(id=point_id, city=city, address=address, **fields)
+    return ServicePoint(**values)
+
+
+def test_cards_follow_directory():
+    """Карточки строятся при загрузке и пересобираются вместе с городом"""
+    directory = ContactsDirectory()
+    shop = point(1, "Алматы", "ул. Абая 1", phone_store="111")
+    service = point(2, "Алматы", "ул. Абая 2", phone_service="222")
+    directory.load([shop, service, point(3, "Астана", "пр. Мира 5")])
+    cards = ContactCards(directory)
+    directory.subscribe(cards.refresh)
+
+    card = cards.get("Алматы", "ул. Абая 1", STORE)
+    assert card.text == render_card(shop, STORE)
+    assert card.keyboard is get_locations_keyboard(("ул. Абая 1",))
+    # Карточка есть и для точки без выбранного типа
+    assert cards.get("Алматы", "ул. Абая 1", SERVICE).keyboard is (
+        get_locations_keyboard(("ул. Абая 2",))
+    )
+    assert cards.get("Алматы", "ул. Абая 3", STORE) is None
+
+    # Новая точка меняет клавиатуры всех карточек города
+    changed = point(4, "Алматы", "ул. Абая 2", phone_store="333")
+    directory.upsert(changed)
+    assert cards.get("Алматы", "ул. Абая 2", STORE).text == render_card(
+        changed, STORE
+    )
+    assert cards.get("Алматы", "ул. Абая 1", STORE).keyboard is (
+        get_locations_keyboard(("ул. Абая 1", "ул. Абая 2"))
+    )
+
+    # Город, которого нет в новой загрузке, исчезает вместе с карточками
+    directory.load([shop])
+    assert cards.get("Астана", "пр. Мира 5", STORE) is None
+    assert cards.get("Алматы", "ул. Абая 2", STORE) is None
+    assert cards.get("Алматы", "ул. Абая 1", STORE).text == render_card(
+        shop, STORE
+    )
@@ -0,0 +1,129 @@
+import asyncio
+import random
+
+from database import Database
+
+USERS = 20
+CLAIMERS = 50
+MANAGERS = (1, 2, 3)
+
+
+def user(user_id: int) -> dict:
+    return {
+        "user_id": user_id,
+        "first_name": f"Имя{user_id}",
+        "last_name": None,
+        "username": None,
+        "phone_number": None,
+        "birth_date": None,
+    }
+
+
+async def open_database(path: str) -> Database:
+    db = Database(path, wal=True)
+    await db.connect()
+    await db.init_db()
+    return db
+
+
+def test_claim_pending_chat_once(tmp_path):
+    """Каждый ожидающий чат принимает ровно один из конкурентов"""
+    async def scenario():
+        path = str(tmp_path / "claims.db")
+        first = await open_database(path)
+        # Второе подключение с отдельным писателем - как второй процесс
+        second = await open_database(path)
+        try:
+            chat_ids = []
+            for user_id in range(100, 100 + USERS):
+                assert await first.save_user(user(user_id))
+                chat_ids.append(await first.create_chat(user_id))
+
+            rng = random.Random(0)
+            claims = []
+            for i in range(CLAIMERS):
+                db = (first, second)[i % 2]
+                manager_id = MANAGERS[i % len(MANAGERS)]
+                # Половина берет самый ранний чат, половина - конкретный
+                chat_id = rng.choice(chat_ids) if i % 4 < 2 else None
+                claims.append(db.claim_pending_chat(manager_id, chat_id))
+            claimed = [chat for chat in await asyncio.gather(*claims) if chat]
+
+            claimed_ids = [chat.id for chat in claimed]
+            assert len(claimed_ids) == len(set(claimed_ids))
+            assert set(claimed_ids) <= set(chat_ids)
+            # Конкурентов больше, чем чатов, и половина берет любой чат:
+            # ожидающих не остается
+            assert set(claimed_ids) == set(chat_ids)
+            # Чаты, принятые через второе подключение, видны после reload
+            await first.reload()
+            for chat in claimed:
+                stored = await first.get_chat_by_id(chat.id)
+                assert stored.status == "active"
+                assert stored.manager_id == chat.manager_id
+            assert await first.claim_pending_chat(MANAGERS[0]) is None
+        finally:
+            await second.disconnect()
+            await first.disconnect()
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_persists_buffered_rows(tmp_path):
+    """Строки из буферов записываются при disconnect без потерь и по порядку"""
+    # Не кратно размерам пачек: остаток пишется только при закрытии
+    rows = 1234
+
+    async def scenario():
+        path = str(tmp_path / "buffers.db")
+        # Таймер записи не срабатывает до disconnect
+        db = Database(path, wal=True, message_flush_interval=60)
+        await db.connect()
+        await db.init_db()
+        db.user_logs.flush_interval = 60
+        assert await db.save_user(user(100))
+        for i in range(rows):
+            assert await db.save_message(1, 100, f"сообщение {i}")
+            assert await db.save_user_log(100, "action", f"запись {i}")
+        await db.disconnect()
+
+        db = await open_database(path)
+        try:
+            async with db.pool.acquire() as connection:
+                cursor = await connection.execute(
+                    "SELECT message_text FROM messages ORDER BY id"
+                )
+                messages = [row[0] for row in await cursor.fetchall()]
+                cursor = await connection.execute(
+                    "SELECT details FROM user_logs ORDER BY id"
+                )
+                logs = [row[0] for row in await cursor.fetchall()]
+        finally:
+            await db.disconnect()
+        assert messages == [f"сообщение {i}" for i in range(rows)]
+        assert logs == [f"запись {i}" for i in range(rows)]
+
+    asyncio.run(scenario())
+
+
+def test_rejected_chats_leave_registry(tmp_path):
+    """Отклоненные чаты не остаются в реестре ни сразу, ни после reload"""
+    async def scenario():
+        db = await open_database(str(tmp_path / "sessions.db"))
+        try:
+            for user_id in (100, 101):
+                assert await db.save_user(user(user_id))
+            rejected = await db.create_chat(100)
+            pending = await db.create_chat(101)
+            assert await db.update_chat_status(rejected, "rejected")
+            for _ in range(2):
+                assert db.sessions.chat(rejected) is None
+                assert await db.get_chat(100) is None
+                assert [chat.id for chat in db.sessions.chats()] == [pending]
+                await db.reload()
+            # Из базы отклоненный чат по-прежнему читается
+            assert (await db.get_chat_by_id(rejected)).status == "rejected"
+        finally:
+            await db.disconnect()
+
+    asyncio.run(scenario())
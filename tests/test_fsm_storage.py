@@ -0,0 +1,88 @@
+import asyncio
+import json
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from tests.test_database import open_database
+from utils.fsm_storage import SQLiteStorage, _timestamp, fsm_key
+from utils.records import FSMState
+
+DAY = 24 * 3600
+
+
+def storage_key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+
+
+async def stored_keys(db) -> list:
+    async with db.pool.acquire() as connection:
+        cursor = await connection.execute("SELECT key FROM fsm_states ORDER BY key")
+        return [row[0] for row in await cursor.fetchall()]
+
+
+def test_state_survives_close_and_reopen(tmp_path):
+    """Состояние и данные переживают close() хранилища и переоткрытие базы"""
+    path = str(tmp_path / "fsm.db")
+
+    async def scenario():
+        db = await open_database(path)
+        # Фоновая запись не успевает сработать: все пишет close()
+        storage = SQLiteStorage(flush_interval=60)
+        await storage.start(db)
+        await storage.set_state(storage_key(1), "ManagerStates:chat_message")
+        await storage.set_data(storage_key(1), {"city": "Алматы", "page": 2})
+        await storage.set_state(storage_key(2), "ContactsStates:city")
+        # Пустое состояние удаляет строку
+        await storage.set_state(storage_key(2), None)
+        await storage.close()
+        await db.disconnect()
+
+        db = await open_database(path)
+        try:
+            assert await stored_keys(db) == [fsm_key(storage_key(1))]
+            storage = SQLiteStorage()
+            await storage.start(db)
+            assert await storage.get_state(storage_key(1)) == (
+                "ManagerStates:chat_message"
+            )
+            assert await storage.get_data(storage_key(1)) == {
+                "city": "Алматы", "page": 2
+            }
+            assert await storage.get_state(storage_key(2)) is None
+            await storage.close()
+        finally:
+            await db.disconnect()
+
+    asyncio.run(scenario())
+
+
+def test_purge_drops_expired_rows(tmp_path):
+    """Строки, не менявшиеся дольше state_ttl, удаляются из базы"""
+    async def scenario():
+        db = await open_database(str(tmp_path / "purge.db"))
+        try:
+            now = time.time()
+            assert await db.save_fsm_states([
+                FSMState(fsm_key(storage_key(1)), "Old:state", json.dumps({}),
+                         _timestamp(now - 8 * DAY)),
+                FSMState(fsm_key(storage_key(2)), "Fresh:state", json.dumps({}),
+                         _timestamp(now - DAY)),
+            ])
+            storage = SQLiteStorage(
+                flush_interval=0.01, state_ttl=7 * DAY, purge_interval=0
+            )
+            await storage.start(db)
+            for _ in range(100):
+                if len(await stored_keys(db)) == 1:
+                    break
+                await asyncio.sleep(0.01)
+            await storage.close()
+            assert await stored_keys(db) == [fsm_key(storage_key(2))]
+            # Устаревшее состояние не возвращается и после удаления строки
+            assert await storage.get_state(storage_key(1)) is None
+            assert await storage.get_state(storage_key(2)) == "Fresh:state"
+        finally:
+            await db.disconnect()
+
+    asyncio.run(scenario())
@@ -0,0 +1,152 @@
+import asyncio
+
+import aiosqlite
+
+from database import Database
+from utils import migrations
+
+LATEST = migrations.MIGRATIONS[-1][0]
+
+# Таблицы до нумерованных миграций: торговые точки без UNIQUE(city,
+# address), товары без уникального ключа, чаты без accepted_at
+LEGACY_SCHEMA = """
+    CREATE TABLE service_points (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        city TEXT NOT NULL,
+        address TEXT NOT NULL,
+        phone_store TEXT,
+        phone_service TEXT,
+        work_schedule_weekdays TEXT,
+        work_schedule_weekend TEXT,
+        service_schedule_weekdays TEXT,
+        service_schedule_weekend TEXT,
+        service_manager_name TEXT,
+        maps_2gis_link TEXT,
+        google_maps_link TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category TEXT NOT NULL,
+        vehicle_type TEXT NOT NULL,
+        subtype TEXT,
+        size TEXT NOT NULL,
+        link TEXT NOT NULL
+    );
+    CREATE TABLE chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        manager_id INTEGER,
+        status TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        closed_at TIMESTAMP
+    );
+    INSERT INTO service_points (id, city, address, phone_store)
+    VALUES (7, 'Алматы', 'ул. Абая 1', '111'), (9, 'Астана', 'пр. Мира 5', NULL);
+    INSERT INTO products (id, category, vehicle_type, subtype, size, link)
+    VALUES (1, 'Шины', 'Легковые', NULL, 'R15', 'https://shop/1'),
+           (2, 'Шины', 'Легковые', NULL, 'R15', 'https://shop/2'),
+           (3, 'Шины', 'Легковые', 'Летние', 'R15', 'https://shop/3');
+"""
+
+
+def count_steps(monkeypatch) -> dict:
+    """Подмена шагов миграции на считающие свои вызовы"""
+    calls = {}
+
+    def counted(number, migration):
+        async def step(connection):
+            calls[number] = calls.get(number, 0) + 1
+            await migration(connection)
+        step.__doc__ = migration.__doc__
+        return number, step
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", [
+        counted(number, migration)
+        for number, migration in migrations.MIGRATIONS
+    ])
+    return calls
+
+
+async def migrate_database(path: str) -> int:
+    db = Database(path, wal=True)
+    await db.connect()
+    try:
+        return await db.migrate()
+    finally:
+        await db.disconnect()
+
+
+async def query(path: str, sql: str) -> list:
+    async with aiosqlite.connect(path) as connection:
+        cursor = await connection.execute(sql)
+        return await cursor.fetchall()
+
+
+def test_migrate_from_empty_database(tmp_path, monkeypatch):
+    """Пустая база доводится до последней версии, повтор ничего не делает"""
+    calls = count_steps(monkeypatch)
+    path = str(tmp_path / "empty.db")
+
+    async def scenario():
+        assert await migrate_database(path) == LATEST
+        assert await migrate_database(path) == LATEST
+        tables = {row[0] for row in await query(
+            path, "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )}
+        assert {"service_points", "products", "users", "chats",
+                "fsm_states"} <= tables
+
+    asyncio.run(scenario())
+    assert calls == {number: 1 for number in range(1, LATEST + 1)}
+
+
+def test_migrate_legacy_tables(tmp_path):
+    """Старые таблицы перестраиваются с сохранением строк"""
+    path = str(tmp_path / "legacy.db")
+
+    async def scenario():
+        async with aiosqlite.connect(path) as connection:
+            await connection.executescript(LEGACY_SCHEMA)
+        assert await migrate_database(path) == LATEST
+
+        async with aiosqlite.connect(path) as connection:
+            assert await migrations._has_unique_index(
+                connection, "service_points", ("city", "address")
+            )
+            assert await migrations._has_column(connection, "chats", "accepted_at")
+        assert await query(
+            path, "SELECT id, city, address, phone_store FROM service_points ORDER BY id"
+        ) == [(7, "Алматы", "ул. Абая 1", "111"), (9, "Астана", "пр. Мира 5", None)]
+        # Из повторов ключа товара остается первый
+        assert await query(path, "SELECT id FROM products ORDER BY id") == [(1,), (3,)]
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_migrate_applies_each_step_once(tmp_path, monkeypatch):
+    """Несколько соединений мигрируют одну базу одновременно"""
+    calls = count_steps(monkeypatch)
+    path = str(tmp_path / "shared.db")
+
+    async def scenario():
+        versions = await asyncio.gather(*(migrate_database(path) for _ in range(4)))
+        assert versions == [LATEST] * 4
+
+    asyncio.run(scenario())
+    assert calls == {number: 1 for number in range(1, LATEST + 1)}
+
+    # Версия, прочитанная до чужой миграции, перечитывается под блокировкой
+    read_version = migrations.get_schema_version
+    stale = []
+
+    async def stale_version(connection):
+        if not stale:
+            stale.append(True)
+            return 0
+        return await read_version(connection)
+
+    monkeypatch.setattr(migrations, "get_schema_version", stale_version)
+    assert asyncio.run(migrate_database(path)) == LATEST
+    assert calls == {number: 1 for number in range(1, LATEST + 1)}
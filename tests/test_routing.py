@@ -0,0 +1,77 @@
+from utils.records import Chat
+from utils.routing import PRIORITY_RETRY, ManagerRouting
+
+
+def chat(chat_id: int, status: str, manager_id=None) -> Chat:
+    values = dict.fromkeys(Chat._fields)
+    values.update(id=chat_id, user_id=100 + chat_id, status=status,
+                  manager_id=manager_id)
+    return Chat(**values)
+
+
+def test_capacity_limits_assignments():
+    """Менеджер получает не больше capacity чатов, остальные ждут"""
+    routing = ManagerRouting((1, 2), capacity=2)
+    for chat_id in range(1, 6):
+        routing.enqueue(chat_id)
+
+    assignments = routing.dispatch()
+    assert len(assignments) == 4
+    assert routing.manager_load(1) == routing.manager_load(2) == 2
+    assert routing.queue_position(5) == 1
+    assert routing.dispatch() == []
+
+    # Принятый чат тоже занимает место, закрытый освобождает его
+    chat_id, manager_id = assignments[0]
+    assert routing.accept(manager_id, chat_id)
+    assert routing.dispatch() == []
+    routing.release(chat_id)
+    assert routing.dispatch() == [(5, manager_id)]
+    assert routing.queue_position(5) is None
+
+
+def test_least_loaded_manager_with_tie_break():
+    """Чат уходит наименее загруженному; при равенстве - дольше ждавшему"""
+    routing = ManagerRouting((1, 2, 3), capacity=3)
+    routing.load([chat(1, "active", manager_id=1)])
+    assert routing.active_chats(1) == (1,)
+    for chat_id in (10, 11):
+        routing.enqueue(chat_id)
+    # Менеджер 1 занят, поэтому чаты получают свободные 2 и 3
+    assert routing.dispatch() == [(10, 2), (11, 3)]
+
+    routing = ManagerRouting((1, 2, 3), capacity=1)
+    for chat_id in (10, 11, 12):
+        routing.enqueue(chat_id)
+    assert routing.dispatch() == [(10, 1), (11, 2), (12, 3)]
+    routing.release(10)
+    routing.enqueue(13)
+    assert routing.dispatch() == [(13, 1)]
+    # Свободны 1 и 3; менеджер 3 получил чат раньше, чем 1 - последний
+    routing.release(13)
+    routing.release(12)
+    routing.enqueue(14)
+    assert routing.dispatch() == [(14, 3)]
+
+
+def test_retry_priority_after_rejected_offer():
+    """Чат, предложение которого сорвалось, раздается раньше очереди"""
+    routing = ManagerRouting((1,), capacity=1)
+    # После перезапуска: чат 2 уже предложен менеджеру, более ранний 1 ждет
+    routing.load([chat(1, "pending"), chat(2, "pending", manager_id=1)])
+    assert routing.offered(1) == 2
+    assert routing.queue_position(1) == 1
+
+    # Предложение сорвалось: чат 2 встает перед ждущим чатом 1
+    routing.release(2)
+    routing.enqueue(2, PRIORITY_RETRY)
+    assert routing.queue_position(2) == 1
+    assert routing.queue_position(1) == 2
+    assert routing.dispatch() == [(2, 1)]
+
+    # Менеджер отклонил чат: место освобождается для следующего в очереди
+    routing.release(2)
+    assert routing.dispatch() == [(1, 1)]
+    # Повторная постановка уже назначенного чата игнорируется
+    routing.enqueue(1, PRIORITY_RETRY)
+    assert routing.queue_position(1) is None
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from utils.tasks import TaskSupervisor
+
+
+def test_submit_or_run_after_close():
+    """После close() задачи выполняются, порядок внутри ключа сохраняется"""
+    async def scenario():
+        tasks = TaskSupervisor(name="test")
+        done = []
+        release = asyncio.Event()
+
+        async def job(name, wait=False):
+            if wait:
+                await release.wait()
+            done.append(name)
+
+        tasks.submit(job("first", wait=True), key=1)
+        await asyncio.sleep(0)
+        closing = asyncio.create_task(tasks.close())
+        await asyncio.sleep(0)
+
+        with pytest.raises(RuntimeError):
+            tasks.submit(job("rejected"), key=2)
+        # Ключа 2 в очереди нет - задача выполняется на месте
+        await tasks.submit_or_run(job("inline"), key=2)
+        assert done == ["inline"]
+        # Ключ 1 еще работает - задача встает за ним
+        await tasks.submit_or_run(job("second"), key=1)
+        assert not closing.done()
+
+        release.set()
+        await closing
+        assert done == ["inline", "first", "second"]
+        assert tasks.pending == 0
+
+    asyncio.run(scenario())
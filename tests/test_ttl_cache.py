@@ -0,0 +1,53 @@
+from utils import ttl_cache
+from utils.ttl_cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_expired_entry_is_cached_again_after_read(monkeypatch):
+    """Последняя запись в кэше: после устаревания чтение снова кэшируется"""
+    clock = Clock()
+    monkeypatch.setattr(ttl_cache.time, "monotonic", clock)
+    cache = TTLCache(ttl=10)
+
+    sequence = cache.begin_write(1)
+    cache.end_write(sequence)
+    cache.store(1, "записано", sequence)
+    assert cache.get(1) == "записано"
+
+    clock.now = 11
+    assert cache.get(1) is None
+    # Других записей не было: прочитанное из базы значение принимается
+    cache.fill(1, "прочитано", cache.token())
+    assert cache.get(1) == "прочитано"
+
+
+def test_fill_skips_values_racing_with_writes():
+    """Чтение, пересекшееся с записью ключа, в кэш не попадает"""
+    cache = TTLCache()
+
+    # Запись началась после получения токена
+    token = cache.token()
+    sequence = cache.begin_write(1)
+    cache.fill(1, "старое", token)
+    assert cache.get(1) is None
+
+    # Запись началась до токена, но еще не завершилась
+    cache.fill(1, "старое", cache.token())
+    assert cache.get(1) is None
+
+    cache.end_write(sequence)
+    cache.fill(1, "новое", cache.token())
+    assert cache.get(1) == "новое"
+    # Запись другого ключа не мешает
+    cache.discard(1)
+    token = cache.token()
+    cache.end_write(cache.begin_write(2))
+    cache.fill(1, "новое", token)
+    assert cache.get(1) == "новое"
@@ -0,0 +1,115 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from utils.webhook import WebhookHandler
+
+SECRET = "s3cret"
+PATH = "/webhook"
+
+
+def message_update(update_id: int, user_id: int) -> dict:
+    """Апдейт с текстовым сообщением от пользователя"""
+    sender = {"id": user_id, "is_bot": False, "first_name": "Test"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": sender,
+            "text": "ping",
+        },
+    }
+
+
+def run_webhook_scenario(scenario, max_pending: int = 10000):
+    """Запуск сценария против тестового сервера с WebhookHandler"""
+    async def main():
+        release = asyncio.Event()
+        handled = []
+        dispatcher = Dispatcher()
+
+        @dispatcher.message()
+        async def on_message(message):
+            await release.wait()
+            handled.append(message.message_id)
+
+        bot = Bot("123456:TEST")
+        handler = WebhookHandler(
+            dispatcher, bot, SECRET, max_pending=max_pending
+        )
+        app = web.Application()
+        handler.register(app, path=PATH)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            await scenario(client, handler, release, handled)
+        finally:
+            release.set()
+            await handler.close()
+            await client.close()
+            await bot.session.close()
+
+    asyncio.run(main())
+
+
+def test_secret_token_required():
+    """Без секретного токена или с чужим апдейт не принимается"""
+    async def scenario(client, handler, release, handled):
+        update = message_update(1, 10)
+        response = await client.post(PATH, json=update)
+        assert response.status in (401, 403)
+        response = await client.post(
+            PATH, json=update,
+            headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+        )
+        assert response.status in (401, 403)
+        assert handler.workers.pending == 0
+
+        response = await client.post(
+            PATH, json=update,
+            headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        )
+        assert response.status == 200
+        release.set()
+        while handler.workers.pending:
+            await asyncio.sleep(0.01)
+        assert handled == [1]
+
+    run_webhook_scenario(scenario)
+
+
+def test_overload_answers_503():
+    """Сверх max_pending апдейтов в работе ответ 503, потом прием снова"""
+    async def scenario(client, handler, release, handled):
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        for update_id in (1, 2):
+            response = await client.post(
+                PATH, json=message_update(update_id, update_id),
+                headers=headers
+            )
+            assert response.status == 200
+        assert handler.workers.pending == 2
+
+        response = await client.post(
+            PATH, json=message_update(3, 3), headers=headers
+        )
+        assert response.status == 503
+        assert handler.rejected == 1
+
+        # Апдейты в работе завершились - Telegram может повторить доставку
+        release.set()
+        while handler.workers.pending:
+            await asyncio.sleep(0.01)
+        response = await client.post(
+            PATH, json=message_update(3, 3), headers=headers
+        )
+        assert response.status == 200
+        while handler.workers.pending:
+            await asyncio.sleep(0.01)
+        assert sorted(handled) == [1, 2, 3]
+
+    run_webhook_scenario(scenario, max_pending=2)
@@ -0,0 +1,105 @@
+import asyncio
+import datetime
+
+from aiogram.types import Chat, Message, Update, User
+
+from utils.workers import SUPPORT_WORKER, WorkerPool, shard
+
+PROCESSES = 2
+# Пользователь с ожидающим чатом, чей процесс по ID - не процесс поддержки
+USER_ID = 105
+
+
+class FakeWorker:
+    """Процесс-обработчик без подпроцесса: запоминает полученные апдейты.
+
+    Как настоящий процесс после запуска, не-поддержка не знает о чатах,
+    созданных в процессе поддержки.
+    """
+
+    def __init__(self, index: int, handled: list, open_chats: set):
+        self.index = index
+        self.handled = handled
+        self.open_chats = open_chats
+        self.alive = True
+
+    async def start(self):
+        pass
+
+    async def wait_healthy(self) -> bool:
+        return True
+
+    async def healthy(self) -> bool:
+        return True
+
+    async def drain(self):
+        pass
+
+    async def stop(self):
+        self.alive = False
+
+    async def request(self, method, path, body=None, **params):
+        if path == "/update":
+            user_id = params["user"]
+            self.handled.append(self.index)
+            support = self.index == SUPPORT_WORKER and user_id in self.open_chats
+            return {"ok": True, "support": support}
+        return {"ok": True}
+
+
+class FakePool(WorkerPool):
+    def __init__(self, handled: list, open_chats: set, **kwargs):
+        super().__init__([], PROCESSES, **kwargs)
+        self.handled = handled
+        self.open_chats = open_chats
+
+    def _spawn(self, slot):
+        slot.generation += 1
+        return FakeWorker(slot.index, self.handled, self.open_chats)
+
+
+def message_update(update_id: int, user_id: int) -> Update:
+    user = User(id=user_id, is_bot=False, first_name="Имя")
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id,
+        date=datetime.datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=user,
+        text="Здравствуйте",
+    ))
+
+
+def test_open_chat_routes_to_support_after_restart():
+    """Пользователь с открытым чатом попадает в процесс поддержки и после
+    запуска супервизора, и после замены процессов"""
+    assert shard(USER_ID, PROCESSES) != SUPPORT_WORKER
+
+    async def scenario():
+        open_chats = {USER_ID}
+
+        async def open_chat_users():
+            return list(open_chats)
+
+        handled = []
+        pool = FakePool(handled, open_chats, support_loader=open_chat_users)
+        await pool.start()
+        try:
+            await pool.dispatch(message_update(1, USER_ID))
+            for index in range(PROCESSES):
+                assert await pool.restart(index)
+                await pool.dispatch(message_update(2 + index, USER_ID))
+        finally:
+            await pool.close()
+        assert handled == [SUPPORT_WORKER] * (1 + PROCESSES)
+
+        # Без списка открытых чатов первый апдейт ушел бы в процесс по ID
+        handled.clear()
+        pool = FakePool(handled, open_chats)
+        await pool.start()
+        try:
+            await pool.dispatch(message_update(1, USER_ID))
+        finally:
+            await pool.close()
+        assert handled == [shard(USER_ID, PROCESSES)]
+
+    asyncio.run(scenario())
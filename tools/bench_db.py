@@ -0,0 +1,427 @@
+"""Бенчмарк слоя хранения Database на синтетических данных.
+
+Скрипт строит временную базу заданного масштаба, вызывает каждый
+публичный метод Database сначала одним вызывающим, затем N конкурентными
+корутинами, и выводит перцентили задержки и пропускную способность
+в формате JSON, чтобы результаты до и после изменения можно было сравнить.
+
+Масштаб --rows - число строк в самых больших таблицах (messages,
+user_logs); остальные таблицы заполняются пропорционально, см.
+DATASET_SHAPE.
+
+Запуск из корня проекта:
+    python -m tools.bench_db --rows 10000 100000 [--concurrency 16]
+        [--calls 1000] [--wal] [--data-dir /tmp/bench] [--output result.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from database import Database
+from tools.check_query_plans import public_methods
+from utils.logger import logger
+from utils.records import FSMState
+
+
+# Доля строк каждой таблицы от масштаба --rows
+DATASET_SHAPE = {
+    "users": 0.1,
+    "chats": 0.1,
+    "chat_ratings": 0.05,
+    "messages": 1.0,
+    "user_logs": 1.0,
+    "products": 0.01,
+    "fsm_states": 0.1,
+}
+SERVICE_POINTS = 200
+MANAGERS = 20
+CITIES = ("Алматы", "Астана", "Шымкент", "Караганда", "Актобе")
+CATEGORIES = ("Шины", "Диски")
+VEHICLE_TYPES = ("Легковые", "Грузовые", "Внедорожники", "Мото", "Спецтехника")
+SUBTYPES = ("Летние", "Зимние", "Всесезонные", "Литые", "Штампованные")
+CHAT_STATUSES = ("closed",) * 8 + ("active", "pending")
+
+
+class Dataset:
+    """Размеры таблиц и генератор случайных аргументов для вызовов"""
+
+    def __init__(self, rows: int, seed: int = 0):
+        self.rows = rows
+        self.counts = {
+            table: max(1, int(rows * share))
+            for table, share in DATASET_SHAPE.items()
+        }
+        self.random = random.Random(seed)
+
+    def user_id(self) -> int:
+        return self.random.randint(1, self.counts["users"])
+
+    def chat_id(self) -> int:
+        return self.random.randint(1, self.counts["chats"])
+
+    def fsm_key(self) -> str:
+        return fsm_key(self.user_id())
+
+    def manager_id(self) -> int:
+        return self.random.randint(1, MANAGERS)
+
+    def city(self) -> str:
+        return self.random.choice(CITIES)
+
+    def address(self) -> str:
+        return f"ул. Тестовая {self.random.randint(1, SERVICE_POINTS)}"
+
+    def product_key(self) -> Tuple[str, str, str, str]:
+        i = self.random.randint(0, self.counts["products"] - 1)
+        return product_key(i)
+
+    def product(self) -> Dict:
+        category, vehicle_type, subtype, size = self.product_key()
+        return {
+            "category": category,
+            "vehicle_type": vehicle_type,
+            "subtype": subtype,
+            "size": size,
+            "link": f"https://example.com/p/{self.random.random()}",
+        }
+
+
+def product_key(i: int) -> Tuple[str, str, str, str]:
+    """Уникальный ключ i-го синтетического товара"""
+    return (
+        CATEGORIES[i % len(CATEGORIES)],
+        VEHICLE_TYPES[i // len(CATEGORIES) % len(VEHICLE_TYPES)],
+        SUBTYPES[i % len(SUBTYPES)],
+        f"R{i}",
+    )
+
+
+def fsm_key(user_id: int) -> str:
+    """Ключ состояния FSM пользователя в личном чате"""
+    return f"42:{user_id}:{user_id}::default"
+
+
+# Аргументы для каждого публичного метода Database
+CALLS: Dict[str, Callable[[Dataset], tuple]] = {
+    "get_all_cities": lambda d: (),
+    "get_locations_by_city": lambda d: (
+        d.city(), d.random.choice(("Магазин", "Сервис"))
+    ),
+    "get_location_info": lambda d: (d.city(), d.address()),
+    "add_service_point": lambda d: ({
+        "city": d.city(),
+        "address": d.address(),
+        "phone_store": "+7 (727) 000-00-00",
+    },),
+    "get_vehicle_types": lambda d: (d.random.choice(CATEGORIES),),
+    "get_subtypes": lambda d: d.product_key()[:2],
+    "get_vehicle_type_options": lambda d: d.product_key()[:2],
+    "get_sizes": lambda d: d.product_key()[:3],
+    "get_product_link": lambda d: d.product_key(),
+    "get_product_choice": lambda d: d.product_key(),
+    "add_product": lambda d: (d.product(),),
+    "import_products": lambda d: ([d.product() for _ in range(100)],),
+    "get_user": lambda d: (d.user_id(),),
+    "save_user": lambda d: ({
+        "user_id": d.user_id(),
+        "first_name": "Имя",
+        "username": "user",
+    },),
+    "create_contact_request": lambda d: (d.user_id(), "call"),
+    "update_user": lambda d: (d.user_id(), {"phone_number": "+77010000000"}),
+    "create_chat": lambda d: (d.user_id(), d.manager_id()),
+    "assign_chat": lambda d: (d.chat_id(), d.manager_id()),
+    "get_chat": lambda d: (d.user_id(),),
+    "update_chat_status": lambda d: (d.chat_id(), "active"),
+    "accept_chat": lambda d: (d.chat_id(),),
+    "claim_pending_chat": lambda d: (d.manager_id(),),
+    "get_pending_chats": lambda d: (),
+    "get_open_chat_users": lambda d: (),
+    "get_active_chat": lambda d: (d.user_id(),),
+    "save_message": lambda d: (d.chat_id(), d.user_id(), "Здравствуйте"),
+    "close_chat": lambda d: (d.chat_id(),),
+    "get_chat_by_id": lambda d: (d.chat_id(),),
+    "get_active_chat_by_manager": lambda d: (d.manager_id(),),
+    "save_user_log": lambda d: (d.user_id(), "send_message", "Здравствуйте"),
+    "get_user_logs": lambda d: (d.user_id(), 10),
+    "save_chat_rating": lambda d: (d.chat_id(), d.random.randint(1, 5)),
+    "get_manager_rating": lambda d: (d.manager_id(),),
+    "get_fsm_state": lambda d: (d.fsm_key(),),
+    "save_fsm_states": lambda d: ([
+        FSMState(d.fsm_key(), "CatalogStates:size",
+                 '{"category": "Диски"}', "2024-01-02 10:00:00")
+        for _ in range(50)
+    ],),
+    "delete_expired_fsm_states": lambda d: ("2023-01-01 00:00:00",),
+}
+
+
+class ErrorCounter(logging.Handler):
+    """Подсчет ошибок, которые методы Database пишут в лог"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
+
+
+def populate(db_path: str, dataset: Dataset):
+    """Заполнение таблиц синтетическими строками"""
+    counts = dataset.counts
+    rng = random.Random(1)
+    created_at = "2024-01-01 10:00:00"
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA synchronous = OFF")
+    with connection:
+        connection.executemany(
+            "INSERT INTO service_points (city, address, phone_store, "
+            "phone_service) VALUES (?, ?, ?, ?)",
+            (
+                (CITIES[i % len(CITIES)], f"ул. Тестовая {i}",
+                 "+7 (727) 000-00-00", "+7 (727) 000-00-01" if i % 2 else None)
+                for i in range(1, SERVICE_POINTS + 1)
+            )
+        )
+        connection.executemany(
+            "INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (i, f"Имя{i}", f"Фамилия{i}", f"user{i}", f"+7701{i:07d}",
+                 None, created_at, created_at)
+                for i in range(1, counts["users"] + 1)
+            )
+        )
+        connection.executemany(
+            "INSERT INTO chats (user_id, manager_id, status, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                (rng.randint(1, counts["users"]), rng.randint(1, MANAGERS),
+                 rng.choice(CHAT_STATUSES), created_at)
+                for _ in range(counts["chats"])
+            )
+        )
+        connection.executemany(
+            "INSERT INTO chat_ratings (chat_id, rating) VALUES (?, ?)",
+            (
+                (rng.randint(1, counts["chats"]), rng.randint(1, 5))
+                for _ in range(counts["chat_ratings"])
+            )
+        )
+        connection.executemany(
+            "INSERT INTO messages (chat_id, sender_id, message_text, "
+            "created_at) VALUES (?, ?, ?, ?)",
+            (
+                (rng.randint(1, counts["chats"]),
+                 rng.randint(1, counts["users"]), f"Сообщение {i}", created_at)
+                for i in range(counts["messages"])
+            )
+        )
+        connection.executemany(
+            "INSERT INTO user_logs (user_id, action, details, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                (rng.randint(1, counts["users"]), "send_message",
+                 f"Действие {i}", created_at)
+                for i in range(counts["user_logs"])
+            )
+        )
+        connection.executemany(
+            "INSERT INTO products (category, vehicle_type, subtype, size, "
+            "link) VALUES (?, ?, ?, ?, ?)",
+            (
+                (*product_key(i), f"https://example.com/p/{i}")
+                for i in range(counts["products"])
+            )
+        )
+        connection.executemany(
+            "INSERT INTO fsm_states (key, state, data, updated_at) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                (fsm_key(i), "CatalogStates:category", "{}", created_at)
+                for i in range(1, counts["fsm_states"] + 1)
+            )
+        )
+    connection.execute("ANALYZE")
+    connection.close()
+
+
+async def prepare(db_path: str, dataset: Dataset, wal: bool):
+    """Создание схемы миграциями и заполнение базы, если ее еще нет"""
+    if Path(db_path).exists():
+        return
+    db = Database(db_path, wal=wal)
+    await db.connect()
+    await db.init_db()
+    await db.disconnect()
+    populate(db_path, dataset)
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int) -> Dict:
+    """Перцентили задержки в миллисекундах и пропускная способность"""
+    ordered = sorted(latencies)
+    cuts = statistics.quantiles(ordered, n=100, method="inclusive")
+    return {
+        "calls": len(ordered),
+        "errors": errors,
+        "throughput_per_s": round(len(ordered) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+        "p50_ms": round(cuts[49] * 1000, 4),
+        "p90_ms": round(cuts[89] * 1000, 4),
+        "p99_ms": round(cuts[98] * 1000, 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+    }
+
+
+async def run_method(
+    db: Database, dataset: Dataset, name: str, calls: int,
+    concurrency: int, errors: ErrorCounter
+) -> Dict:
+    """Серия вызовов одного метода от concurrency корутин"""
+    method = getattr(db, name)
+    make_args = CALLS[name]
+    latencies: List[float] = []
+    per_caller = max(1, calls // concurrency)
+
+    async def caller():
+        for _ in range(per_caller):
+            args = make_args(dataset)
+            started = time.perf_counter()
+            await method(*args)
+            latencies.append(time.perf_counter() - started)
+
+    errors.count = 0
+    started = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, errors.count)
+
+
+async def bench_scale(
+    db_path: str, rows: int, calls: int, concurrency: int, wal: bool
+) -> Dict:
+    """Все методы на одном масштабе данных"""
+    dataset = Dataset(rows)
+    started = time.perf_counter()
+    await prepare(db_path, dataset, wal)
+    prepare_seconds = time.perf_counter() - started
+
+    db = Database(db_path, pool_size=max(4, min(concurrency, 16)), wal=wal)
+    await db.connect()
+    started = time.perf_counter()
+    await db.init_db()
+    init_seconds = time.perf_counter() - started
+
+    errors = ErrorCounter()
+    logger.addHandler(errors)
+    methods = {}
+    try:
+        for name in sorted(CALLS):
+            methods[name] = {
+                "single": await run_method(
+                    db, dataset, name, calls, 1, errors
+                ),
+                "concurrent": await run_method(
+                    db, dataset, name, calls, concurrency, errors
+                ),
+            }
+    finally:
+        logger.removeHandler(errors)
+        started = time.perf_counter()
+        await db.disconnect()
+        disconnect_seconds = time.perf_counter() - started
+
+    return {
+        "rows": rows,
+        "tables": dataset.counts,
+        "file_bytes": Path(db_path).stat().st_size,
+        "prepare_s": round(prepare_seconds, 3),
+        "init_db_s": round(init_seconds, 3),
+        "disconnect_s": round(disconnect_seconds, 3),
+        "methods": methods,
+    }
+
+
+async def run(args) -> Dict:
+    result = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "wal": args.wal,
+        "calls": args.calls,
+        "concurrency": args.concurrency,
+        "scales": [],
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = Path(args.data_dir or temp_dir)
+        data_dir.mkdir(parents=True, exist_ok=True)
+        for rows in args.rows:
+            suffix = "wal" if args.wal else "rollback"
+            db_path = str(data_dir / f"bench_{rows}_{suffix}.db")
+            print(f"Масштаб {rows} строк...", file=sys.stderr)
+            result["scales"].append(await bench_scale(
+                db_path, rows, args.calls, args.concurrency, args.wal
+            ))
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000],
+        help="масштабы данных, например 10000 100000 1000000 10000000"
+    )
+    parser.add_argument(
+        "--calls", type=int, default=1000,
+        help="число вызовов каждого метода в каждом режиме"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16,
+        help="число конкурентных корутин во втором режиме"
+    )
+    parser.add_argument("--wal", action="store_true", help="режим WAL")
+    parser.add_argument(
+        "--data-dir",
+        help="каталог для баз; готовые базы переиспользуются между запусками"
+    )
+    parser.add_argument("--output", help="файл для JSON вместо stdout")
+    args = parser.parse_args()
+
+    missing = sorted(set(public_methods()) - set(CALLS))
+    if missing:
+        print(
+            f"Нет аргументов для методов: {', '.join(missing)}",
+            file=sys.stderr
+        )
+        return 1
+
+    # Консольный лог мешал бы выводу JSON
+    logger.setLevel(logging.ERROR)
+    for handler in logger.handlers:
+        if isinstance(handler, logging.StreamHandler) and \
+                not isinstance(handler, logging.FileHandler):
+            handler.setLevel(logging.CRITICAL)
+
+    result = asyncio.run(run(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
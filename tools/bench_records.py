@@ -0,0 +1,113 @@
+"""Микробенчмарк записей: dict(zip(columns, row)) против NamedTuple.
+
+Сравнивает время выборки строк из SQLite и память, занимаемую
+закэшированными записями, для старого и нового способа.
+
+Запуск из корня проекта:
+    python -m tools.bench_records [--rows 100000]
+"""
+import argparse
+import sqlite3
+import time
+import tracemalloc
+from typing import Callable, List
+
+from utils.records import Chat, ServicePoint, User, row_factory
+
+
+def make_connection(rows: int) -> sqlite3.Connection:
+    """Временная база в памяти с пользователями, чатами и точками"""
+    connection = sqlite3.connect(":memory:")
+    connection.execute(
+        "CREATE TABLE users (user_id INTEGER PRIMARY KEY, first_name TEXT, "
+        "last_name TEXT, username TEXT, phone_number TEXT, birth_date TEXT, "
+        "created_at TEXT, updated_at TEXT)"
+    )
+    connection.execute(
+        "CREATE TABLE chats (id INTEGER PRIMARY KEY, user_id INTEGER, "
+        "manager_id INTEGER, status TEXT, created_at TEXT, closed_at TEXT)"
+    )
+    connection.execute(
+        "CREATE TABLE service_points ("
+        + ", ".join(f"{field} TEXT" for field in ServicePoint._fields)
+        + ")"
+    )
+    connection.executemany(
+        "INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (i, f"Имя{i}", f"Фамилия{i}", f"user{i}", f"+7701{i:07d}",
+             None, "2024-01-01 10:00:00", "2024-01-01 10:00:00")
+            for i in range(rows)
+        )
+    )
+    connection.executemany(
+        "INSERT INTO chats VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (i, i, 1, "active", "2024-01-01 10:00:00", None)
+            for i in range(rows)
+        )
+    )
+    connection.executemany(
+        f"INSERT INTO service_points VALUES "
+        f"({', '.join('?' * len(ServicePoint._fields))})",
+        (
+            tuple(f"{field}-{i}" for field in ServicePoint._fields)
+            for i in range(rows)
+        )
+    )
+    return connection
+
+
+def fetch_dicts(connection: sqlite3.Connection, table: str) -> List:
+    """Старый способ: словарь на каждую строку"""
+    cursor = connection.execute(f"SELECT * FROM {table}")
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def fetch_records(connection: sqlite3.Connection, table: str, record) -> List:
+    """Новый способ: фабрика строк создает NamedTuple"""
+    cursor = connection.execute(f"SELECT * FROM {table}")
+    cursor.row_factory = row_factory(record)
+    return cursor.fetchall()
+
+
+def measure(fetch: Callable[[], List], repeat: int):
+    """Лучшее время выборки и объем памяти под результат"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fetch()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    result = fetch()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, size, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    connection = make_connection(args.rows)
+    print(f"{'таблица':<16}{'способ':<12}{'время, мс':>12}{'байт/запись':>14}")
+    for table, record in (
+        ("users", User), ("chats", Chat), ("service_points", ServicePoint)
+    ):
+        for name, fetch in (
+            ("dict", lambda: fetch_dicts(connection, table)),
+            ("record", lambda: fetch_records(connection, table, record)),
+        ):
+            seconds, size, count = measure(fetch, args.repeat)
+            print(
+                f"{table:<16}{name:<12}{seconds * 1000:>12.1f}"
+                f"{size / count:>14.0f}"
+            )
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Проверка планов выполнения всех запросов Database.
+
+Скрипт создает временную базу, применяет миграции, вызывает каждый
+публичный метод Database и прогоняет каждый выполненный запрос через
+EXPLAIN QUERY PLAN. Если какой-либо запрос читает таблицу полным
+сканированием без индекса, скрипт завершается с кодом 1.
+
+Запуск из корня проекта:
+    python -m tools.check_query_plans
+"""
+import asyncio
+import inspect
+import re
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+from database import Database
+from utils.records import FSMState
+
+
+# Методы жизненного цикла не выполняют прикладных запросов
+LIFECYCLE_METHODS = {
+    "connect", "disconnect", "init_db", "migrate", "reload",
+    "reload_catalog", "set_trace_callback"
+}
+
+SAMPLE_POINT = {
+    "city": "Алматы",
+    "address": "ул. Розыбакиева 247",
+    "phone_store": "+7 (727) 123-45-67",
+    "phone_service": "+7 (727) 123-45-68",
+}
+SAMPLE_PRODUCT = {
+    "category": "Диски",
+    "vehicle_type": "Легковые",
+    "subtype": "Литые",
+    "size": "R16",
+    "link": "https://example.com/product",
+}
+SAMPLE_USER = {"user_id": 100, "first_name": "Иван"}
+
+# Вызовы с примерными аргументами. Порядок важен: сначала данные
+# создаются, затем читаются и изменяются.
+SAMPLE_CALLS = [
+    ("add_service_point", (SAMPLE_POINT,)),
+    ("add_product", (SAMPLE_PRODUCT,)),
+    ("import_products", ([
+        SAMPLE_PRODUCT,
+        {**SAMPLE_PRODUCT, "size": "R17"},
+        {**SAMPLE_PRODUCT, "link": "https://example.com/updated"},
+    ],)),
+    ("save_user", (SAMPLE_USER,)),
+    ("update_user", (100, {"phone_number": "+77010000000"})),
+    ("create_contact_request", (100, "call")),
+    ("create_chat", (100, 1)),
+    ("assign_chat", (1, 1)),
+    ("get_all_cities", ()),
+    ("get_locations_by_city", ("Алматы", "Магазин")),
+    ("get_locations_by_city", ("Алматы", "Сервис")),
+    ("get_location_info", ("Алматы", "ул. Розыбакиева 247")),
+    ("get_vehicle_types", ("Диски",)),
+    ("get_subtypes", ("Диски", "Легковые")),
+    ("get_vehicle_type_options", ("Диски", "Легковые")),
+    ("get_sizes", ("Диски", "Легковые", None)),
+    ("get_sizes", ("Диски", "Легковые", "Литые")),
+    ("get_product_link", ("Диски", "Легковые", None, "R16")),
+    ("get_product_link", ("Диски", "Легковые", "Литые", "R16")),
+    ("get_product_choice", ("Диски", "Легковые", "Литые", "R16")),
+    ("get_user", (100,)),
+    ("get_chat", (100,)),
+    ("get_pending_chats", ()),
+    ("get_open_chat_users", ()),
+    ("update_chat_status", (1, "active")),
+    ("accept_chat", (1,)),
+    ("create_chat", (100, None)),
+    ("claim_pending_chat", (1,)),
+    ("claim_pending_chat", (1, 1)),
+    ("get_active_chat", (100,)),
+    ("get_chat_by_id", (1,)),
+    ("get_active_chat_by_manager", (1,)),
+    ("save_message", (1, 100, "Здравствуйте")),
+    ("save_user_log", (100, "send_message", "Здравствуйте")),
+    ("get_user_logs", (100, 10)),
+    ("save_chat_rating", (1, 5)),
+    ("save_fsm_states", ([
+        FSMState("42:100:100::default", "CatalogStates:category", "{}",
+                 "2024-01-01 10:00:00"),
+        FSMState("42:101:101::default", None, "{}", "2024-01-01 10:00:00"),
+    ],)),
+    ("get_fsm_state", ("42:100:100::default",)),
+    ("delete_expired_fsm_states", ("2024-01-01 00:00:00",)),
+    ("get_manager_rating", (1,)),
+    ("close_chat", (1,)),
+]
+
+# Полное сканирование таблицы выглядит как "SCAN <table>" без "USING"
+TABLE_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+SKIPPED_STATEMENTS = ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK")
+
+
+def public_methods() -> List[str]:
+    """Список публичных асинхронных методов Database"""
+    return [
+        name for name, member in inspect.getmembers(Database)
+        if inspect.iscoroutinefunction(member)
+        and not name.startswith("_")
+        and name not in LIFECYCLE_METHODS
+    ]
+
+
+def explain(db_path: str, statements: List[str]) -> Dict[str, List[str]]:
+    """Поиск запросов, план которых содержит полное сканирование таблицы"""
+    failures = {}
+    connection = sqlite3.connect(db_path)
+    try:
+        for statement in statements:
+            rows = connection.execute(
+                f"EXPLAIN QUERY PLAN {statement}"
+            ).fetchall()
+            scans = [row[3] for row in rows if TABLE_SCAN.match(row[3])]
+            if scans:
+                failures[statement] = scans
+    finally:
+        connection.close()
+    return failures
+
+
+async def collect_statements(db_path: str) -> List[str]:
+    """Вызов всех методов Database с трассировкой выполненных запросов"""
+    statements: List[str] = []
+
+    def trace(statement: str):
+        statement = " ".join(statement.split())
+        if statement.upper().startswith(SKIPPED_STATEMENTS):
+            return
+        if statement not in statements:
+            statements.append(statement)
+
+    db = Database(db_path, pool_size=1)
+    await db.connect()
+    await db.init_db()
+    await db.set_trace_callback(trace)
+    try:
+        for name, args in SAMPLE_CALLS:
+            await getattr(db, name)(*args)
+    finally:
+        await db.set_trace_callback(None)
+        await db.disconnect()
+    return statements
+
+
+def main() -> int:
+    covered = {name for name, _ in SAMPLE_CALLS}
+    missing = sorted(set(public_methods()) - covered)
+    if missing:
+        print(f"Нет примеров вызова для методов: {', '.join(missing)}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = str(Path(directory) / "plans.db")
+        statements = asyncio.run(collect_statements(db_path))
+        failures = explain(db_path, statements)
+
+    for statement, scans in failures.items():
+        print(f"ПОЛНОЕ СКАНИРОВАНИЕ: {statement}")
+        for scan in scans:
+            print(f"    {scan}")
+    print(
+        f"Проверено запросов: {len(statements)}, "
+        f"с полным сканированием: {len(failures)}"
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
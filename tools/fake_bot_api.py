@@ -0,0 +1,235 @@
+"""Локальный сервер Bot API с лимитами Telegram и прогон очереди отправки.
+
+Сервер принимает вызовы вида /bot<token>/<method> и отвечает 429 с
+retry_after, если отправка превышает лимиты Telegram: 30 сообщений в
+секунду на бота, 1 в секунду в личный чат, 20 в минуту в группу.
+Прогон отправляет через него пачку пересылок, уведомлений и рассылок
+в группы через SendScheduler (с флагом --no-scheduler - напрямую) и
+печатает JSON: длительность, число ответов 429, задержки по классам
+приоритета и счетчики планировщика. Если с планировщиком сервер вернул
+хотя бы один ответ 429, скрипт завершается с кодом 1.
+
+Запуск из корня проекта:
+    python -m tools.fake_bot_api [--chats 40] [--messages 3] [--groups 2]
+        [--no-scheduler] [--output result.json]
+    python -m tools.fake_bot_api --serve 8081
+"""
+import argparse
+import asyncio
+import json
+import math
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+from typing import Deque, Dict, List
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+from aiohttp import web
+
+from utils.send_scheduler import (
+    PRIORITY_BROADCAST, PRIORITY_NAMES, PRIORITY_NOTIFICATION, PRIORITY_RELAY,
+    THROTTLED_METHODS, SendScheduler, send_priority
+)
+
+
+class FakeBotAPI:
+    """Сервер Bot API, который проверяет лимиты отправки скользящим окном"""
+
+    def __init__(self, global_limit: int = 30, chat_limit: int = 1,
+                 group_limit: int = 20):
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.group_limit = group_limit
+        self.calls: Counter = Counter()
+        self.rejected = 0
+        self._global: Deque[float] = deque()
+        self._chats: Dict[int, Deque[float]] = defaultdict(deque)
+        self._message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        self.calls[method] += 1
+        chat_id = data.get("chat_id")
+        if chat_id is None or not method.startswith(THROTTLED_METHODS):
+            return web.json_response({"ok": True, "result": True})
+
+        chat_id = int(chat_id)
+        is_group = chat_id < 0
+        now = time.monotonic()
+        window = self._chats[chat_id]
+        wait = max(
+            self._wait(self._global, self.global_limit, 1.0, now),
+            self._wait(
+                window,
+                self.group_limit if is_group else self.chat_limit,
+                60.0 if is_group else 1.0,
+                now,
+            ),
+        )
+        if wait > 0:
+            self.rejected += 1
+            retry_after = math.ceil(wait)
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }, status=429)
+
+        self._global.append(now)
+        window.append(now)
+        self._message_id += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if is_group else "private"},
+            "text": data.get("text"),
+        }})
+
+    @staticmethod
+    def _wait(window: Deque[float], limit: int, period: float, now: float) -> float:
+        """Сколько ждать, пока в окне period освободится место"""
+        while window and window[0] <= now - period:
+            window.popleft()
+        if len(window) < limit:
+            return 0.0
+        return window[0] + period - now
+
+
+async def start_server(api: FakeBotAPI, port: int = 0):
+    """Запуск сервера; возвращает runner и адрес"""
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50, p99 и максимум в секундах"""
+    if len(samples) < 2:
+        value = round(samples[0], 3) if samples else 0.0
+        return {"p50_s": value, "p99_s": value, "max_s": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_s": round(cuts[49], 3),
+        "p99_s": round(cuts[98], 3),
+        "max_s": round(max(samples), 3),
+    }
+
+
+async def run(args) -> Dict:
+    api = FakeBotAPI()
+    runner, url = await start_server(api)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(url))
+    scheduler = None
+    if not args.no_scheduler:
+        scheduler = SendScheduler()
+        session.middleware(scheduler)
+    bot = Bot("42:FAKE", session=session)
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    failed = Counter()
+
+    async def send(chat_id: int, priority: int, text: str):
+        started = time.perf_counter()
+        try:
+            with send_priority(priority):
+                await bot.send_message(chat_id, text)
+        except TelegramRetryAfter:
+            failed[PRIORITY_NAMES[priority]] += 1
+            return
+        latencies[PRIORITY_NAMES[priority]].append(time.perf_counter() - started)
+
+    # Всплеск: каждому личному чату - пересылки и уведомление,
+    # каждой группе - рассылка
+    jobs = []
+    for chat_id in range(1, args.chats + 1):
+        jobs.append(send(chat_id, PRIORITY_NOTIFICATION, "Менеджер принял чат"))
+        jobs += [
+            send(chat_id, PRIORITY_RELAY, f"Сообщение {i}")
+            for i in range(args.messages)
+        ]
+    for group in range(1, args.groups + 1):
+        jobs += [
+            send(-group, PRIORITY_BROADCAST, f"Рассылка {i}")
+            for i in range(args.messages)
+        ]
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*jobs)
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+    return {
+        "scheduler": scheduler is not None,
+        "chats": args.chats,
+        "groups": args.groups,
+        "messages": len(jobs),
+        "elapsed_s": round(elapsed, 3),
+        "rejected_429": api.rejected,
+        "failed": dict(failed),
+        "latency": {
+            name: percentiles(samples) for name, samples in sorted(latencies.items())
+        },
+        "scheduler_stats": scheduler.stats() if scheduler else None,
+    }
+
+
+async def serve(port: int):
+    """Сервер без прогона: для ручной проверки бота"""
+    runner, url = await start_server(FakeBotAPI(), port)
+    print(f"Bot API: {url}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=40,
+                        help="число личных чатов")
+    parser.add_argument("--messages", type=int, default=3,
+                        help="пересылок на личный чат и рассылок на группу")
+    parser.add_argument("--groups", type=int, default=2, help="число групп")
+    parser.add_argument("--no-scheduler", action="store_true",
+                        help="отправлять без SendScheduler")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="только запустить сервер на порту")
+    parser.add_argument("--output", help="файл для JSON вместо stdout")
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        try:
+            asyncio.run(serve(args.serve))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    result = asyncio.run(run(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    else:
+        print(output)
+    return 1 if result["scheduler"] and result["rejected_429"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
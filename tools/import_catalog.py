@@ -0,0 +1,58 @@
+"""Импорт прайс-листа в таблицу products.
+
+Строки с тем же ключом (category, vehicle_type, subtype, size) обновляют
+ссылку, новые добавляются. Весь файл записывается одной транзакцией.
+База открывается в режиме WAL с теми же прагмами, что у бота: импорт
+не блокирует чтение работающего бота и ждет его записи по busy_timeout.
+
+Запущенный бот отдает каталог из памяти и видит импорт после сигнала
+SIGUSR1: с --reload-pid скрипт сам шлет его процессу бота (в режиме
+нескольких процессов - супервизору, он передаст сигнал обработчикам).
+
+Запуск из корня проекта:
+    python -m tools.import_catalog price.csv [--format csv|json|jsonl]
+        [--db service_points.db] [--reload-pid PID]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import time
+
+from database import Database
+from utils.catalog_import import read_products
+
+
+async def run(path: str, file_format: str, db_path: str):
+    db = Database(db_path, pool_size=1, wal=True)
+    await db.connect()
+    try:
+        await db.init_db()
+        started = time.perf_counter()
+        result = await db.import_products(read_products(path, file_format))
+        elapsed = time.perf_counter() - started
+    finally:
+        await db.disconnect()
+    print(
+        f"Добавлено: {result.inserted}, обновлено: {result.updated}, "
+        f"без изменений: {result.unchanged}, пропущено: {result.skipped} "
+        f"({elapsed:.2f} с)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("csv", "json", "jsonl", "ndjson"))
+    parser.add_argument("--db", default="service_points.db")
+    parser.add_argument("--reload-pid", type=int,
+                        help="PID бота, который перечитает каталог после импорта")
+    args = parser.parse_args()
+    asyncio.run(run(args.path, args.format, args.db))
+    if args.reload_pid:
+        os.kill(args.reload_pid, signal.SIGUSR1)
+        print(f"Бот {args.reload_pid} перечитывает каталог")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,519 @@
+"""Нагрузочный прогон бота без сети: синтетические Update через Dispatcher.
+
+Скрипт берет Dispatcher, собранный в main.py, подключает его к временной
+базе с синтетическими данными и к сессии Bot API, которая только
+запоминает исходящие вызовы, и прогоняет через него сценарии
+пользователей: /start, проход по каталогу, проход по контактам и чат
+с менеджером с оценкой. На выходе - JSON с числом апдейтов в секунду,
+перцентилями задержки по каждому обработчику и долей времени в базе.
+
+С --transport webhook апдейты отправляются POST-запросами в локальный
+сервер webhook из utils.webhook. Задержка апдейта тогда - время до
+ответа сервера, обработка идет в фоне, а порядок соблюдается только
+внутри одного отправителя, поэтому сценарий чата с менеджером может
+расходиться с прямым прогоном.
+
+С --processes N апдейты раздаются N процессам-обработчикам через
+WorkerPool, как в main.py --processes. Задержка апдейта тогда включает
+передачу процессу, а обработчики и время в базе не замеряются.
+
+Запуск из корня проекта:
+    python -m tools.replay [--users 100] [--sessions 5]
+        [--mix catalog=5,contacts=3,manager=1,start=1]
+        [--rows 10000] [--api-latency 0] [--output result.json]
+        [--transport direct|webhook] [--workers 100] [--processes 1]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Chat, Message, TelegramObject, Update, User
+from aiohttp import ClientSession, web
+
+from config import MANAGER_ID
+from database import Database
+from handlers.contacts import create_contact_cards
+from handlers.manager import MANAGER_IDS, SUPPORT_TEXTS, create_routing
+from keyboards.factory import detach_keyboard
+from main import dp, run_worker, storage
+from tools.bench_db import CITIES, Dataset, prepare, product_key
+from tools.check_query_plans import public_methods
+from utils.logger import logger
+from utils.tasks import TaskSupervisor
+from utils.webhook import create_webhook_app
+from utils.workers import WorkerPool
+
+# Сценарий - последовательность апдейтов (отправитель, текст)
+Scenario = List[Tuple[int, str]]
+
+# Синтетические пользователи не пересекаются с пользователями из базы
+FIRST_USER_ID = 10_000_000
+
+# Время в базе, накопленное текущим обработчиком
+_db_time: ContextVar[Optional[List[float]]] = ContextVar("db_time", default=None)
+
+
+class RecordingSession(BaseSession):
+    """Сессия Bot API без сети: считает исходящие вызовы.
+
+    Аргументы вызова сериализуются так же, как в настоящей сессии, чтобы
+    стоимость подготовки клавиатур и текста попадала в замер.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None):
+        files: Dict[str, Any] = {}
+        # Как BotSession: готовые клавиатуры не сериализуются заново
+        method, _ = detach_keyboard(method)
+        for value in method.model_dump(warnings=False).values():
+            self.prepare_value(value, bot=bot, files=files)
+        self.calls[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__returning__ is Message:
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(timezone.utc),
+                chat=Chat(id=getattr(method, "chat_id", 0), type="private"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+    async def stream_content(self, url: str, headers=None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class HandlerTimer(BaseMiddleware):
+    """Замер времени обработчика и времени, проведенного им в базе"""
+
+    def __init__(self, stats: "ReplayStats"):
+        self.stats = stats
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        callback = data["handler"].callback
+        name = f"{callback.__module__}.{callback.__name__}"
+        db_time = [0.0]
+        token = _db_time.set(db_time)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.stats.handlers[name].append(time.perf_counter() - started)
+            self.stats.handler_db_time[name] += db_time[0]
+            _db_time.reset(token)
+
+
+class ReplayStats:
+    """Накопленные результаты прогона"""
+
+    def __init__(self):
+        self.updates: List[float] = []
+        self.unhandled = 0
+        self.errors = 0
+        self.handlers: Dict[str, List[float]] = defaultdict(list)
+        self.handler_db_time: Dict[str, float] = defaultdict(float)
+
+
+def instrument_database(db: Database):
+    """Подмена публичных методов экземпляра обертками с замером времени"""
+    for name in public_methods():
+        method = getattr(db, name)
+
+        @wraps(method)
+        async def timed(*args, __method=method, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await __method(*args, **kwargs)
+            finally:
+                db_time = _db_time.get()
+                if db_time is not None:
+                    db_time[0] += time.perf_counter() - started
+
+        setattr(db, name, timed)
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50 и p99 в миллисекундах"""
+    if len(samples) < 2:
+        value = round(samples[0] * 1000, 4) if samples else 0.0
+        return {"p50_ms": value, "p99_ms": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_ms": round(cuts[49] * 1000, 4),
+        "p99_ms": round(cuts[98] * 1000, 4),
+    }
+
+
+class ScenarioBuilder:
+    """Сценарии пользователей по данным каталога и справочника точек"""
+
+    def __init__(self, db: Database, dataset: Dataset, seed: int = 0):
+        self.db = db
+        self.dataset = dataset
+        self.random = random.Random(seed)
+
+    async def start(self, user_id: int) -> Scenario:
+        return [(user_id, "/start")]
+
+    async def catalog(self, user_id: int) -> Scenario:
+        i = self.random.randrange(self.dataset.counts["products"])
+        category, vehicle_type, subtype, size = product_key(i)
+        texts = ["Каталог", category, vehicle_type]
+        # Для шин подтип не выбирается, для дисков - выбирается
+        if category == "Диски" and await self.db.get_subtypes(category, vehicle_type):
+            texts.append(subtype)
+        texts.append(size)
+        # Кнопка «Назад» до выхода из каталога
+        texts += ["Назад"] * (len(texts) - 1)
+        return [(user_id, text) for text in texts]
+
+    async def contacts(self, user_id: int) -> Scenario:
+        contact_type = self.random.choice(("Магазин", "Сервис"))
+        city = self.random.choice(CITIES)
+        locations = await self.db.get_locations_by_city(city, contact_type)
+        texts = ["Контакты", contact_type, city]
+        if locations:
+            texts.append(self.random.choice(locations))
+        texts += ["Назад"] * (len(texts) - 1)
+        return [(user_id, text) for text in texts]
+
+    async def manager(self, user_id: int) -> Scenario:
+        return [
+            (user_id, "Связаться с менеджером"),
+            (user_id, "Чат с менеджером"),
+            (MANAGER_ID, f"Принять чат с Имя{user_id}"),
+            (user_id, "Здравствуйте, нужна консультация"),
+            (MANAGER_ID, "Здравствуйте, слушаю вас"),
+            (user_id, "Спасибо"),
+            (user_id, "Завершить чат"),
+            (user_id, "⭐️" * self.random.randint(1, 5)),
+        ]
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """Разбор строки вида catalog=5,contacts=3"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("start", "catalog", "contacts", "manager"):
+            raise argparse.ArgumentTypeError(f"Неизвестный сценарий: {name}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    """Апдейт с текстовым сообщением из личного чата"""
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(timezone.utc),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name=f"Имя{user_id}"),
+            text=text,
+        ),
+    )
+
+
+async def replay(
+    dispatcher: Dispatcher, bot: Bot, scenarios: List[Scenario],
+    stats: ReplayStats
+) -> float:
+    """Прогон сценариев: пользователи параллельно, апдейты одного - по очереди"""
+    update_ids = iter(range(1, sys.maxsize))
+
+    async def run_user(scenario: Scenario):
+        for sender_id, text in scenario:
+            update = make_update(next(update_ids), sender_id, text)
+            started = time.perf_counter()
+            try:
+                result = await dispatcher.feed_update(bot, update)
+                if result is UNHANDLED:
+                    stats.unhandled += 1
+            except Exception as e:
+                stats.errors += 1
+                logger.error(f"Ошибка обработки апдейта: {e}")
+            stats.updates.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(scenario) for scenario in scenarios))
+    return time.perf_counter() - started
+
+
+async def replay_webhook(
+    dispatcher: Dispatcher, bot: Bot, scenarios: List[Scenario],
+    stats: ReplayStats, workers: int
+) -> float:
+    """Прогон через локальный сервер webhook: апдейты приходят POST-запросами"""
+    update_ids = iter(range(1, sys.maxsize))
+    secret = secrets.token_urlsafe(16)
+    app = create_webhook_app(dispatcher, bot, "/webhook", secret, limit=workers)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}/webhook"
+    headers = {
+        "Content-Type": "application/json",
+        "X-Telegram-Bot-Api-Secret-Token": secret,
+    }
+
+    async def run_user(scenario: Scenario):
+        for sender_id, text in scenario:
+            update = make_update(next(update_ids), sender_id, text)
+            body = update.model_dump_json(by_alias=True, exclude_none=True)
+            started = time.perf_counter()
+            try:
+                async with session.post(url, data=body, headers=headers) as response:
+                    if response.status != 200:
+                        stats.errors += 1
+            except Exception as e:
+                stats.errors += 1
+                logger.error(f"Ошибка отправки апдейта: {e}")
+            stats.updates.append(time.perf_counter() - started)
+
+    try:
+        async with ClientSession() as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(run_user(scenario) for scenario in scenarios))
+            # Ответы пришли раньше обработки: ждем апдейты в работе
+            await app["webhook_handler"].workers.close()
+            return time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+
+
+async def replay_processes(
+    scenarios: List[Scenario], stats: ReplayStats, db_path: str, args
+) -> Tuple[float, Dict]:
+    """Прогон через пул процессов-обработчиков; возвращает и их счетчики"""
+    update_ids = iter(range(1, sys.maxsize))
+    pool = WorkerPool(
+        [sys.executable, "-m", "tools.replay",
+         "--db", db_path, "--api-latency", str(args.api_latency)],
+        args.processes,
+        support_users=MANAGER_IDS,
+        support_texts=SUPPORT_TEXTS,
+    )
+
+    async def run_user(scenario: Scenario):
+        for sender_id, text in scenario:
+            update = make_update(next(update_ids), sender_id, text)
+            started = time.perf_counter()
+            if await pool.dispatch(update) is None:
+                stats.errors += 1
+            stats.updates.append(time.perf_counter() - started)
+
+    await pool.start()
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(run_user(scenario) for scenario in scenarios))
+        elapsed = time.perf_counter() - started
+        pool_stats = await pool.stats()
+    finally:
+        await pool.close()
+    for worker in pool_stats["workers"].values():
+        stats.errors += worker.get("errors", 0)
+    return elapsed, pool_stats
+
+
+async def serve_replay_worker(args):
+    """Процесс-обработчик прогона: база прогона и сессия без сети"""
+    db = Database(args.db, wal=True)
+    await db.connect()
+    await db.init_db(apply_migrations=False)
+    dp["db"] = db
+    await storage.start(db)
+    tasks = TaskSupervisor(name="replay")
+    dp["tasks"] = tasks
+    dp["routing"] = create_routing(db)
+    dp["cards"] = create_contact_cards(db)
+    session = RecordingSession(latency=args.api_latency)
+    bot = Bot("42:REPLAY", session=session)
+    try:
+        await run_worker(
+            bot, args.worker, args.socket,
+            stats=lambda: {"api_calls": dict(session.calls)}
+        )
+    finally:
+        await tasks.close()
+        await storage.close()
+        await db.disconnect()
+
+
+async def run(args) -> Dict:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = str(Path(temp_dir) / "replay.db")
+        dataset = Dataset(args.rows)
+        await prepare(db_path, dataset, wal=True)
+
+        db = Database(db_path, wal=True)
+        await db.connect()
+        await db.init_db()
+        stats = ReplayStats()
+        session = RecordingSession(latency=args.api_latency)
+        pool_stats = None
+        if args.processes == 1:
+            instrument_database(db)
+            dp["db"] = db
+            await storage.start(db)
+            tasks = TaskSupervisor(name="replay")
+            dp["tasks"] = tasks
+            dp["routing"] = create_routing(db)
+            dp["cards"] = create_contact_cards(db)
+            # Внутренние middleware диспетчера действуют и во вложенных роутерах
+            dp.message.middleware(HandlerTimer(stats))
+            bot = Bot("42:REPLAY", session=session)
+
+        builder = ScenarioBuilder(db, dataset)
+        names = list(args.mix)
+        weights = [args.mix[name] for name in names]
+        scenarios = []
+        for i in range(args.users):
+            user_id = FIRST_USER_ID + i
+            scenario = [(user_id, "/start")]
+            for name in builder.random.choices(names, weights, k=args.sessions):
+                scenario += await getattr(builder, name)(user_id)
+            scenarios.append(scenario)
+
+        if args.processes > 1:
+            # Обработчики открывают базу сами
+            await db.disconnect()
+            elapsed, pool_stats = await replay_processes(
+                scenarios, stats, db_path, args
+            )
+            for worker in pool_stats["workers"].values():
+                session.calls.update(worker.get("api_calls", {}))
+        else:
+            try:
+                if args.transport == "webhook":
+                    elapsed = await replay_webhook(
+                        dp, bot, scenarios, stats, args.workers
+                    )
+                else:
+                    elapsed = await replay(dp, bot, scenarios, stats)
+            finally:
+                await tasks.close()
+                await storage.close()
+                await db.disconnect()
+
+    handler_time = sum(sum(samples) for samples in stats.handlers.values())
+    db_time = sum(stats.handler_db_time.values())
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "users": args.users,
+        "sessions": args.sessions,
+        "mix": args.mix,
+        "rows": args.rows,
+        "api_latency_s": args.api_latency,
+        "transport": args.transport,
+        "processes": args.processes,
+        "updates": len(stats.updates),
+        # В режиме webhook и с процессами результат обработки до
+        # отправителя не доходит
+        "unhandled": stats.unhandled
+        if args.transport == "direct" and args.processes == 1 else None,
+        "errors": stats.errors,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(stats.updates) / elapsed, 1),
+        "update_latency": percentiles(stats.updates),
+        "db_time_share": round(db_time / handler_time, 4) if handler_time else 0.0,
+        "handlers": {
+            name: {
+                "count": len(samples),
+                **percentiles(samples),
+                "db_time_share": round(
+                    stats.handler_db_time[name] / sum(samples), 4
+                ) if sum(samples) else 0.0,
+            }
+            for name, samples in sorted(stats.handlers.items())
+        },
+        "api_calls": dict(session.calls),
+        "pool": pool_stats,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100,
+                        help="число одновременных пользователей")
+    parser.add_argument("--sessions", type=int, default=5,
+                        help="число сценариев на пользователя")
+    parser.add_argument("--mix", type=parse_mix,
+                        default="catalog=5,contacts=3,manager=1,start=1",
+                        help="веса сценариев")
+    parser.add_argument("--rows", type=int, default=10_000,
+                        help="масштаб синтетической базы, см. tools.bench_db")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="имитация задержки Bot API, секунды")
+    parser.add_argument("--transport", choices=("direct", "webhook"),
+                        default="direct",
+                        help="подача апдейтов: напрямую в Dispatcher или через webhook")
+    parser.add_argument("--workers", type=int, default=100,
+                        help="параллельность обработки в режиме webhook")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="число процессов-обработчиков")
+    parser.add_argument("--output", help="файл для JSON вместо stdout")
+    # Процесс-обработчик, запущенный прогоном с --processes
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--socket", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.processes < 1:
+        parser.error("--processes должно быть не меньше 1")
+    if args.processes > 1 and args.transport != "direct":
+        parser.error("--processes совместим только с --transport direct")
+
+    # Консольный лог и лог aiogram о каждом апдейте мешали бы замеру
+    logging.getLogger("aiogram").setLevel(logging.WARNING)
+    for handler in logger.handlers:
+        if isinstance(handler, logging.StreamHandler) and \
+                not isinstance(handler, logging.FileHandler):
+            handler.setLevel(logging.CRITICAL)
+
+    if args.worker is not None:
+        asyncio.run(serve_replay_worker(args))
+        return 0
+
+    result = asyncio.run(run(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import List, Sequence, Set
+
+import aiosqlite
+
+from utils.db_pool import SQLiteWriter
+from utils.logger import logger
+
+
+def utc_timestamp() -> str:
+    """Текущее время в формате CURRENT_TIMESTAMP SQLite"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class BatchWriter:
+    """Буферизованная запись строк пачками через писателя базы данных.
+
+    Строки копятся в памяти и записываются одним executemany в одной
+    транзакции, когда набирается batch_size строк или проходит
+    flush_interval секунд. Если буфер заполнен до max_buffer, put ждет,
+    пока фоновая задача не освободит место. Если пачка не записалась,
+    она повторяется построчно; строки с ошибкой пропускаются, а их
+    ожидающие put(wait=True) получают исключение.
+    """
+
+    def __init__(
+        self,
+        writer: SQLiteWriter,
+        sql: str,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        max_buffer: int = 10000,
+        name: str = "batch",
+    ):
+        self.writer = writer
+        self.sql = sql
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.name = name
+        self._buffer: List[Sequence] = []
+        self._wakeup = asyncio.Event()
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+        self._flushed = asyncio.Condition()
+        # Номер строки - ее порядковый номер в put. Строки до _processed
+        # уже записаны или отброшены, _written - число записанных
+        self._queued = 0
+        self._processed = 0
+        self._written = 0
+        # Строки, которых ждут вызовы put(wait=True), и те из них,
+        # что не удалось записать
+        self._waiting: Set[int] = set()
+        self._failed: Set[int] = set()
+        self._closing = False
+        self._task: asyncio.Task = None
+
+    async def start(self):
+        """Запуск фоновой задачи записи"""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Запись всего буфера и остановка фоновой задачи"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        logger.info(
+            f"Буфер {self.name} записан и остановлен: "
+            f"записано {self._written} из {self._processed} строк"
+        )
+
+    async def put(self, row: Sequence, wait: bool = False):
+        """Добавление строки в буфер с ожиданием при переполнении.
+
+        С wait=True вызов завершается только после фиксации пачки, в которую
+        попала строка. Такие вызовы не форсируют запись, а разделяют одну
+        транзакцию с остальными строками пачки (групповая фиксация).
+        Если строку записать не удалось, вызывается RuntimeError.
+        """
+        if self._task is None:
+            raise RuntimeError(f"Буфер {self.name} не запущен")
+        while len(self._buffer) >= self.max_buffer:
+            self._has_space.clear()
+            self._wakeup.set()
+            await self._has_space.wait()
+        self._buffer.append(row)
+        self._queued += 1
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        if wait:
+            number = self._queued
+            self._waiting.add(number)
+            try:
+                await self._wait_processed(number)
+            finally:
+                self._waiting.discard(number)
+            if number in self._failed:
+                self._failed.discard(number)
+                raise RuntimeError(f"Строка буфера {self.name} не записана")
+
+    async def flush(self):
+        """Немедленная запись буфера с ожиданием ее завершения"""
+        target = self._queued
+        self._wakeup.set()
+        await self._wait_processed(target)
+
+    async def _wait_processed(self, target: int):
+        """Ожидание, пока не будут обработаны первые target строк"""
+        async with self._flushed:
+            await self._flushed.wait_for(lambda: self._processed >= target)
+
+    @property
+    def pending(self) -> int:
+        """Количество строк, ожидающих записи"""
+        return len(self._buffer)
+
+    async def _run(self):
+        """Фоновая запись пачек по размеру или по таймеру"""
+        while True:
+            if not self._buffer and self._closing:
+                break
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                self._has_space.set()
+                await self._write(batch)
+
+    async def _write(self, batch: List[Sequence]):
+        """Запись пачки одной транзакцией"""
+        async def operation(connection: aiosqlite.Connection):
+            await connection.executemany(self.sql, batch)
+
+        async def row_by_row(connection: aiosqlite.Connection) -> List[int]:
+            failed = []
+            for index, row in enumerate(batch):
+                try:
+                    await connection.execute(self.sql, row)
+                except aiosqlite.Error:
+                    failed.append(index)
+            return failed
+
+        first = self._processed + 1
+        failed = range(len(batch))
+        try:
+            try:
+                await self.writer.run(operation)
+                failed = range(0)
+            except aiosqlite.Error:
+                # Одна ошибочная строка не должна терять всю пачку:
+                # повторяем построчно, пропуская только ошибочные строки
+                failed = await self.writer.run(row_by_row)
+                logger.error(
+                    f"Пачка {self.name}: не записано {len(failed)} "
+                    f"из {len(batch)} строк"
+                )
+        except Exception as e:
+            logger.error(
+                f"Ошибка при записи пачки {self.name} "
+                f"({len(batch)} строк): {e}"
+            )
+        finally:
+            for index in failed:
+                if first + index in self._waiting:
+                    self._failed.add(first + index)
+            self._processed += len(batch)
+            self._written += len(batch) - len(failed)
+            async with self._flushed:
+                self._flushed.notify_all()
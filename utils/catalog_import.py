@@ -0,0 +1,51 @@
+import csv
+import json
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Optional
+
+from utils.records import Product
+
+PRODUCT_FIELDS = Product._fields
+REQUIRED_FIELDS = ("category", "vehicle_type", "size", "link")
+
+
+class ImportResult(NamedTuple):
+    """Итог импорта прайс-листа"""
+    inserted: int
+    updated: int
+    unchanged: int
+    skipped: int
+
+
+def normalize_product(data: Dict) -> Optional[Product]:
+    """Приведение строки прайс-листа к товару; None, если строка неполная"""
+    values = {
+        field: (str(data[field]).strip() if data.get(field) is not None else None)
+        for field in PRODUCT_FIELDS
+    }
+    if not all(values[field] for field in REQUIRED_FIELDS):
+        return None
+    # Пустой подтип и отсутствующий подтип - одно и то же
+    values["subtype"] = values["subtype"] or None
+    return Product(**values)
+
+
+def read_products(path: str, file_format: Optional[str] = None) -> Iterator[Dict]:
+    """Потоковое чтение прайс-листа из CSV, JSON Lines или JSON.
+
+    CSV и JSON Lines читаются построчно. Обычный JSON-массив читается
+    целиком, поэтому для очень больших файлов лучше CSV или JSON Lines.
+    """
+    file_format = (file_format or Path(path).suffix.lstrip(".")).lower()
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        if file_format == "csv":
+            yield from csv.DictReader(file)
+        elif file_format in ("jsonl", "ndjson"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        elif file_format == "json":
+            data = json.load(file)
+            yield from (data["products"] if isinstance(data, dict) else data)
+        else:
+            raise ValueError(f"Неизвестный формат прайс-листа: {file_format}")
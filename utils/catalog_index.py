@@ -0,0 +1,154 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+# Строка каталога: category, vehicle_type, subtype, size, link
+ProductRow = Tuple[str, str, Optional[str], str, str]
+
+
+class CatalogIndex:
+    """Дерево каталога в памяти: категория → тип ТС → подтип → размер → ссылка.
+
+    Списки вариантов для клавиатур вычисляются заранее и хранятся
+    отсортированными, поэтому любой шаг каталога - это один поиск в словаре.
+    """
+
+    def __init__(self):
+        self._tree: Dict[str, Dict[str, Dict[Optional[str], Dict[str, str]]]] = {}
+        self._vehicle_types: Dict[str, Tuple[str, ...]] = {}
+        self._subtypes: Dict[Tuple[str, str], Tuple[str, ...]] = {}
+        # Ключ с подтипом None - размеры по всем подтипам типа ТС
+        self._sizes: Dict[Tuple[str, str, Optional[str]], Tuple[str, ...]] = {}
+        # (категория, тип ТС) → подтипы и размеры по всем подтипам
+        self._branches: Dict[
+            Tuple[str, str], Tuple[Tuple[str, ...], Tuple[str, ...]]
+        ] = {}
+        # Ссылка для выбора без подтипа: товар нужного размера из первого
+        # загруженного подтипа
+        self._any_subtype_links: Dict[Tuple[str, str, str], str] = {}
+
+    def load(self, rows: Iterable[ProductRow]):
+        """Полная перестройка дерева по строкам таблицы products"""
+        self._tree.clear()
+        self._vehicle_types.clear()
+        self._subtypes.clear()
+        self._sizes.clear()
+        self._branches.clear()
+        self._any_subtype_links.clear()
+        branches = set()
+        for category, vehicle_type, subtype, size, link in rows:
+            self._insert(category, vehicle_type, subtype, size, link)
+            branches.add((category, vehicle_type))
+        for category, vehicle_type in branches:
+            self._refresh(category, vehicle_type)
+
+    def add(
+        self, category: str, vehicle_type: str, subtype: Optional[str],
+        size: str, link: str
+    ):
+        """Добавление или обновление товара с пересчетом только его ветки"""
+        self._insert(category, vehicle_type, subtype, size, link)
+        self._refresh(category, vehicle_type)
+
+    def add_many(self, rows: Iterable[ProductRow]):
+        """Добавление или обновление многих товаров с пересчетом их веток"""
+        branches = set()
+        for category, vehicle_type, subtype, size, link in rows:
+            self._insert(category, vehicle_type, subtype, size, link)
+            branches.add((category, vehicle_type))
+        for category, vehicle_type in branches:
+            self._refresh(category, vehicle_type)
+
+    def vehicle_types(self, category: str) -> Tuple[str, ...]:
+        """Типы ТС в категории"""
+        return self._vehicle_types.get(category, ())
+
+    def subtypes(self, category: str, vehicle_type: str) -> Tuple[str, ...]:
+        """Подтипы для категории и типа ТС"""
+        return self._subtypes.get((category, vehicle_type), ())
+
+    def branch(
+        self, category: str, vehicle_type: str
+    ) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """Подтипы и размеры без подтипа - все, что нужно после выбора типа ТС"""
+        return self._branches.get((category, vehicle_type), ((), ()))
+
+    def sizes(
+        self, category: str, vehicle_type: str, subtype: Optional[str] = None
+    ) -> Tuple[str, ...]:
+        """Размеры для подтипа или, без подтипа, для всего типа ТС"""
+        return self._sizes.get((category, vehicle_type, subtype or None), ())
+
+    def exact_link(
+        self, category: str, vehicle_type: str, subtype: Optional[str],
+        size: str
+    ) -> Optional[str]:
+        """Ссылка товара с точно таким ключом (без подтипа - только без него)"""
+        return (
+            self._tree.get(category, {})
+            .get(vehicle_type, {})
+            .get(subtype or None, {})
+            .get(size)
+        )
+
+    def link(
+        self, category: str, vehicle_type: str, subtype: Optional[str],
+        size: str
+    ) -> Optional[str]:
+        """Ссылка на товар"""
+        if not subtype:
+            return self._any_subtype_links.get((category, vehicle_type, size))
+        return (
+            self._tree.get(category, {})
+            .get(vehicle_type, {})
+            .get(subtype, {})
+            .get(size)
+        )
+
+    def choice(
+        self, category: str, vehicle_type: str, subtype: Optional[str],
+        size: str
+    ) -> Tuple[Optional[str], Tuple[str, ...]]:
+        """Ссылка на товар и размеры, среди которых он выбирается"""
+        return (
+            self.link(category, vehicle_type, subtype, size),
+            self.sizes(category, vehicle_type, subtype),
+        )
+
+    def _insert(
+        self, category: str, vehicle_type: str, subtype: Optional[str],
+        size: str, link: str
+    ):
+        """Добавление товара в дерево без пересчета списков"""
+        sizes = (
+            self._tree.setdefault(category, {})
+            .setdefault(vehicle_type, {})
+            .setdefault(subtype or None, {})
+        )
+        sizes[size] = link
+
+    def _refresh(self, category: str, vehicle_type: str):
+        """Пересчет отсортированных списков для ветки категории и типа ТС"""
+        vehicles = self._tree[category]
+        self._vehicle_types[category] = tuple(sorted(vehicles))
+        subtypes = vehicles[vehicle_type]
+        self._subtypes[(category, vehicle_type)] = tuple(
+            sorted(subtype for subtype in subtypes if subtype is not None)
+        )
+        self._sizes[(category, vehicle_type, None)] = tuple(
+            sorted({size for sizes in subtypes.values() for size in sizes})
+        )
+        self._branches[(category, vehicle_type)] = (
+            self._subtypes[(category, vehicle_type)],
+            self._sizes[(category, vehicle_type, None)],
+        )
+        for subtype, sizes in subtypes.items():
+            if subtype is not None:
+                self._sizes[(category, vehicle_type, subtype)] = tuple(
+                    sorted(sizes)
+                )
+        # Без подтипа берется товар первого по порядку загрузки подтипа
+        links = {}
+        for sizes in subtypes.values():
+            for size, link in sizes.items():
+                links.setdefault(size, link)
+        for size, link in links.items():
+            self._any_subtype_links[(category, vehicle_type, size)] = link
@@ -0,0 +1,96 @@
+from typing import Dict, Iterable, List, Optional
+
+from utils.records import Chat
+
+# Статусы чатов, которые держит реестр; закрытые и отклоненные не нужны
+OPEN_STATUSES = ("pending", "active")
+
+
+def _newest(chats: Dict[int, Chat]) -> Optional[Chat]:
+    """Самый поздний чат: по created_at, при равенстве - по id"""
+    if not chats:
+        return None
+    return max(chats.values(), key=lambda chat: (chat.created_at or "", chat.id))
+
+
+class ChatSessions:
+    """Реестр открытых чатов в памяти: пользователь ↔ чат ↔ менеджер.
+
+    Хранит ожидающие и активные чаты (OPEN_STATUSES) с полями
+    пользователя, как их возвращает JOIN с users. Database обновляет
+    реестр в той же операции писателя, что и саму таблицу chats, поэтому
+    поиск чата для пересылки сообщения не требует запросов к базе.
+    """
+
+    def __init__(self):
+        self._chats: Dict[int, Chat] = {}
+        self._by_user: Dict[int, Dict[int, Chat]] = {}
+        # Только активные чаты менеджера
+        self._by_manager: Dict[int, Dict[int, Chat]] = {}
+        self._pending: Dict[int, Chat] = {}
+
+    def load(self, chats: Iterable[Chat]):
+        """Полная перестройка реестра"""
+        self._chats.clear()
+        self._by_user.clear()
+        self._by_manager.clear()
+        self._pending.clear()
+        for chat in chats:
+            self.upsert(chat)
+
+    def upsert(self, chat: Chat):
+        """Добавление или замена чата; закрытый или отклоненный удаляется"""
+        self.discard(chat.id)
+        if chat.status not in OPEN_STATUSES:
+            return
+        self._chats[chat.id] = chat
+        self._by_user.setdefault(chat.user_id, {})[chat.id] = chat
+        if chat.status == "active":
+            self._by_manager.setdefault(chat.manager_id, {})[chat.id] = chat
+        elif chat.status == "pending":
+            self._pending[chat.id] = chat
+
+    def discard(self, chat_id: int):
+        """Удаление чата из реестра"""
+        chat = self._chats.pop(chat_id, None)
+        if chat is None:
+            return
+        self._remove(self._by_user, chat.user_id, chat_id)
+        self._remove(self._by_manager, chat.manager_id, chat_id)
+        self._pending.pop(chat_id, None)
+
+    def chats(self) -> List[Chat]:
+        """Все открытые чаты"""
+        return list(self._chats.values())
+
+    def chat(self, chat_id: int) -> Optional[Chat]:
+        """Открытый чат по ID"""
+        return self._chats.get(chat_id)
+
+    def user_chat(self, user_id: int) -> Optional[Chat]:
+        """Последний открытый чат пользователя"""
+        return _newest(self._by_user.get(user_id, {}))
+
+    def active_user_chat(self, user_id: int) -> Optional[Chat]:
+        """Последний активный чат пользователя"""
+        return _newest({
+            chat_id: chat
+            for chat_id, chat in self._by_user.get(user_id, {}).items()
+            if chat.status == "active"
+        })
+
+    def manager_chat(self, manager_id: int) -> Optional[Chat]:
+        """Последний активный чат менеджера"""
+        return _newest(self._by_manager.get(manager_id, {}))
+
+    def pending(self) -> List[Chat]:
+        """Ожидающие чаты в порядке создания"""
+        return sorted(self._pending.values(), key=lambda chat: chat.id)
+
+    @staticmethod
+    def _remove(index: Dict[int, Dict[int, Chat]], key: int, chat_id: int):
+        chats = index.get(key)
+        if chats is not None:
+            chats.pop(chat_id, None)
+            if not chats:
+                del index[key]
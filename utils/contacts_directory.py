@@ -0,0 +1,96 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.records import ServicePoint
+
+STORE = "Магазин"
+SERVICE = "Сервис"
+
+# Поля, наличие которых означает, что на точке есть сервис
+SERVICE_FIELDS = (
+    "phone_service",
+    "service_schedule_weekdays",
+    "service_schedule_weekend",
+    "service_manager_name",
+)
+
+
+def has_store(point: ServicePoint) -> bool:
+    """Есть ли на точке магазин"""
+    return bool(point.phone_store)
+
+
+def has_service(point: ServicePoint) -> bool:
+    """Есть ли на точке сервис"""
+    return any(getattr(point, field) for field in SERVICE_FIELDS)
+
+
+class ContactsDirectory:
+    """Справочник торговых точек в памяти: город → адрес → запись.
+
+    Признаки «магазин» и «сервис» вычисляются один раз при загрузке,
+    а списки городов и адресов хранятся готовыми для клавиатур. Подписчики
+    (например, готовые карточки точек) получают точки города при каждом
+    его пересчете; для исчезнувшего города - пустой словарь.
+    """
+
+    def __init__(self):
+        self._points: Dict[str, Dict[str, ServicePoint]] = {}
+        self._cities: Tuple[str, ...] = ()
+        # (город, тип контакта) → адреса точек подходящего типа
+        self._locations: Dict[Tuple[str, str], Tuple[str, ...]] = {}
+        self._listeners: List[Callable[[str, Dict[str, ServicePoint]], None]] = []
+
+    def subscribe(self, listener: Callable[[str, Dict[str, ServicePoint]], None]):
+        """Подписка на пересчет городов; уже загруженные передаются сразу"""
+        self._listeners.append(listener)
+        for city, points in self._points.items():
+            listener(city, points)
+
+    def load(self, points: Iterable[ServicePoint]):
+        """Полная перестройка справочника"""
+        removed = set(self._points)
+        self._points.clear()
+        for point in points:
+            self._points.setdefault(point.city, {})[point.address] = point
+        self._locations.clear()
+        for city in self._points:
+            self._refresh_city(city)
+        for city in removed - self._points.keys():
+            self._notify(city, {})
+        self._cities = tuple(sorted(self._points))
+
+    def upsert(self, point: ServicePoint):
+        """Добавление или замена одной точки"""
+        city = point.city
+        self._points.setdefault(city, {})[point.address] = point
+        self._refresh_city(city)
+        self._cities = tuple(sorted(self._points))
+
+    def cities(self) -> Tuple[str, ...]:
+        """Все города"""
+        return self._cities
+
+    def locations(self, city: str, contact_type: str) -> Tuple[str, ...]:
+        """Адреса в городе с учетом типа контакта"""
+        return self._locations.get((city, contact_type), ())
+
+    def info(self, city: str, address: str) -> Optional[ServicePoint]:
+        """Запись о торговой точке"""
+        return self._points.get(city, {}).get(address)
+
+    def _refresh_city(self, city: str):
+        """Пересчет списков адресов города"""
+        points = self._points[city]
+        self._locations[(city, STORE)] = tuple(sorted(
+            address for address, point in points.items()
+            if has_store(point)
+        ))
+        self._locations[(city, SERVICE)] = tuple(sorted(
+            address for address, point in points.items()
+            if has_service(point)
+        ))
+        self._notify(city, points)
+
+    def _notify(self, city: str, points: Dict[str, ServicePoint]):
+        for listener in self._listeners:
+            listener(city, points)
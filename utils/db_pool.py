@@ -0,0 +1,182 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, List, Optional, Sequence
+)
+
+import aiosqlite
+
+from utils.logger import logger
+
+
+Operation = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+async def open_connection(
+    db_path: str, pragmas: Sequence[str], read_only: bool = False
+) -> aiosqlite.Connection:
+    """Открытие соединения и применение прагм"""
+    if read_only:
+        connection = await aiosqlite.connect(
+            f"file:{db_path}?mode=ro", uri=True
+        )
+    else:
+        connection = await aiosqlite.connect(db_path)
+    for pragma in pragmas:
+        await connection.execute(pragma)
+    await connection.commit()
+    return connection
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений с базой данных SQLite.
+
+    Соединения открываются один раз при запуске и выдаются обработчикам
+    по одному, поэтому параллельные апдейты не делят одно соединение.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = 4,
+        pragmas: Sequence[str] = ("PRAGMA foreign_keys = ON",),
+        read_only: bool = False,
+    ):
+        self.db_path = db_path
+        self.size = size
+        self.pragmas = tuple(pragmas)
+        self.read_only = read_only
+        self._connections: List[aiosqlite.Connection] = []
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._closed = True
+
+    async def open(self):
+        """Открытие всех соединений пула"""
+        if not self._closed:
+            return
+        for _ in range(self.size):
+            connection = await open_connection(
+                self.db_path, self.pragmas, self.read_only
+            )
+            self._connections.append(connection)
+            self._idle.put_nowait(connection)
+        self._closed = False
+        logger.info(
+            f"Пул соединений открыт: {self.db_path} ({self.size} соед.)"
+        )
+
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        if self._closed:
+            return
+        self._closed = True
+        # Дожидаемся возврата соединений, которые сейчас заняты
+        for _ in range(len(self._connections)):
+            await self._idle.get()
+        for connection in self._connections:
+            await connection.close()
+        self._connections.clear()
+        logger.info("Пул соединений закрыт")
+
+    async def set_trace_callback(self, callback: Optional[Callable]):
+        """Установка обработчика трассировки SQL на все соединения"""
+        for connection in self._connections:
+            await connection.set_trace_callback(callback)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Получение соединения из пула на время операции"""
+        if self._closed:
+            raise RuntimeError("Пул соединений не открыт")
+        connection = await self._idle.get()
+        try:
+            yield connection
+        except BaseException:
+            # Не оставляем незавершенную транзакцию следующему владельцу
+            if connection.in_transaction:
+                await connection.rollback()
+            raise
+        finally:
+            self._idle.put_nowait(connection)
+
+
+class SQLiteWriter:
+    """Единственное соединение для записи с очередью операций.
+
+    Все изменения выполняются по одному в отдельной задаче, поэтому
+    писатели не конкурируют за блокировку файла, а каждая операция
+    фиксируется отдельной транзакцией.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        pragmas: Sequence[str] = ("PRAGMA foreign_keys = ON",),
+        max_queue: int = 1000,
+    ):
+        self.db_path = db_path
+        self.pragmas = tuple(pragmas)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._connection: aiosqlite.Connection = None
+        self._task: asyncio.Task = None
+
+    async def open(self):
+        """Открытие соединения и запуск задачи записи"""
+        if self._task is not None:
+            return
+        self._connection = await open_connection(self.db_path, self.pragmas)
+        self._task = asyncio.create_task(self._worker())
+        logger.info(f"Писатель базы данных запущен: {self.db_path}")
+
+    async def close(self):
+        """Выполнение оставшихся операций и закрытие соединения"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        await self._connection.close()
+        self._connection = None
+        logger.info("Писатель базы данных остановлен")
+
+    async def set_trace_callback(self, callback: Optional[Callable]):
+        """Установка обработчика трассировки SQL на соединение писателя"""
+        await self._connection.set_trace_callback(callback)
+
+    async def run(self, operation: Operation) -> Any:
+        """Выполнение операции в транзакции писателя"""
+        if self._task is None:
+            raise RuntimeError("Писатель базы данных не запущен")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((operation, future))
+        return await future
+
+    async def execute(self, sql: str, parameters: Sequence = ()) -> int:
+        """Выполнение одного изменяющего запроса, возвращает lastrowid"""
+        async def operation(connection: aiosqlite.Connection) -> int:
+            cursor = await connection.execute(sql, parameters)
+            await cursor.close()
+            return cursor.lastrowid
+
+        return await self.run(operation)
+
+    async def _worker(self):
+        """Последовательное выполнение операций из очереди"""
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            operation, future = item
+            if future.cancelled():
+                continue
+            try:
+                result = await operation(self._connection)
+                await self._connection.commit()
+            except Exception as e:
+                if self._connection.in_transaction:
+                    await self._connection.rollback()
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
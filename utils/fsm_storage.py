@@ -0,0 +1,228 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from utils.logger import logger
+from utils.records import FSMState
+
+# Состояние и данные пользователя
+Record = Tuple[Optional[str], Dict[str, Any]]
+EMPTY: Record = (None, {})
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def fsm_key(key: StorageKey) -> str:
+    """Ключ записи: бот, чат, пользователь, тема, назначение"""
+    return (
+        f"{key.bot_id}:{key.chat_id}:{key.user_id}:"
+        f"{key.thread_id or ''}:{key.destiny}"
+    )
+
+
+def _timestamp(moment: float) -> str:
+    return datetime.fromtimestamp(moment, timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def _moment(timestamp: str) -> float:
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT).replace(
+        tzinfo=timezone.utc
+    ).timestamp()
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в таблице fsm_states с LRU-кэшем в памяти.
+
+    Состояние читается из кэша, при промахе - из базы. Изменение сразу
+    попадает в кэш и в набор измененных ключей, который фоновая задача
+    раз в flush_interval записывает одной транзакцией: несколько изменений
+    ключа между записями дают одну строку, пустое состояние удаляет
+    строку. Состояние, к которому не обращались state_ttl секунд,
+    сбрасывается; раз в purge_interval такие строки удаляются из базы.
+
+    Кэш у каждого процесса свой, поэтому процессы могут делить таблицу,
+    только если апдейты одного пользователя попадают в один процесс;
+    при передаче пользователя другому процессу вызывается release().
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        flush_interval: float = 0.5,
+        state_ttl: float = 7 * 24 * 3600,
+        purge_interval: float = 3600,
+    ):
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.state_ttl = state_ttl
+        self.purge_interval = purge_interval
+        self.hits = 0
+        self.misses = 0
+        self.written = 0
+        self._db = None
+        # ключ → (состояние и данные, момент последнего изменения)
+        self._entries: "OrderedDict[str, Tuple[Record, float]]" = OrderedDict()
+        # Измененные ключи до записи и пачка, которая записывается сейчас
+        self._dirty: Dict[str, FSMState] = {}
+        self._flushing: Dict[str, FSMState] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(self, db):
+        """Подключение к базе и запуск фоновой записи"""
+        self._db = db
+        if self._task is None:
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Запись измененных состояний и остановка фоновой задачи"""
+        if self._task is None:
+            # Изменения, сделанные после остановки, дописываются сразу
+            if self._db is not None:
+                await self._flush()
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        logger.info(f"Состояния FSM записаны: {self.stats()}")
+
+    async def set_state(self, key: StorageKey, state: StateType = None):
+        if isinstance(state, State):
+            state = state.state
+        name = fsm_key(key)
+        _, data = await self._get(name)
+        self._put(name, (state, data), time.time())
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(fsm_key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]):
+        name = fsm_key(key)
+        state, _ = await self._get(name)
+        self._put(name, (state, data.copy()), time.time())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get(fsm_key(key)))[1].copy()
+
+    async def release(self, key: StorageKey) -> bool:
+        """Запись изменений в базу и удаление ключа из кэша.
+
+        Нужна перед передачей пользователя другому процессу: тот прочитает
+        состояние из базы. False - запись не удалась, ключ остается.
+        """
+        name = fsm_key(key)
+        if not await self._flush():
+            return False
+        self._entries.pop(name, None)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики кэша и записей"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "dirty": len(self._dirty),
+            "written": self.written,
+        }
+
+    async def _get(self, name: str) -> Record:
+        """Состояние из кэша, из ожидающих записи или из базы"""
+        entry = self._entries.get(name)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(name)
+        else:
+            self.misses += 1
+            entry = self._pending(name)
+            if entry is None:
+                row = await self._db.get_fsm_state(name)
+                entry = self._decode(row) if row else (EMPTY, time.time())
+                # Пока шло чтение, ключ мог измениться - новое значение важнее
+                entry = self._entries.get(name) or self._pending(name) or entry
+            self._cache(name, entry)
+
+        record, updated = entry
+        age = time.time() - updated
+        if record != EMPTY and age >= self.state_ttl / 2:
+            if age >= self.state_ttl:
+                # Пользователь не появлялся дольше state_ttl
+                record = EMPTY
+            # Обращение продлевает жизнь состояния в базе
+            self._put(name, record, time.time())
+        return record
+
+    def _pending(self, name: str) -> Optional[Tuple[Record, float]]:
+        """Значение, еще не записанное в базу"""
+        row = self._dirty.get(name) or self._flushing.get(name)
+        return self._decode(row) if row else None
+
+    def _put(self, name: str, record: Record, updated: float):
+        """Изменение в кэше с постановкой в очередь на запись"""
+        state, data = record
+        self._cache(name, (record, updated))
+        self._dirty[name] = FSMState(
+            name, state, json.dumps(data, ensure_ascii=False), _timestamp(updated)
+        )
+
+    def _cache(self, name: str, entry: Tuple[Record, float]):
+        self._entries[name] = entry
+        self._entries.move_to_end(name)
+        # Вытесненный измененный ключ остается в _dirty до записи
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _decode(row: FSMState) -> Tuple[Record, float]:
+        return (row.state, json.loads(row.data)), _moment(row.updated_at)
+
+    async def _run(self):
+        """Фоновая запись измененных состояний и удаление устаревших"""
+        purged = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush()
+            if self._closing:
+                break
+            if time.monotonic() - purged >= self.purge_interval:
+                purged = time.monotonic()
+                deleted = await self._db.delete_expired_fsm_states(
+                    _timestamp(time.time() - self.state_ttl)
+                )
+                if deleted:
+                    logger.info(f"Удалено устаревших состояний FSM: {deleted}")
+
+    async def _flush(self) -> bool:
+        """Запись всех измененных ключей одной транзакцией"""
+        # Записи идут по одной: после ожидания записаны и более ранние пачки
+        async with self._flush_lock:
+            if not self._dirty:
+                return True
+            self._flushing, self._dirty = self._dirty, {}
+            saved = await self._db.save_fsm_states(list(self._flushing.values()))
+            if saved:
+                self.written += len(self._flushing)
+            else:
+                # Повтор при следующей записи, если ключ с тех пор не менялся
+                for name, row in self._flushing.items():
+                    self._dirty.setdefault(name, row)
+            self._flushing = {}
+            return saved
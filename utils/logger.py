@@ -1,7 +1,7 @@
 import logging
 import sys
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, WatchedFileHandler
 
 
 # Создаем директорию для логов, если её нет
@@ -14,13 +14,15 @@ formatter = logging.Formatter(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-# Настройка обработчика для файла
-file_handler = RotatingFileHandler(
-    filename=log_dir / 'bot.log',
-    maxBytes=10 * 1024 * 1024,  # 10 MB
-    backupCount=5,
-    encoding='utf-8'
-)
+log_file = log_dir / 'bot.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 10 MB
+LOG_BACKUP_COUNT = 5
+
+# Настройка обработчика для файла. В bot.log пишут и обработчики,
+# запущенные супервизором, поэтому по умолчанию файл не ротируется, а
+# заново открывается после переименования; ротацию включает только
+# запускающий процесс (setup_logger(rotate=True))
+file_handler = WatchedFileHandler(filename=log_file, encoding='utf-8')
 file_handler.setFormatter(formatter)
 file_handler.setLevel(logging.INFO)
 
@@ -36,8 +38,22 @@ logger.addHandler(file_handler)
 logger.addHandler(console_handler)
 
 
-def setup_logger():
+def setup_logger(rotate: bool = False):
     """Настройка логгера для всего приложения"""
+    global file_handler
+    if rotate:
+        logger.removeHandler(file_handler)
+        file_handler.close()
+        file_handler = RotatingFileHandler(
+            filename=log_file,
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+        file_handler.setFormatter(formatter)
+        file_handler.setLevel(logging.INFO)
+        logger.addHandler(file_handler)
+
     # Логгер для aiogram
     aiogram_logger = logging.getLogger('aiogram')
     aiogram_logger.setLevel(logging.WARNING)
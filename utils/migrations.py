@@ -0,0 +1,321 @@
+from typing import Awaitable, Callable, List, Tuple
+
+import aiosqlite
+
+from utils.logger import logger
+
+
+Migration = Callable[[aiosqlite.Connection], Awaitable[None]]
+
+SERVICE_POINTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        city TEXT NOT NULL,
+        address TEXT NOT NULL,
+        phone_store TEXT,
+        phone_service TEXT,
+        work_schedule_weekdays TEXT,
+        work_schedule_weekend TEXT,
+        service_schedule_weekdays TEXT,
+        service_schedule_weekend TEXT,
+        service_manager_name TEXT,
+        maps_2gis_link TEXT,
+        google_maps_link TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(city, address)
+    )
+"""
+
+
+async def _table_exists(connection: aiosqlite.Connection, name: str) -> bool:
+    """Проверка существования таблицы"""
+    cursor = await connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?",
+        (name,)
+    )
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row is not None
+
+
+async def _has_column(
+    connection: aiosqlite.Connection, table: str, column: str
+) -> bool:
+    """Проверка наличия колонки в таблице"""
+    cursor = await connection.execute(f"PRAGMA table_info({table})")
+    rows = await cursor.fetchall()
+    await cursor.close()
+    return any(row[1] == column for row in rows)
+
+
+async def _has_unique_index(
+    connection: aiosqlite.Connection, table: str, columns: Tuple[str, ...]
+) -> bool:
+    """Проверка наличия уникального индекса по набору колонок"""
+    cursor = await connection.execute(f"PRAGMA index_list({table})")
+    indexes = await cursor.fetchall()
+    await cursor.close()
+    for _, index_name, unique, *_ in indexes:
+        if not unique:
+            continue
+        cursor = await connection.execute(f"PRAGMA index_info({index_name})")
+        index_columns = tuple(row[2] for row in await cursor.fetchall())
+        await cursor.close()
+        if index_columns == columns:
+            return True
+    return False
+
+
+async def _initial_schema(connection: aiosqlite.Connection):
+    """Базовая схема: торговые точки, каталог, пользователи и чаты"""
+    if await _table_exists(connection, "service_points") and not (
+        await _has_unique_index(
+            connection, "service_points", ("city", "address")
+        )
+    ):
+        # Старая таблица без UNIQUE(city, address) перестраивается один раз
+        await connection.execute(
+            SERVICE_POINTS_TABLE.format(name="service_points_new")
+        )
+        await connection.execute("""
+            INSERT INTO service_points_new (
+                id, city, address, phone_store, phone_service,
+                work_schedule_weekdays, work_schedule_weekend,
+                service_schedule_weekdays, service_schedule_weekend,
+                service_manager_name, maps_2gis_link, google_maps_link,
+                created_at, updated_at
+            )
+            SELECT
+                id, city, address, phone_store, phone_service,
+                work_schedule_weekdays, work_schedule_weekend,
+                service_schedule_weekdays, service_schedule_weekend,
+                service_manager_name, maps_2gis_link, google_maps_link,
+                created_at, updated_at
+            FROM service_points
+        """)
+        await connection.execute("DROP TABLE service_points")
+        await connection.execute(
+            "ALTER TABLE service_points_new RENAME TO service_points"
+        )
+    else:
+        await connection.execute(
+            SERVICE_POINTS_TABLE.format(name="service_points")
+        )
+
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            vehicle_type TEXT NOT NULL,
+            subtype TEXT,
+            size TEXT NOT NULL,
+            link TEXT NOT NULL
+        )
+    """)
+
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_name TEXT,
+            last_name TEXT,
+            username TEXT,
+            phone_number TEXT,
+            birth_date TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS contact_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            request_type TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            manager_id INTEGER,
+            status TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            closed_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS chat_ratings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            rating INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (chat_id) REFERENCES chats(id)
+        )
+    """)
+
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            sender_id INTEGER,
+            message_text TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS user_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            action TEXT,
+            details TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+
+async def _hot_query_indexes(connection: aiosqlite.Connection):
+    """Индексы для горячих запросов каталога, чатов и логов"""
+    # Каталог: все выборки идут по префиксу category, vehicle_type,
+    # а ссылка включена в индекс, чтобы не читать саму таблицу
+    await connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_products_lookup
+        ON products (category, vehicle_type, subtype, size, link)
+    """)
+    # Текущий чат пользователя (get_chat, get_active_chat)
+    await connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chats_user
+        ON chats (user_id, created_at, status)
+    """)
+    # Активный чат менеджера и его рейтинг
+    await connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chats_manager
+        ON chats (manager_id, status, created_at)
+    """)
+    # Очередь ожидающих чатов
+    await connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chats_status
+        ON chats (status, created_at)
+    """)
+    await connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_ratings_chat
+        ON chat_ratings (chat_id, rating)
+    """)
+    await connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_logs_user
+        ON user_logs (user_id, created_at)
+    """)
+
+
+async def _products_unique_key(connection: aiosqlite.Connection):
+    """Уникальный ключ товара для импорта с обновлением"""
+    # Из повторов остается первый товар - его же раньше возвращал поиск
+    await connection.execute("""
+        DELETE FROM products
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM products
+            GROUP BY category, vehicle_type, IFNULL(subtype, ''), size
+        )
+    """)
+    # NULL в UNIQUE не равен NULL, поэтому подтип сравнивается через IFNULL
+    await connection.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_products_key
+        ON products (category, vehicle_type, IFNULL(subtype, ''), size)
+    """)
+
+
+async def _chat_accepted_at(connection: aiosqlite.Connection):
+    """Время принятия чата менеджером"""
+    # accept_chat всегда писал эту колонку, но в схеме ее не было
+    if not await _has_column(connection, "chats", "accepted_at"):
+        await connection.execute(
+            "ALTER TABLE chats ADD COLUMN accepted_at TIMESTAMP"
+        )
+
+
+async def _fsm_states(connection: aiosqlite.Connection):
+    """Состояния FSM пользователей"""
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP NOT NULL
+        )
+    """)
+    # Удаление давно не менявшихся состояний
+    await connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_fsm_states_updated
+        ON fsm_states (updated_at)
+    """)
+
+
+# Нумерованные шаги миграции. Номер шага записывается в PRAGMA user_version,
+# поэтому каждый шаг применяется ровно один раз. Новые шаги добавляются
+# только в конец списка.
+MIGRATIONS: List[Tuple[int, Migration]] = [
+    (1, _initial_schema),
+    (2, _hot_query_indexes),
+    (3, _products_unique_key),
+    (4, _chat_accepted_at),
+    (5, _fsm_states),
+]
+
+
+async def get_schema_version(connection: aiosqlite.Connection) -> int:
+    """Получение текущей версии схемы"""
+    cursor = await connection.execute("PRAGMA user_version")
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row[0]
+
+
+async def migrate(connection: aiosqlite.Connection) -> int:
+    """Применение недостающих миграций, возвращает версию схемы.
+
+    Каждый шаг идет в транзакции BEGIN IMMEDIATE: блокировка записи
+    берется сразу (с ожиданием busy_timeout), а версия перечитывается уже
+    под ней. Поэтому несколько процессов могут мигрировать одну базу
+    одновременно: шаг применит только один из них.
+    """
+    version = await get_schema_version(connection)
+    for number, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        # Шаг и новая версия фиксируются одной транзакцией
+        await connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = await get_schema_version(connection)
+            if number <= version:
+                # Шаг уже применил другой процесс
+                await connection.commit()
+                continue
+            await migration(connection)
+            await connection.execute(f"PRAGMA user_version = {number}")
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+        logger.info(f"Применена миграция {number}: {migration.__doc__}")
+        version = number
+    return version
+
+
+async def check_schema(connection: aiosqlite.Connection) -> int:
+    """Проверка, что миграции уже применены; возвращает версию схемы"""
+    version = await get_schema_version(connection)
+    latest = MIGRATIONS[-1][0]
+    if version < latest:
+        raise RuntimeError(
+            f"Схема базы v{version} устарела, нужна v{latest}: "
+            f"миграции применяет процесс запуска"
+        )
+    return version
@@ -0,0 +1,117 @@
+from functools import lru_cache
+from typing import Callable, List, NamedTuple, Optional, Sequence, Type, TypeVar
+
+import aiosqlite
+
+
+RecordT = TypeVar("RecordT", bound=tuple)
+
+
+class User(NamedTuple):
+    """Пользователь бота"""
+    user_id: int
+    first_name: Optional[str]
+    last_name: Optional[str]
+    username: Optional[str]
+    phone_number: Optional[str]
+    birth_date: Optional[str]
+    created_at: Optional[str]
+    updated_at: Optional[str]
+
+
+class Chat(NamedTuple):
+    """Чат пользователя с менеджером; поля пользователя есть только в JOIN"""
+    id: int
+    user_id: int
+    manager_id: Optional[int]
+    status: str
+    created_at: Optional[str]
+    closed_at: Optional[str]
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    username: Optional[str] = None
+
+
+class ServicePoint(NamedTuple):
+    """Торговая точка"""
+    id: int
+    city: str
+    address: str
+    phone_store: Optional[str]
+    phone_service: Optional[str]
+    work_schedule_weekdays: Optional[str]
+    work_schedule_weekend: Optional[str]
+    service_schedule_weekdays: Optional[str]
+    service_schedule_weekend: Optional[str]
+    service_manager_name: Optional[str]
+    maps_2gis_link: Optional[str]
+    google_maps_link: Optional[str]
+    created_at: Optional[str]
+    updated_at: Optional[str]
+
+
+class Product(NamedTuple):
+    """Товар каталога"""
+    category: str
+    vehicle_type: str
+    subtype: Optional[str]
+    size: str
+    link: str
+
+
+class LogEntry(NamedTuple):
+    """Запись журнала действий пользователя"""
+    action: str
+    details: Optional[str]
+    created_at: str
+
+
+class FSMState(NamedTuple):
+    """Сохраненное состояние FSM; data - JSON"""
+    key: str
+    state: Optional[str]
+    data: str
+    updated_at: str
+
+
+def columns(record: Type[RecordT], alias: str = "") -> str:
+    """Список колонок для SELECT в порядке полей записи"""
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(f"{prefix}{field}" for field in record._fields)
+
+
+@lru_cache(maxsize=None)
+def row_factory(record: Type[RecordT]) -> Callable:
+    """Фабрика строк курсора: кортеж SQLite сразу становится записью"""
+    def factory(cursor, row: Sequence) -> RecordT:
+        return record(*row)
+
+    return factory
+
+
+async def fetch_one(
+    connection: aiosqlite.Connection,
+    record: Type[RecordT],
+    sql: str,
+    parameters: Sequence = ()
+) -> Optional[RecordT]:
+    """Выборка одной записи заданного типа"""
+    cursor = await connection.execute(sql, parameters)
+    cursor.row_factory = row_factory(record)
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row
+
+
+async def fetch_all(
+    connection: aiosqlite.Connection,
+    record: Type[RecordT],
+    sql: str,
+    parameters: Sequence = ()
+) -> List[RecordT]:
+    """Выборка всех записей заданного типа"""
+    cursor = await connection.execute(sql, parameters)
+    cursor.row_factory = row_factory(record)
+    rows = await cursor.fetchall()
+    await cursor.close()
+    return rows
@@ -0,0 +1,160 @@
+import heapq
+import itertools
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.records import Chat
+
+# Приоритеты очереди: меньше - раньше; внутри приоритета - по ID чата
+PRIORITY_RETRY = -1
+PRIORITY_NORMAL = 0
+
+
+class ManagerRouting:
+    """Распределение чатов между менеджерами.
+
+    Новый чат встает в очередь ожидания с приоритетом. dispatch() раздает
+    чаты из очереди наименее загруженным менеджерам, у которых есть
+    свободные места: чат предлагается менеджеру и занимает место до
+    принятия или отклонения. Загрузка менеджера - сумма предложенных
+    и активных чатов, не больше capacity. Менеджер с несколькими
+    активными чатами пишет в выбранный чат.
+    """
+
+    def __init__(self, managers: Iterable[int], capacity: int = 3):
+        self.capacity = capacity
+        self._offered: Dict[int, Dict[int, None]] = {}
+        self._active: Dict[int, Dict[int, None]] = {}
+        # Номер последнего назначения: при равной загрузке чат получает
+        # менеджер, дольше всех ждавший нового чата
+        self._last_assigned: Dict[int, int] = {}
+        for manager_id in managers:
+            self._offered[manager_id] = {}
+            self._active[manager_id] = {}
+            self._last_assigned[manager_id] = 0
+        self._owner: Dict[int, int] = {}
+        self._selected: Dict[int, int] = {}
+        self._queue: List[Tuple[int, int]] = []
+        self._queued: Set[int] = set()
+        self._assignments = itertools.count(1)
+
+    @property
+    def managers(self) -> Tuple[int, ...]:
+        """ID менеджеров пула"""
+        return tuple(self._offered)
+
+    def is_manager(self, user_id: int) -> bool:
+        """Входит ли пользователь в пул менеджеров"""
+        return user_id in self._offered
+
+    def load(self, chats: Iterable[Chat]):
+        """Восстановление распределения по незакрытым чатам из базы"""
+        for chat in sorted(chats, key=lambda chat: chat.id):
+            if chat.status == "active" and self.is_manager(chat.manager_id):
+                self._active[chat.manager_id][chat.id] = None
+                self._owner[chat.id] = chat.manager_id
+                self._selected.setdefault(chat.manager_id, chat.id)
+            elif chat.status == "pending":
+                if self.is_manager(chat.manager_id):
+                    self._offered[chat.manager_id][chat.id] = None
+                    self._owner[chat.id] = chat.manager_id
+                else:
+                    self.enqueue(chat.id)
+
+    def enqueue(self, chat_id: int, priority: int = PRIORITY_NORMAL):
+        """Постановка чата в очередь ожидания"""
+        if chat_id in self._queued or chat_id in self._owner:
+            return
+        heapq.heappush(self._queue, (priority, chat_id))
+        self._queued.add(chat_id)
+
+    def queue_position(self, chat_id: int) -> Optional[int]:
+        """Место чата в очереди, начиная с 1"""
+        if chat_id not in self._queued:
+            return None
+        waiting = sorted(item for item in self._queue if item[1] in self._queued)
+        return [item[1] for item in waiting].index(chat_id) + 1
+
+    def dispatch(self) -> List[Tuple[int, int]]:
+        """Раздача чатов из очереди свободным менеджерам: [(чат, менеджер)]"""
+        assignments = []
+        while self._queue:
+            manager_id = self._least_loaded()
+            if manager_id is None:
+                break
+            _, chat_id = heapq.heappop(self._queue)
+            if chat_id not in self._queued:
+                continue
+            self._queued.discard(chat_id)
+            self._offered[manager_id][chat_id] = None
+            self._owner[chat_id] = manager_id
+            self._last_assigned[manager_id] = next(self._assignments)
+            assignments.append((chat_id, manager_id))
+        return assignments
+
+    def offered(self, manager_id: int, chat_id: Optional[int] = None) -> Optional[int]:
+        """Предложенный менеджеру чат: указанный или самый ранний"""
+        offered = self._offered.get(manager_id, {})
+        if chat_id is None:
+            return next(iter(offered), None)
+        return chat_id if chat_id in offered else None
+
+    def accept(self, manager_id: int, chat_id: int) -> bool:
+        """Принятие предложенного чата; принятый чат становится выбранным"""
+        if self.offered(manager_id, chat_id) is None:
+            return False
+        del self._offered[manager_id][chat_id]
+        self._active[manager_id][chat_id] = None
+        self._selected[manager_id] = chat_id
+        return True
+
+    def release(self, chat_id: int):
+        """Чат закрыт или отклонен: место у менеджера освобождается"""
+        self._queued.discard(chat_id)
+        manager_id = self._owner.pop(chat_id, None)
+        if manager_id is None:
+            return
+        self._offered[manager_id].pop(chat_id, None)
+        self._active[manager_id].pop(chat_id, None)
+        if self._selected.get(manager_id) == chat_id:
+            # Выбранным становится последний принятый из оставшихся
+            remaining = list(self._active[manager_id])
+            if remaining:
+                self._selected[manager_id] = remaining[-1]
+            else:
+                del self._selected[manager_id]
+
+    def select(self, manager_id: int, chat_id: int) -> bool:
+        """Явный выбор активного чата, в который пишет менеджер"""
+        if chat_id not in self._active.get(manager_id, {}):
+            return False
+        self._selected[manager_id] = chat_id
+        return True
+
+    def selected(self, manager_id: int) -> Optional[int]:
+        """Чат, в который сейчас пишет менеджер"""
+        return self._selected.get(manager_id)
+
+    def active_chats(self, manager_id: int) -> Tuple[int, ...]:
+        """Активные чаты менеджера в порядке принятия"""
+        return tuple(self._active.get(manager_id, {}))
+
+    def manager_load(self, manager_id: int) -> int:
+        """Число предложенных и активных чатов менеджера"""
+        return len(self._offered[manager_id]) + len(self._active[manager_id])
+
+    def stats(self) -> Dict[str, int]:
+        """Размер очереди и суммарная загрузка"""
+        return {
+            "queued": len(self._queued),
+            "offered": sum(len(chats) for chats in self._offered.values()),
+            "active": sum(len(chats) for chats in self._active.values()),
+        }
+
+    def _least_loaded(self) -> Optional[int]:
+        """Менеджер с наименьшей загрузкой среди имеющих свободные места"""
+        candidates = [
+            (self.manager_load(manager_id), self._last_assigned[manager_id], manager_id)
+            for manager_id in self._offered
+            if self.manager_load(manager_id) < self.capacity
+        ]
+        return min(candidates)[2] if candidates else None
@@ -0,0 +1,271 @@
+import asyncio
+import bisect
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware, NextRequestMiddlewareType
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from utils.logger import logger
+
+# Классы приоритета исходящих сообщений: меньше - раньше
+PRIORITY_RELAY = 0
+PRIORITY_NOTIFICATION = 1
+PRIORITY_BROADCAST = 2
+PRIORITY_NAMES = {
+    PRIORITY_RELAY: "relay",
+    PRIORITY_NOTIFICATION: "notification",
+    PRIORITY_BROADCAST: "broadcast",
+}
+
+# Лимиты Telegram: 30 сообщений в секунду на бота, 1 в секунду в личный
+# чат, 20 в минуту в группу. Значения по умолчанию взяты с запасом на
+# неравномерность сети
+GLOBAL_RATE = 28.0
+CHAT_RATE = 0.9
+GROUP_RATE = 19 / 60
+
+# Методы, на которые действуют лимиты отправки
+THROTTLED_METHODS = ("send", "copyMessage", "forwardMessage")
+
+_priority: ContextVar[int] = ContextVar(
+    "send_priority", default=PRIORITY_NOTIFICATION
+)
+
+
+@contextmanager
+def send_priority(priority: int):
+    """Приоритет отправок внутри блока with"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst в запасе.
+
+    Баланс может уйти в минус: после паузы по ответу 429 следующий токен
+    появится только через retry_after секунд.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до свободного токена"""
+        self._refill(now)
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def reserve(self, now: float):
+        """Списание токена"""
+        self._refill(now)
+        self._tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        """Токены не выдаются еще seconds секунд"""
+        self._refill(now)
+        self._tokens = min(self._tokens, 1.0 - seconds * self.rate)
+
+    def idle(self, now: float) -> bool:
+        """Ведро полное: его можно забыть без потери ограничения"""
+        self._refill(now)
+        return self._tokens >= self.burst
+
+    def _refill(self, now: float):
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих сообщений бота.
+
+    Подключается к сессии бота как middleware запросов, поэтому через него
+    проходят и bot.send_message, и message.answer. Отправки ждут в общей
+    очереди, упорядоченной по приоритету и времени постановки. Очередь
+    разбирает одна задача: она выдает токен общего ведра первой отправке,
+    чей чат тоже не исчерпал свой лимит (в группы - групповой), поэтому
+    чат, упершийся в лимит, не задерживает остальные. Приоритет задается
+    через send_priority(); по умолчанию - уведомление. Ответ 429
+    приостанавливает чат и всю очередь на retry_after, после чего отправка
+    повторяется. Остальные методы Bot API проходят без очереди.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        group_rate: float = GROUP_RATE,
+        max_retries: int = 3,
+        max_chats: int = 10000,
+    ):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.sent = 0
+        self.retried = 0
+        self.max_queued = 0
+        # Отправки, которые при последнем разборе ждали лимита своего чата
+        self.chat_waiting = 0
+        self._global = TokenBucket(global_rate)
+        self._chats: Dict[Hashable, TokenBucket] = {}
+        self._prune_at = max_chats
+        # (приоритет, номер, чат, future) по возрастанию
+        self._queue: List[Tuple[int, int, Hashable, asyncio.Future]] = []
+        self._queued: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+        self._sequence = itertools.count()
+        # Создаются в цикле событий при первой очереди
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump: Optional[asyncio.Task] = None
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not method.__api_method__.startswith(THROTTLED_METHODS):
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retried += 1
+                attempt += 1
+                logger.warning(
+                    f"Лимит отправки в чат {chat_id}, "
+                    f"пауза {e.retry_after} с, попытка {attempt}"
+                )
+                now = time.monotonic()
+                self._chat_bucket(chat_id).pause(now, e.retry_after)
+                self._global.pause(now, e.retry_after)
+                if attempt > self.max_retries:
+                    raise
+                continue
+            self.sent += 1
+            return response
+
+    def queue_depth(self) -> Dict[str, int]:
+        """Число отправок в очереди по классам приоритета"""
+        return {
+            name: self._queued[priority]
+            for priority, name in PRIORITY_NAMES.items()
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики отправок и глубина очереди"""
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "queued": len(self._queue),
+            "max_queued": self.max_queued,
+            "chat_waiting": self.chat_waiting,
+            **{f"queued_{name}": depth for name, depth in self.queue_depth().items()},
+        }
+
+    async def _acquire(self, chat_id: Hashable, priority: int):
+        """Ожидание токенов чата и общего ведра"""
+        bucket = self._chat_bucket(chat_id)
+        now = time.monotonic()
+        # Без очереди и при свободных токенах отправка идет сразу
+        if not self._queue and self._global.delay(now) == 0 and bucket.delay(now) == 0:
+            self._global.reserve(now)
+            bucket.reserve(now)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        bisect.insort(self._queue, (priority, next(self._sequence), chat_id, future))
+        self._queued[priority] = self._queued.get(priority, 0) + 1
+        self.max_queued = max(self.max_queued, len(self._queue))
+        if self._pump is None:
+            self._wakeup = asyncio.Event()
+            self._pump = asyncio.create_task(self._run_pump())
+        else:
+            self._wakeup.set()
+        try:
+            await future
+        finally:
+            self._queued[priority] -= 1
+
+    async def _run_pump(self):
+        """Выдача токенов по приоритету отправкам, чей чат готов"""
+        try:
+            while self._queue:
+                now = time.monotonic()
+                delay = self._global.delay(now)
+                if delay == 0:
+                    delay = self._grant(now)
+                    if delay == 0:
+                        continue
+                # Новая отправка может оказаться готовой раньше
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._pump = None
+
+    def _grant(self, now: float) -> float:
+        """Выдача токена первой готовой отправке; иначе - время до готовности"""
+        delay = float("inf")
+        blocked = set()
+        for index, (_, _, chat_id, future) in enumerate(self._queue):
+            if future.done():
+                # Отправку отменили, пока она ждала в очереди
+                del self._queue[index]
+                return 0.0
+            if chat_id in blocked:
+                continue
+            bucket = self._chat_bucket(chat_id)
+            chat_delay = bucket.delay(now)
+            if chat_delay == 0:
+                del self._queue[index]
+                self._global.reserve(now)
+                bucket.reserve(now)
+                future.set_result(None)
+                self.chat_waiting = len(blocked)
+                return 0.0
+            blocked.add(chat_id)
+            delay = min(delay, chat_delay)
+        self.chat_waiting = len(self._queue)
+        return delay
+
+    def _chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self._prune_at:
+                self._prune()
+            # Отрицательный ID - группа или канал
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        """Удаление полных ведер: они ничего не ограничивают"""
+        now = time.monotonic()
+        for chat_id in [
+            chat_id for chat_id, bucket in self._chats.items() if bucket.idle(now)
+        ]:
+            del self._chats[chat_id]
+        self._prune_at = max(self.max_chats, len(self._chats) * 2)
@@ -0,0 +1,90 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Deque, Dict, Hashable, Optional, Set
+
+from utils.logger import logger
+
+
+class TaskSupervisor:
+    """Фоновые задачи с ограничением параллельности и порядком по ключу.
+
+    Задачи с одним ключом (например, ID чата) выполняются строго по очереди
+    в порядке постановки, задачи с разными ключами - параллельно, но не
+    больше limit одновременно. Ошибки задач пишутся в лог и не
+    прерывают остальные задачи. close() дожидается выполнения всего,
+    что было поставлено.
+    """
+
+    def __init__(self, limit: int = 100, name: str = "background"):
+        self.name = name
+        self.errors = 0
+        self._semaphore = asyncio.Semaphore(limit)
+        self._tasks: Set[asyncio.Task] = set()
+        # Очередь ключа существует, пока по нему работает обработчик
+        self._queues: Dict[Hashable, Deque[Awaitable]] = {}
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        """Число задач, которые еще не завершились"""
+        return len(self._tasks) + sum(
+            len(queue) for queue in self._queues.values()
+        )
+
+    def submit(self, job: Awaitable, key: Optional[Hashable] = None):
+        """Постановка корутины в фон; с ключом - после задач этого ключа"""
+        if self._closed:
+            if asyncio.iscoroutine(job):
+                job.close()
+            raise RuntimeError(f"Фоновые задачи {self.name} остановлены")
+        if key is None:
+            self._spawn(self._execute(job))
+            return
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(job)
+            return
+        self._queues[key] = deque([job])
+        self._spawn(self._run_key(key))
+
+    async def submit_or_run(self, job: Awaitable, key: Optional[Hashable] = None):
+        """Постановка в фон; после close() задача выполняется на месте"""
+        if not self._closed:
+            self.submit(job, key)
+            return
+        queue = self._queues.get(key) if key is not None else None
+        if queue is not None:
+            # close() еще ждет очередь ключа: порядок внутри ключа сохраняется
+            queue.append(job)
+            return
+        await self._execute(job)
+
+    async def close(self):
+        """Прием новых задач прекращается, поставленные дорабатывают"""
+        self._closed = True
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info(
+            f"Фоновые задачи {self.name} завершены, ошибок: {self.errors}"
+        )
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_key(self, key: Hashable):
+        queue = self._queues[key]
+        try:
+            while queue:
+                await self._execute(queue.popleft())
+        finally:
+            del self._queues[key]
+
+    async def _execute(self, job: Awaitable):
+        async with self._semaphore:
+            try:
+                await job
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ошибка фоновой задачи {self.name}: {e}")
@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+ValueT = TypeVar("ValueT")
+
+
+class TTLCache(Generic[ValueT]):
+    """Ограниченный LRU-кэш со сроком жизни записей и порядком записи.
+
+    Запись в базу получает номер из begin_write() внутри транзакции
+    писателя, поэтому номера идут в порядке фиксации; после фиксации или
+    отката о ней сообщает end_write(). Зафиксированное значение кладется
+    через store() и принимается, только если по ключу не началась более
+    новая запись. Чтение из базы берет токен - номер последней завершенной
+    записи - до запроса и кладет результат через fill(): значение
+    принимается, только если последняя запись ключа завершилась до
+    получения токена, то есть видна прочитавшему запросу.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # ключ → (значение, момент устаревания)
+        self._entries: "OrderedDict[Hashable, Tuple[ValueT, float]]" = (
+            OrderedDict()
+        )
+        self._sequence = 0
+        # Наибольший номер завершенной записи: писатель один, поэтому все
+        # записи с меньшими номерами тоже завершены
+        self._committed = 0
+        # ключ → номер последней начатой записи; старейшие вытесняются,
+        # а их наибольший номер запоминается в _floor
+        self._writes: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._floor = -1
+
+    def token(self) -> int:
+        """Токен для чтения: номер последней завершенной записи"""
+        return self._committed
+
+    def begin_write(self, key: Hashable) -> int:
+        """Номер записи ключа; вызывается внутри транзакции писателя"""
+        self._sequence += 1
+        self._writes[key] = self._sequence
+        self._writes.move_to_end(key)
+        while len(self._writes) > self.maxsize:
+            _, sequence = self._writes.popitem(last=False)
+            self._floor = max(self._floor, sequence)
+        return self._sequence
+
+    def end_write(self, sequence: int):
+        """Запись под номером sequence зафиксирована или откатена"""
+        self._committed = max(self._committed, sequence)
+
+    def get(self, key: Hashable) -> Optional[ValueT]:
+        """Значение из кэша или None при промахе"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def store(self, key: Hashable, value: ValueT, sequence: int):
+        """Значение, записанное в базу под номером sequence"""
+        if self._writes.get(key) == sequence:
+            self._set(key, value)
+
+    def fill(self, key: Hashable, value: ValueT, token: int):
+        """Значение, прочитанное из базы после получения токена token"""
+        if self._writes.get(key, self._floor) <= token:
+            self._set(key, value)
+
+    def discard(self, key: Hashable):
+        """Удаление значения: следующее чтение пойдет в базу"""
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+        }
+
+    def _set(self, key: Hashable, value: ValueT):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
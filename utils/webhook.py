@@ -0,0 +1,102 @@
+import asyncio
+from typing import Any, Dict, Hashable, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from utils.logger import logger
+from utils.tasks import TaskSupervisor
+
+
+def update_key(update: Dict[str, Any]) -> Optional[Hashable]:
+    """Отправитель апдейта: его апдейты обрабатываются по порядку"""
+    for name, event in update.items():
+        if name != "update_id" and isinstance(event, dict):
+            sender = event.get("from") or event.get("chat") or {}
+            return sender.get("id")
+    return None
+
+
+class WebhookHandler(SimpleRequestHandler):
+    """Прием апдейтов от Telegram по webhook.
+
+    Апдейт подтверждается ответом 200 сразу после проверки секретного
+    токена и обрабатывается в фоне через TaskSupervisor: не больше limit
+    апдейтов одновременно, апдейты одного отправителя - по порядку. Если
+    в работе уже max_pending апдейтов, ответ 503 - Telegram повторит
+    доставку позже. При остановке сервера close() дожидается апдейтов
+    в работе; сессию бота закрывает вызывающий код.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret_token: str,
+        limit: int = 100,
+        max_pending: int = 10000,
+        **data: Any,
+    ):
+        super().__init__(
+            dispatcher, bot, handle_in_background=True,
+            secret_token=secret_token, **data
+        )
+        self.max_pending = max_pending
+        self.rejected = 0
+        self.workers = TaskSupervisor(limit=limit, name="webhook")
+
+    async def _handle_request_background(
+        self, bot: Bot, request: web.Request
+    ) -> web.Response:
+        if self.workers.pending >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503)
+        update = await request.json(loads=bot.session.json_loads)
+        self.workers.submit(
+            self._background_feed_update(bot=bot, update=update),
+            key=update_key(update)
+        )
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self):
+        await self.workers.close()
+        if self.rejected:
+            logger.warning(f"Апдейтов отклонено при перегрузке: {self.rejected}")
+
+
+def create_webhook_app(
+    dispatcher: Dispatcher, bot: Bot, path: str, secret_token: str,
+    limit: int = 100
+) -> web.Application:
+    """Приложение aiohttp с обработчиком webhook и хуками диспетчера"""
+    app = web.Application()
+    handler = WebhookHandler(dispatcher, bot, secret_token, limit=limit)
+    handler.register(app, path=path)
+    app["webhook_handler"] = handler
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def run_webhook(
+    dispatcher: Dispatcher, bot: Bot, *, host: str, port: int, path: str,
+    secret_token: str, url: Optional[str] = None, limit: int = 100
+):
+    """Сервер webhook до отмены; с url - адрес регистрируется в Telegram"""
+    app = create_webhook_app(dispatcher, bot, path, secret_token, limit=limit)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        if url:
+            await bot.set_webhook(
+                url.rstrip("/") + path,
+                secret_token=secret_token,
+                allowed_updates=dispatcher.resolve_used_update_types(),
+            )
+        logger.info(f"Webhook слушает {host}:{port}{path}")
+        await asyncio.Event().wait()
+    finally:
+        # Остановка сервера дожидается апдейтов в работе
+        await runner.cleanup()
@@ -0,0 +1,570 @@
+import asyncio
+import os
+import signal
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import (
+    ClientConnectorError, ClientSession, ClientTimeout, UnixConnector, web
+)
+
+from utils.logger import logger
+
+# Процесс поддержки: в нем живут реестр чатов и распределение по
+# менеджерам, поэтому менеджеры и пользователи в диалоге с ними
+# обрабатываются только здесь
+SUPPORT_WORKER = 0
+
+HEALTH_INTERVAL = 5.0
+HEALTH_FAILURES = 3
+HEALTH_TIMEOUT = 10.0
+START_TIMEOUT = 60.0
+DRAIN_TIMEOUT = 30.0
+STOP_TIMEOUT = 30.0
+REQUEST_TIMEOUT = 60.0
+
+# Адрес для запросов через unix-сокет: хост не используется
+WORKER_URL = "http://worker"
+
+
+def shard(user_id: int, processes: int) -> int:
+    """Процесс пользователя по его ID"""
+    return user_id % processes
+
+
+def update_sender(update: Update) -> Optional[int]:
+    """ID отправителя апдейта"""
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat is not None else None
+
+
+class WorkerProcess:
+    """Процесс-обработчик: дочерний процесс и клиент к его unix-сокету"""
+
+    def __init__(self, index: int, command: List[str], socket_path: str):
+        self.index = index
+        self.command = command
+        self.socket_path = socket_path
+        self.inflight = 0
+        self.failures = 0
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._session: Optional[ClientSession] = None
+        self._idle: Optional[asyncio.Event] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        """Запуск процесса"""
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._session = ClientSession(
+            connector=UnixConnector(path=self.socket_path, limit=0),
+            timeout=ClientTimeout(total=REQUEST_TIMEOUT),
+        )
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            "--worker", str(self.index),
+            "--socket", self.socket_path,
+        )
+        logger.info(f"Запущен обработчик {self.index}, pid {self.process.pid}")
+
+    async def request(
+        self, method: str, path: str, body: Optional[str] = None,
+        timeout: Optional[ClientTimeout] = None, **params: Any
+    ) -> Dict:
+        """Запрос к процессу; ответ - JSON"""
+        self.inflight += 1
+        self._idle.clear()
+        try:
+            async with self._session.request(
+                method, WORKER_URL + path,
+                params={name: str(value) for name, value in params.items()},
+                data=body,
+                headers={"Content-Type": "application/json"} if body else None,
+                # Без timeout действует общий REQUEST_TIMEOUT сессии
+                timeout=timeout or self._session.timeout,
+            ) as response:
+                response.raise_for_status()
+                return await response.json()
+        finally:
+            self.inflight -= 1
+            if not self.inflight:
+                self._idle.set()
+
+    async def healthy(self) -> bool:
+        """Процесс жив и отвечает на проверку"""
+        if not self.alive:
+            return False
+        try:
+            response = await self.request(
+                "GET", "/health", timeout=ClientTimeout(total=HEALTH_TIMEOUT)
+            )
+            return response.get("ok", False)
+        except Exception:
+            # Включая закрытую сессию процесса, который уже заменили
+            return False
+
+    async def wait_healthy(self, timeout: float = START_TIMEOUT) -> bool:
+        """Ожидание готовности после запуска"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.alive:
+                return False
+            if os.path.exists(self.socket_path) and await self.healthy():
+                return True
+            await asyncio.sleep(0.1)
+        return False
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT):
+        """Ожидание ответов на уже переданные апдейты"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Обработчик {self.index} не ответил на {self.inflight} апдейтов"
+            )
+
+    async def stop(self, timeout: float = STOP_TIMEOUT):
+        """Остановка: SIGTERM, после timeout - SIGKILL"""
+        if self.alive:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Обработчик {self.index} не остановился, SIGKILL")
+                self.process.kill()
+                await self.process.wait()
+        if self._session is not None:
+            await self._session.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self.process is not None:
+            logger.info(
+                f"Обработчик {self.index} остановлен, код {self.process.returncode}"
+            )
+
+
+class WorkerSlot:
+    """Место в пуле: текущий процесс и признак приема апдейтов"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.generation = 0
+        self.worker: Optional[WorkerProcess] = None
+        # Создается в цикле событий при запуске пула
+        self.ready: Optional[asyncio.Event] = None
+
+
+class WorkerPool:
+    """Пул процессов-обработчиков с распределением апдейтов по пользователям.
+
+    Апдейт пользователя уходит в процесс shard(user_id) и передается
+    следующим только после ответа на предыдущий, поэтому у каждого
+    пользователя порядок сохраняется, а его кэшированные состояния живут
+    в одном процессе. Менеджеры, тексты из support_texts и пользователи,
+    о которых процесс ответил support=true, обрабатываются в процессе
+    SUPPORT_WORKER. При переходе пользователя в другой процесс прежний
+    сначала записывает его состояние в базу и забывает его кэш.
+
+    Пользователи с открытыми чатами (support_loader, обычно из базы)
+    направляются в SUPPORT_WORKER с запуска пула и после каждой замены
+    процесса, даже если их апдейтов еще не было: иначе после перезапуска
+    супервизора или процесса поддержки их сообщения попали бы в процесс
+    shard(user_id) и обработались бы как обычный ввод.
+
+    Раз в HEALTH_INTERVAL процессы проверяются; упавший или не отвечающий
+    HEALTH_FAILURES раз подряд перезапускается. restart() заменяет процесс
+    без потери апдейтов: новый процесс запускается заранее, прием в место
+    приостанавливается, старый дорабатывает переданные апдейты и
+    останавливается с записью буферов, после чего новый перечитывает
+    общее состояние из базы и принимает апдейты.
+    """
+
+    def __init__(
+        self,
+        command: List[str],
+        processes: int,
+        support_users: Iterable[int] = (),
+        support_texts: Iterable[str] = (),
+        run_dir: Optional[str] = None,
+        support_loader: Optional[Callable[[], Awaitable[Iterable[int]]]] = None,
+    ):
+        self.command = command
+        self.processes = processes
+        self.support_users = frozenset(support_users)
+        self.support_texts = frozenset(support_texts)
+        self.run_dir = run_dir or tempfile.mkdtemp(prefix="bot-workers-")
+        self.support_loader = support_loader
+        self.dispatched = 0
+        self.errors = 0
+        self.moves = 0
+        self.restarts = 0
+        self._slots = [WorkerSlot(index) for index in range(processes)]
+        # Пользователи в диалоге с менеджером, не считая самих менеджеров
+        self._support: Set[int] = set()
+        # Ожидание предыдущего апдейта по отправителю
+        self._tails: Dict[Hashable, asyncio.Future] = {}
+        self._restart_lock: Optional[asyncio.Lock] = None
+        self._health: Optional[asyncio.Task] = None
+        self._rolling: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(self):
+        """Запуск всех процессов и проверки их состояния"""
+        self._restart_lock = asyncio.Lock()
+        for slot in self._slots:
+            slot.ready = asyncio.Event()
+        workers = [self._spawn(slot) for slot in self._slots]
+        await asyncio.gather(*(worker.start() for worker in workers))
+        ready = await asyncio.gather(*(worker.wait_healthy() for worker in workers))
+        if not all(ready):
+            await asyncio.gather(*(worker.stop() for worker in workers))
+            raise RuntimeError("Обработчики не запустились")
+        for slot, worker in zip(self._slots, workers):
+            await worker.request("POST", "/activate")
+            slot.worker = worker
+        await self._load_support()
+        for slot in self._slots:
+            slot.ready.set()
+        self._health = asyncio.create_task(self._watch())
+        logger.info(f"Запущено обработчиков: {self.processes}")
+
+    async def close(self):
+        """Остановка проверок и всех процессов"""
+        if self._restart_lock is None:
+            return
+        self._closing = True
+        if self._rolling is not None:
+            await self._rolling
+        # Начатая замена процесса доводится до конца
+        async with self._restart_lock:
+            if self._health is not None:
+                self._health.cancel()
+                await asyncio.gather(self._health, return_exceptions=True)
+                self._health = None
+            for slot in self._slots:
+                slot.ready.clear()
+            await asyncio.gather(*(
+                self._retire(slot.worker) for slot in self._slots if slot.worker
+            ))
+        try:
+            os.rmdir(self.run_dir)
+        except OSError:
+            pass
+        logger.info(f"Пул обработчиков остановлен: {self.counters()}")
+
+    async def dispatch(self, update: Update) -> Optional[Dict]:
+        """Передача апдейта в процесс пользователя; ответ процесса или None"""
+        user_id = update_sender(update)
+        body = update.model_dump_json(by_alias=True, exclude_none=True)
+        self.dispatched += 1
+        if user_id is None:
+            return await self._feed(SUPPORT_WORKER, None, body)
+
+        loop = asyncio.get_running_loop()
+        previous = self._tails.get(user_id)
+        done = loop.create_future()
+        self._tails[user_id] = done
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            return await self._route(user_id, update, body)
+        finally:
+            done.set_result(None)
+            if self._tails.get(user_id) is done:
+                del self._tails[user_id]
+
+    async def restart(self, index: int, failed: Optional[WorkerProcess] = None) -> bool:
+        """Замена процесса в месте index без потери апдейтов.
+
+        С failed процесс заменяется, только если в месте все еще он: об
+        одном упавшем процессе могут сообщить несколько апдейтов.
+        """
+        async with self._restart_lock:
+            slot = self._slots[index]
+            if self._closing or (failed is not None and slot.worker is not failed):
+                return False
+            worker = self._spawn(slot)
+            await worker.start()
+            if not await worker.wait_healthy():
+                logger.error(f"Новый обработчик {index} не запустился")
+                await worker.stop()
+                return False
+            slot.ready.clear()
+            try:
+                await self._retire(slot.worker)
+                slot.worker = worker
+                await worker.request("POST", "/activate")
+                await self._load_support()
+            except Exception as e:
+                # Новый процесс остается в месте: проверка заменит его снова
+                logger.error(f"Ошибка при замене обработчика {index}: {e}")
+                return False
+            finally:
+                slot.ready.set()
+            self.restarts += 1
+            logger.info(f"Обработчик {index} заменен")
+            return True
+
+    async def restart_all(self):
+        """Поочередная замена всех процессов"""
+        for slot in self._slots:
+            if self._closing:
+                break
+            await self.restart(slot.index)
+
+    def request_restart(self):
+        """Поочередная замена процессов в фоне, например по SIGHUP"""
+        if self._restart_lock is None:
+            # Пул еще не запущен
+            return
+        if self._closing or (self._rolling and not self._rolling.done()):
+            return
+        logger.info("Поочередный перезапуск обработчиков")
+        self._rolling = asyncio.create_task(self.restart_all())
+
+    def signal_workers(self, signum: int):
+        """Отправка сигнала всем работающим процессам, например SIGUSR1"""
+        # Процесс попадает в место только после проверки, то есть когда
+        # его обработчики сигналов уже установлены
+        for slot in self._slots:
+            worker = slot.worker
+            if worker is not None and worker.alive:
+                worker.process.send_signal(signum)
+
+    async def stats(self) -> Dict:
+        """Счетчики пула и ответы процессов на проверку"""
+        workers = {}
+        for slot in self._slots:
+            try:
+                workers[slot.index] = await slot.worker.request("GET", "/health")
+            except Exception as e:
+                workers[slot.index] = {"ok": False, "error": str(e)}
+        return {**self.counters(), "workers": workers}
+
+    def counters(self) -> Dict[str, int]:
+        """Счетчики пула"""
+        return {
+            "dispatched": self.dispatched,
+            "errors": self.errors,
+            "moves": self.moves,
+            "restarts": self.restarts,
+            "support_users": len(self._support),
+        }
+
+    def _spawn(self, slot: WorkerSlot) -> WorkerProcess:
+        slot.generation += 1
+        socket_path = os.path.join(
+            self.run_dir, f"worker-{slot.index}-{slot.generation}.sock"
+        )
+        return WorkerProcess(slot.index, self.command, socket_path)
+
+    async def _retire(self, worker: Optional[WorkerProcess]):
+        """Остановка процесса после ответов на переданные ему апдейты"""
+        if worker is None:
+            return
+        if worker.alive:
+            await worker.drain()
+        await worker.stop()
+
+    async def _load_support(self):
+        """Пользователи с открытыми чатами закрепляются за процессом поддержки"""
+        if self.support_loader is None:
+            return
+        try:
+            users = set(await self.support_loader()) - self.support_users
+        except Exception as e:
+            logger.error(f"Ошибка загрузки пользователей поддержки: {e}")
+            return
+        self._support |= users
+        logger.info(f"Пользователей с открытыми чатами: {len(users)}")
+
+    def _home(self, user_id: int) -> int:
+        """Процесс, в котором сейчас живет состояние пользователя"""
+        if user_id in self.support_users or user_id in self._support:
+            return SUPPORT_WORKER
+        return shard(user_id, self.processes)
+
+    async def _route(self, user_id: int, update: Update, body: str) -> Optional[Dict]:
+        home = self._home(user_id)
+        target = home
+        text = update.message.text if update.message else None
+        if text in self.support_texts:
+            target = SUPPORT_WORKER
+        if target != home and not await self._release(home, user_id):
+            target = home
+
+        result = await self._feed(target, user_id, body)
+        if result is None or user_id in self.support_users:
+            return result
+        if result.get("support"):
+            self._support.add(user_id)
+        else:
+            self._support.discard(user_id)
+        home = self._home(user_id)
+        if home != target and not await self._release(target, user_id):
+            # Состояние не записалось: пользователь остается, где был
+            self._support.add(user_id)
+        return result
+
+    async def _feed(self, index: int, user_id: Optional[int], body: str) -> Optional[Dict]:
+        slot = self._slots[index]
+        params = {"user": user_id} if user_id is not None else {}
+        for attempt in range(2):
+            await slot.ready.wait()
+            worker = slot.worker
+            try:
+                return await worker.request("POST", "/update", body, **params)
+            except ClientConnectorError as e:
+                if attempt == 0:
+                    # Апдейт не доставлен: процесс упал, после замены - повтор
+                    logger.error(f"Обработчик {index} недоступен: {e}")
+                    await self.restart(index, worker)
+                    continue
+                error = e
+            except Exception as e:
+                error = e
+            self.errors += 1
+            logger.error(f"Ошибка передачи апдейта обработчику {index}: {error}")
+            return None
+
+    async def _release(self, index: int, user_id: int) -> bool:
+        """Запись состояния пользователя в базу и очистка его кэша в процессе"""
+        slot = self._slots[index]
+        await slot.ready.wait()
+        try:
+            result = await slot.worker.request("POST", "/release", user=user_id)
+        except Exception as e:
+            logger.error(f"Ошибка освобождения пользователя {user_id}: {e}")
+            return False
+        self.moves += 1
+        return result.get("ok", False)
+
+    async def _watch(self):
+        """Периодическая проверка процессов и перезапуск неисправных"""
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            for slot in self._slots:
+                worker = slot.worker
+                if not slot.ready.is_set() or worker is None:
+                    continue
+                if await worker.healthy():
+                    worker.failures = 0
+                    continue
+                worker.failures += 1
+                if worker.alive and worker.failures < HEALTH_FAILURES:
+                    continue
+                logger.error(
+                    f"Обработчик {slot.index} неисправен, перезапуск"
+                )
+                try:
+                    await self.restart(slot.index, worker)
+                except Exception as e:
+                    logger.error(f"Ошибка перезапуска обработчика {slot.index}: {e}")
+
+
+class ShardingDispatcher(Dispatcher):
+    """Диспетчер супервизора: апдейты не обрабатываются, а уходят в пул"""
+
+    def __init__(self, pool: WorkerPool, update_types: List[str]):
+        super().__init__()
+        self.pool = pool
+        self.update_types = update_types
+
+    def resolve_used_update_types(self, skip_events=None) -> List[str]:
+        return list(self.update_types)
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        return await self.pool.dispatch(update)
+
+
+async def serve_worker(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    socket_path: str,
+    *,
+    index: int,
+    activate: Callable[[], Awaitable[None]],
+    is_support: Callable[[int], Awaitable[bool]],
+    release: Callable[[int], Awaitable[bool]],
+    stats: Optional[Callable[[], Dict]] = None,
+):
+    """Обработчик апдейтов от супервизора на unix-сокете до SIGTERM.
+
+    POST /update обрабатывает апдейт и отвечает support - остается ли
+    пользователь в процессе поддержки; POST /release записывает и
+    забывает состояние пользователя; POST /activate перечитывает общее
+    состояние; GET /health - проверка и счетчики процесса.
+    """
+    counters = {"updates": 0, "errors": 0}
+
+    async def handle_update(request: web.Request) -> web.Response:
+        user = request.query.get("user")
+        update = Update.model_validate(
+            await request.json(loads=bot.session.json_loads), context={"bot": bot}
+        )
+        counters["updates"] += 1
+        try:
+            await dispatcher.feed_update(bot, update)
+        except Exception as e:
+            counters["errors"] += 1
+            logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        support = await is_support(int(user)) if user else False
+        return web.json_response({"support": support})
+
+    async def handle_release(request: web.Request) -> web.Response:
+        return web.json_response({"ok": await release(int(request.query["user"]))})
+
+    async def handle_activate(request: web.Request) -> web.Response:
+        await activate()
+        return web.json_response({"ok": True})
+
+    async def handle_health(request: web.Request) -> web.Response:
+        return web.json_response({
+            "ok": True,
+            "index": index,
+            "pid": os.getpid(),
+            **counters,
+            **(stats() if stats else {}),
+        })
+
+    app = web.Application()
+    app.router.add_post("/update", handle_update)
+    app.router.add_post("/release", handle_release)
+    app.router.add_post("/activate", handle_activate)
+    app.router.add_get("/health", handle_health)
+    # Строка журнала доступа на каждый апдейт стоила бы заметной доли
+    # времени обработки
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+
+    # Остановкой управляет супервизор: Ctrl+C в терминале приходит всей
+    # группе процессов, а SIGTERM - только после передачи апдейтов
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, lambda: None)
+    parent = os.getppid()
+    try:
+        site = web.UnixSite(runner, socket_path)
+        await site.start()
+        logger.info(f"Обработчик {index} слушает {socket_path}")
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), HEALTH_INTERVAL)
+            except asyncio.TimeoutError:
+                # Супервизор завершился аварийно
+                if os.getppid() != parent:
+                    logger.error(f"Супервизор обработчика {index} завершился")
+                    break
+    finally:
+        await runner.cleanup()